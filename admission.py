@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+
+from broadcast import TokenBucket
+
+# Приоритеты запросов к ИИ: меньше — раньше
+SCHEDULED = 0   # плановая рассылка
+ON_DEMAND = 1   # /analyze и другие запросы пользователей
+
+PRIORITY_NAMES = {SCHEDULED: "scheduled", ON_DEMAND: "on_demand"}
+
+
+class Overloaded(Exception):
+    """Запрос отклонен: очередь к ИИ заполнена"""
+
+
+class ChatRateLimiter:
+    """Ведро токенов на каждый чат: не больше rate запросов в секунду с запасом burst.
+
+    Ведро чата, которое успело наполниться, удаляется при очередной чистке:
+    память занимают только чаты, писавшие недавно.
+    """
+
+    def __init__(self, rate, burst=1, sweep_interval=60.0):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.sweep_interval = sweep_interval
+        self.buckets = {}
+        # Чаты, которым уже ответили об ограничении: до конца ограничения они не получают ответов
+        self.notified = set()
+        self.limited = 0
+        self.swept_at = time.monotonic()
+
+    def check(self, chat_id):
+        """None, если запрос чата допущен, иначе через сколько секунд появится токен"""
+        now = time.monotonic()
+        if now - self.swept_at >= self.sweep_interval:
+            self._sweep(now)
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        if bucket.try_acquire():
+            self.notified.discard(chat_id)
+            return None
+        self.limited += 1
+        return (1 - bucket.tokens) / self.rate
+
+    def notify(self, chat_id):
+        """True при первом отклоненном запросе чата с момента последнего допущенного"""
+        if chat_id in self.notified:
+            return False
+        self.notified.add(chat_id)
+        return True
+
+    def _sweep(self, now):
+        full_after = self.burst / self.rate
+        for chat_id in [chat_id for chat_id, bucket in self.buckets.items() if now - bucket.updated >= full_after]:
+            del self.buckets[chat_id]
+            self.notified.discard(chat_id)
+        self.swept_at = now
+
+
+class PriorityLimiter:
+    """Общий лимит одновременных запросов к ИИ с очередью по приоритету.
+
+    Освободившийся слот достается ждущему с наименьшим приоритетом
+    (SCHEDULED раньше ON_DEMAND), при равном — тому, кто ждет дольше.
+    Запросы ON_DEMAND занимают не больше on_demand_limit слотов, чтобы
+    оставшиеся всегда были свободны для рассылки. Если ON_DEMAND-запросов
+    ждет уже max_waiting, новый отклоняется сразу исключением Overloaded;
+    плановые запросы не отклоняются никогда.
+    """
+
+    def __init__(self, limit, on_demand_limit=None, max_waiting=None):
+        self.limit = limit
+        self.on_demand_limit = limit if on_demand_limit is None else min(on_demand_limit, limit)
+        self.max_waiting = max_waiting
+        self.waiters = []
+        self.order = itertools.count()
+        self.active = Counter()
+        self.waiting = Counter()
+        self.shed = Counter()
+
+    def slot(self, priority=ON_DEMAND):
+        """Контекстный менеджер: async with limiter.slot(SCHEDULED): ..."""
+        return _Slot(self, priority)
+
+    async def acquire(self, priority=ON_DEMAND):
+        """Ждет слот; Overloaded, если очередь ON_DEMAND заполнена"""
+        if (priority != SCHEDULED and self.max_waiting is not None
+                and self.waiting[priority] >= self.max_waiting):
+            self.shed[priority] += 1
+            raise Overloaded("очередь запросов к ИИ заполнена")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        self.waiting[priority] += 1
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот выдан, но ждущего уже отменили: отдаем слот следующему
+                self.release(priority)
+            raise
+        finally:
+            self.waiting[priority] -= 1
+
+    def release(self, priority=ON_DEMAND):
+        """Возвращает слот и передает его следующему в очереди"""
+        self.active[priority] -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and sum(self.active.values()) < self.limit:
+            priority, _, future = self.waiters[0]
+            if future.done():
+                # Ждущего отменили
+                heapq.heappop(self.waiters)
+                continue
+            if priority == ON_DEMAND and self.active[ON_DEMAND] >= self.on_demand_limit:
+                # Впереди только ON_DEMAND: оставшиеся слоты ждут рассылку
+                break
+            heapq.heappop(self.waiters)
+            self.active[priority] += 1
+            future.set_result(None)
+
+    def depth(self):
+        """Ждущих запросов по приоритетам: {имя: число}"""
+        return {name: self.waiting[priority] for priority, name in PRIORITY_NAMES.items()}
+
+    def in_flight(self):
+        """Выполняемых запросов по приоритетам: {имя: число}"""
+        return {name: self.active[priority] for priority, name in PRIORITY_NAMES.items()}
+
+    def shed_counts(self):
+        """Отклоненных запросов по приоритетам: {имя: число}"""
+        return {name: self.shed[priority] for priority, name in PRIORITY_NAMES.items()}
+
+
+class _Slot:
+    __slots__ = ("limiter", "priority")
+
+    def __init__(self, limiter, priority):
+        self.limiter = limiter
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.priority)
+
+    async def __aexit__(self, *exc_info):
+        self.limiter.release(self.priority)
@@ -0,0 +1,202 @@
+import bisect
+import logging
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+ABOVE = "above"
+BELOW = "below"
+
+
+def valid_price(threshold):
+    """Конечная положительная цена: порог или цена с NaN сломали бы упорядоченный индекс порогов"""
+    return isinstance(threshold, (int, float)) and math.isfinite(threshold) and threshold > 0
+
+
+@dataclass
+class Alert:
+    """Ценовой алерт: сработает, когда цена монеты пересечет порог"""
+    alert_id: int
+    chat_id: int
+    coin: str
+    threshold: float
+    direction: str
+
+
+class AlertEngine:
+    """Движок ценовых алертов с индексом порогов по монетам.
+
+    Для каждой монеты пороги хранятся в двух отсортированных списках: на рост
+    и на падение. При новой цене все пересеченные пороги находятся бинарным
+    поиском между прошлой и текущей ценой, без перебора всех алертов.
+    Сработавшие алерты удаляются (одноразовые).
+    """
+
+    def __init__(self, path, max_per_chat=20):
+        self.max_per_chat = max_per_chat
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            "alert_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "chat_id INTEGER NOT NULL, "
+            "coin TEXT NOT NULL, "
+            "threshold REAL NOT NULL, "
+            "direction TEXT NOT NULL, "
+            "created_at INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS alerts_chat ON alerts (chat_id)")
+        self._conn.commit()
+        self.alerts = {}
+        # coin -> direction -> отсортированный список (порог, alert_id)
+        self._index = {}
+        self._by_chat = {}
+        self.last_prices = {}
+        self._load()
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def _load(self):
+        """Загружает алерты из базы и строит индекс"""
+        rows = self._conn.execute(
+            "SELECT alert_id, chat_id, coin, threshold, direction FROM alerts"
+        ).fetchall()
+        invalid = [row for row in rows if not valid_price(row[3])]
+        if invalid:
+            # Строки из версий без проверки порога: в индекс они не попадают
+            logger.error(f"Удалены алерты с некорректным порогом: {len(invalid)}")
+            self._delete_rows([Alert(*row) for row in invalid])
+            rows = [row for row in rows if valid_price(row[3])]
+        for row in rows:
+            alert = Alert(*row)
+            self.alerts[alert.alert_id] = alert
+            self._by_chat.setdefault(alert.chat_id, set()).add(alert.alert_id)
+            self._thresholds(alert.coin, alert.direction).append((alert.threshold, alert.alert_id))
+        for directions in self._index.values():
+            for thresholds in directions.values():
+                thresholds.sort()
+        if rows:
+            print(f"🔔 Загружено {len(rows)} алертов")
+
+    def _thresholds(self, coin, direction):
+        directions = self._index.setdefault(coin, {ABOVE: [], BELOW: []})
+        return directions[direction]
+
+    def add(self, chat_id, coin, threshold, current_price):
+        """Добавляет алерт; направление определяется относительно текущей цены"""
+        if not valid_price(threshold):
+            raise ValueError("Порог должен быть положительной ценой")
+        if threshold == current_price:
+            # Направление не определено: такой алерт не сработал бы или сработал сразу
+            raise ValueError(f"Порог совпадает с текущей ценой ${current_price:,.2f}: укажите уровень выше или ниже")
+        if len(self._by_chat.get(chat_id, ())) >= self.max_per_chat:
+            raise ValueError(f"Не больше {self.max_per_chat} алертов на чат")
+        direction = ABOVE if threshold > current_price else BELOW
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO alerts (chat_id, coin, threshold, direction, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chat_id, coin, threshold, direction, int(time.time()))
+            )
+            self._conn.commit()
+        alert = Alert(cursor.lastrowid, chat_id, coin, threshold, direction)
+        self.alerts[alert.alert_id] = alert
+        self._by_chat.setdefault(chat_id, set()).add(alert.alert_id)
+        bisect.insort(self._thresholds(coin, direction), (threshold, alert.alert_id))
+        self.last_prices.setdefault(coin, current_price)
+        return alert
+
+    def remove(self, chat_id, alert_id):
+        """Удаляет алерт чата, возвращает True, если он был"""
+        alert = self.alerts.get(alert_id)
+        if alert is None or alert.chat_id != chat_id:
+            return False
+        thresholds = self._thresholds(alert.coin, alert.direction)
+        position = bisect.bisect_left(thresholds, (alert.threshold, alert_id))
+        if position < len(thresholds) and thresholds[position][1] == alert_id:
+            del thresholds[position]
+        self._forget([alert])
+        self._delete_rows([alert])
+        return True
+
+    def remove_chat(self, chat_id):
+        """Удаляет все алерты чата (например, после отписки)"""
+        for alert in self.for_chat(chat_id):
+            self.remove(chat_id, alert.alert_id)
+
+    def coins(self):
+        """Монеты, по которым есть алерты"""
+        return {alert.coin for alert in self.alerts.values()}
+
+    def for_chat(self, chat_id):
+        """Алерты чата, отсортированные по номеру"""
+        return [self.alerts[alert_id] for alert_id in sorted(self._by_chat.get(chat_id, ()))]
+
+    def _forget(self, alerts):
+        """Удаляет алерты из словарей в памяти"""
+        for alert in alerts:
+            self.alerts.pop(alert.alert_id, None)
+            chat_alerts = self._by_chat.get(alert.chat_id)
+            if chat_alerts is not None:
+                chat_alerts.discard(alert.alert_id)
+                if not chat_alerts:
+                    del self._by_chat[alert.chat_id]
+
+    def _delete_rows(self, alerts):
+        """Удаляет алерты из базы одной транзакцией"""
+        if not alerts:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM alerts WHERE alert_id = ?", ((alert.alert_id,) for alert in alerts)
+            )
+            self._conn.commit()
+
+    def check(self, coin, price):
+        """Возвращает алерты, пересеченные при переходе от прошлой цены к price.
+
+        Меняет только индекс в памяти; записи в базе удаляет check_snapshot.
+        """
+        previous = self.last_prices.get(coin)
+        self.last_prices[coin] = price
+        directions = self._index.get(coin)
+        if previous is None or directions is None or price == previous:
+            return []
+
+        if price > previous:
+            # Рост: пороги в диапазоне (previous, price]
+            thresholds = directions[ABOVE]
+            lo = bisect.bisect_right(thresholds, (previous, float('inf')))
+            hi = bisect.bisect_right(thresholds, (price, float('inf')))
+        else:
+            # Падение: пороги в диапазоне [price, previous)
+            thresholds = directions[BELOW]
+            lo = bisect.bisect_left(thresholds, (price, -1))
+            hi = bisect.bisect_left(thresholds, (previous, -1))
+        if lo >= hi:
+            return []
+
+        triggered = [self.alerts[alert_id] for _, alert_id in thresholds[lo:hi]]
+        del thresholds[lo:hi]
+        self._forget(triggered)
+        return triggered
+
+    def check_snapshot(self, snapshot):
+        """Проверяет алерты по всем монетам снимка CoinGecko.
+
+        Возвращает список пар (алерт, цена); сработавшие алерты удаляются
+        из базы одной транзакцией уже после проверки всех монет.
+        """
+        triggered = []
+        for coin, data in snapshot.items():
+            price = data.get('usd') if isinstance(data, dict) else None
+            if valid_price(price):
+                triggered.extend((alert, price) for alert in self.check(coin, price))
+        self._delete_rows([alert for alert, _ in triggered])
+        return triggered
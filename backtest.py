@@ -0,0 +1,580 @@
+"""Проигрывание истории цен через конвейер анализа бота.
+
+Читает исторические цены из CSV (или Parquet, если установлен pandas с
+pyarrow), считает индикаторы векторно по всему ряду и в каждой точке
+решения (по умолчанию раз в час) прогоняет тот же конвейер, что и
+/analyze: снимок → промпт → ИИ → сообщение. ИИ подменяется заглушкой
+(по умолчанию) или настоящим ProxyAPI с кэшем ответов на диске.
+Результат — лента сигналов и статистика доходности и точности по монетам.
+
+    python backtest.py prices.csv
+    python backtest.py btc.csv eth.csv --step 900 --timeline signals.csv --output report.json
+    python backtest.py prices.csv --llm api --llm-cache replay_llm.json
+
+Форматы CSV:
+* широкий — `timestamp,bitcoin,ethereum,...` (цена каждой монеты в своей колонке);
+* длинный — `timestamp,coin,price` (или `symbol`, `close`);
+* OHLC — `timestamp,open,high,low,close[,volume]`, монета — из --coin или имени файла.
+Время — секунды или миллисекунды Unix либо дата ISO 8601 (UTC).
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from history import EMA_PERIOD, RSI_PERIOD, SMA_WINDOW, VOLATILITY_WINDOW
+
+logger = logging.getLogger(__name__)
+
+TIME_COLUMNS = ("timestamp", "time", "date", "datetime", "open_time")
+PRICE_COLUMNS = ("close", "price", "usd")
+COIN_COLUMNS = ("coin", "symbol", "asset")
+# Колонки OHLC, которые не являются монетами в широком формате
+SKIP_COLUMNS = ("open", "high", "low", "volume", "quote_volume", "trades")
+
+BUY = 1
+SELL = -1
+HOLD = 0
+
+# Основы слов, по которым комментарий ИИ относится к росту или падению
+BULLISH_WORDS = ("рост", "растет", "вверх", "отскок", "быч", "покуп", "восходящ", "укрепл")
+BEARISH_WORDS = ("паден", "снижен", "вниз", "коррекц", "медвеж", "продаж", "нисходящ", "ослабл")
+
+
+def parse_time(value):
+    """Время из CSV в секундах Unix: число (с или мс) либо дата ISO 8601"""
+    try:
+        number = float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+    # Миллисекунды (Binance и подобные выгрузки)
+    return number / 1000 if number > 1e11 else number
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _default_coin(path):
+    name = os.path.basename(path)
+    return re.split(r"[._-]", name, 1)[0].lower()
+
+
+def load_csv(path, coin=None):
+    """Читает CSV с ценами: {монета: (времена, цены)} в хронологическом порядке"""
+    with _open_text(path) as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader)]
+        time_index = next((header.index(name) for name in TIME_COLUMNS if name in header), 0)
+        coin_index = next((header.index(name) for name in COIN_COLUMNS if name in header), None)
+        price_index = next((header.index(name) for name in PRICE_COLUMNS if name in header), None)
+
+        columns = {}
+        if coin_index is not None:
+            # Длинный формат: монета в отдельной колонке
+            if price_index is None:
+                raise ValueError(f"{path}: нет колонки с ценой ({', '.join(PRICE_COLUMNS)})")
+            for row in reader:
+                if not row:
+                    continue
+                times, prices = columns.setdefault(row[coin_index].strip().lower(), ([], []))
+                times.append(parse_time(row[time_index]))
+                prices.append(float(row[price_index]))
+        elif price_index is not None:
+            # OHLC или пара время-цена одной монеты
+            times, prices = columns.setdefault(coin or _default_coin(path), ([], []))
+            for row in reader:
+                if row:
+                    times.append(parse_time(row[time_index]))
+                    prices.append(float(row[price_index]))
+        else:
+            # Широкий формат: каждая колонка — монета
+            coins = [(i, name) for i, name in enumerate(header) if i != time_index and name not in SKIP_COLUMNS]
+            for _, name in coins:
+                columns[name] = ([], [])
+            for row in reader:
+                if not row:
+                    continue
+                timestamp = parse_time(row[time_index])
+                for i, name in coins:
+                    if row[i].strip():
+                        columns[name][0].append(timestamp)
+                        columns[name][1].append(float(row[i]))
+    return {name: _as_series(times, prices) for name, (times, prices) in columns.items() if times}
+
+
+def load_parquet(path, coin=None):
+    """Читает Parquet через pandas (нужен pyarrow или fastparquet) в том же виде, что load_csv"""
+    try:
+        import pandas
+    except ImportError:
+        raise ValueError("Для чтения Parquet нужен pandas с pyarrow: pip install pandas pyarrow")
+    frame = pandas.read_parquet(path)
+    frame.columns = [str(name).lower() for name in frame.columns]
+    time_column = next((name for name in TIME_COLUMNS if name in frame.columns), frame.columns[0])
+    times = frame[time_column]
+    if pandas.api.types.is_datetime64_any_dtype(times):
+        seconds = times.astype("int64").to_numpy() / 1e9
+    else:
+        seconds = times.astype(float).to_numpy()
+        seconds = seconds / 1000 if len(seconds) and seconds.max() > 1e11 else seconds
+    coin_column = next((name for name in COIN_COLUMNS if name in frame.columns), None)
+    price_column = next((name for name in PRICE_COLUMNS if name in frame.columns), None)
+    if coin_column and price_column:
+        return {
+            str(name).lower(): _as_series(seconds[mask], frame[price_column].to_numpy()[mask])
+            for name in frame[coin_column].unique()
+            for mask in [(frame[coin_column] == name).to_numpy()]
+        }
+    if price_column:
+        return {coin or _default_coin(path): _as_series(seconds, frame[price_column].to_numpy())}
+    return {
+        name: _as_series(seconds[mask], frame[name].to_numpy()[mask])
+        for name in frame.columns if name != time_column and name not in SKIP_COLUMNS
+        for mask in [frame[name].notna().to_numpy()]
+    }
+
+
+def _as_series(times, prices):
+    """Массивы NumPy, отсортированные по времени, без повторяющихся отметок"""
+    times = np.asarray(times, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    order = np.argsort(times, kind="stable")
+    times, prices = times[order], prices[order]
+    # Из повторов времени остается последняя цена
+    keep = np.append(times[1:] != times[:-1], True)
+    valid = keep & (prices > 0)
+    return times[valid], prices[valid]
+
+
+def load_prices(paths, coin=None):
+    """Читает несколько файлов и объединяет ряды по монетам"""
+    series = {}
+    for path in paths:
+        loader = load_parquet if path.endswith((".parquet", ".pq")) else load_csv
+        for name, (times, prices) in loader(path, coin).items():
+            if name in series:
+                times = np.concatenate([series[name][0], times])
+                prices = np.concatenate([series[name][1], prices])
+                times, prices = _as_series(times, prices)
+            series[name] = (times, prices)
+    return series
+
+
+def ewm_series(values, alpha, initial=None):
+    """Экспоненциальное среднее на каждом шаге: y[i] = y[i-1] + alpha * (x[i] - y[i-1]).
+
+    Без initial ряд начинается с values[0], как CoinSeries. Рекурсия считается
+    блоками: внутри блока она раскрывается в накопленную сумму со степенями
+    (1 - alpha), длина блока ограничена, чтобы степени не теряли точность.
+    """
+    values = np.asarray(values, dtype=float)
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1 - alpha
+    if decay <= 0:
+        out[:] = values
+        return out
+    start = 0
+    previous = initial
+    if previous is None:
+        out[0] = previous = values[0]
+        start = 1
+    # (1 - alpha)^-block не больше 1e12
+    block = max(1, int(12 * math.log(10) / -math.log(decay)))
+    steps = np.arange(block, dtype=float)
+    inverse = decay ** -steps
+    forward = decay ** steps
+    while start < len(values):
+        chunk = values[start:start + block]
+        size = len(chunk)
+        smoothed = decay * forward[:size] * previous + alpha * forward[:size] * np.cumsum(chunk * inverse[:size])
+        out[start:start + size] = smoothed
+        previous = smoothed[-1]
+        start += size
+    return out
+
+
+def rolling_max(values, window):
+    """Максимум по скользящему окну (включая текущий отсчет) за O(n): алгоритм ван Херка — Гил-Вермана"""
+    count = len(values)
+    if window >= count:
+        return np.maximum.accumulate(values)
+    padded = np.concatenate([values, np.full((-count) % window, -np.inf)]).reshape(-1, window)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()[:count]
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()[:count]
+    out = prefix.copy()
+    out[window - 1:] = np.maximum(suffix[:count - window + 1], prefix[window - 1:])
+    return out
+
+
+def indicator_series(prices, capacity=1000, sma_window=SMA_WINDOW, ema_period=EMA_PERIOD,
+                     rsi_period=RSI_PERIOD, volatility_window=VOLATILITY_WINDOW):
+    """Индикаторы CoinSeries на каждом отсчете ряда, посчитанные векторно.
+
+    Значения совпадают с тем, что вернул бы CoinSeries.indicators() после
+    добавления отсчетов по одному; недоступные RSI и волатильность — NaN.
+    """
+    prices = np.asarray(prices, dtype=float)
+    count = len(prices)
+    index = np.arange(count)
+    capacity = max(capacity, sma_window + 1, volatility_window + 2)
+
+    price_sums = np.concatenate([[0.0], np.cumsum(prices)])
+    sma_count = np.minimum(index + 1, sma_window)
+    sma = (price_sums[index + 1] - price_sums[index + 1 - sma_count]) / sma_count
+
+    ema = ewm_series(prices, 2 / (ema_period + 1))
+
+    rsi = np.full(count, np.nan)
+    changes = np.diff(prices)
+    if len(changes) >= rsi_period:
+        averages = []
+        for moves in (np.maximum(changes, 0.0), np.maximum(-changes, 0.0)):
+            # Первые rsi_period изменений — простое среднее, дальше сглаживание Уайлдера
+            average = np.empty(len(moves))
+            average[:rsi_period] = np.cumsum(moves[:rsi_period]) / np.arange(1, rsi_period + 1)
+            average[rsi_period:] = ewm_series(moves[rsi_period:], 1 / rsi_period, initial=average[rsi_period - 1])
+            averages.append(average)
+        gain, loss = averages
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        rsi[rsi_period:] = value[rsi_period - 1:]
+
+    volatility = np.full(count, np.nan)
+    if count > 2:
+        # Волатильность есть, когда в окне хотя бы две доходности
+        returns = np.diff(np.log(prices))
+        return_sums = np.concatenate([[0.0], np.cumsum(returns)])
+        square_sums = np.concatenate([[0.0], np.cumsum(returns * returns)])
+        tail = index[2:]
+        returns_count = np.minimum(tail, volatility_window)
+        mean = (return_sums[tail] - return_sums[tail - returns_count]) / returns_count
+        variance = (square_sums[tail] - square_sums[tail - returns_count]) / returns_count - mean * mean
+        volatility[2:] = np.sqrt(np.maximum(variance, 0.0)) * 100
+
+    drawdown = (prices / rolling_max(prices, capacity) - 1) * 100
+    return {
+        'samples': np.minimum(index + 1, capacity),
+        'sma': sma,
+        'ema': ema,
+        'rsi': rsi,
+        'volatility': volatility,
+        'drawdown': drawdown,
+    }
+
+
+def change_24h(times, prices):
+    """Изменение цены за 24 часа в процентах (0, пока истории меньше суток)"""
+    previous = np.searchsorted(times, times - 86400, side="right") - 1
+    change = np.zeros(len(prices))
+    known = previous >= 0
+    change[known] = (prices[known] / prices[previous[known]] - 1) * 100
+    return change
+
+
+def rule_signal(price, indicators):
+    """Сигнал по индикаторам: цена выше EMA без перекупленности — покупка, ниже без перепроданности — продажа"""
+    rsi = indicators.get('rsi')
+    if price > indicators['ema'] and (rsi is None or rsi < 70):
+        return BUY
+    if price < indicators['ema'] and (rsi is None or rsi > 30):
+        return SELL
+    return HOLD
+
+
+def commentary_signal(text, coin):
+    """Сигнал из комментария ИИ по словам о росте и падении в предложениях о монете"""
+    sentences = [sentence.lower() for sentence in re.split(r"[.!?\n]+", text) if sentence.strip()]
+    about_coin = [sentence for sentence in sentences if coin.lower() in sentence]
+    score = 0
+    for sentence in about_coin or sentences:
+        score += sum(word in sentence for word in BULLISH_WORDS)
+        score -= sum(word in sentence for word in BEARISH_WORDS)
+    return BUY if score > 0 else SELL if score < 0 else HOLD
+
+
+class StubLLM:
+    """Заглушка ИИ для офлайн-прогонов: короткий комментарий по таблице из промпта.
+
+    Интерфейс как у AIClient.complete, ответ в формате chat/completions.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, prompt, max_tokens=200):
+        self.calls += 1
+        lines = [line for line in prompt.splitlines() if "|" in line]
+        header = lines[0].split("|") if lines else []
+        sentences = []
+        for line in lines[1:]:
+            row = dict(zip(header, line.split("|")))
+            coin = row.get("coin", "")
+            rsi = _number(row.get("rsi"))
+            price, ema, change = _number(row.get("price")), _number(row.get("ema")), _number(row.get("24h%"))
+            if rsi is not None and rsi >= 70:
+                sentences.append(f"{coin} перекуплен (RSI {rsi:.0f}), вероятна коррекция вниз")
+            elif rsi is not None and rsi <= 30:
+                sentences.append(f"{coin} перепродан (RSI {rsi:.0f}), возможен отскок вверх")
+            elif price is not None and ema is not None:
+                trend = "восходящий тренд, рост продолжается" if price > ema else "нисходящий тренд, снижение продолжается"
+                sentences.append(f"{coin} {'выше' if price > ema else 'ниже'} EMA: {trend}")
+            elif change is not None:
+                sentences.append(f"{coin} {'рост' if change > 0 else 'снижение'} за сутки {change:+.2f}%")
+        content = ". ".join(sentences) + "." if sentences else "Рынок без выраженного направления."
+        return {"choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CachedLLM:
+    """Кэш ответов ИИ на диске по хешу промпта: повторный прогон не платит за запросы"""
+
+    def __init__(self, llm, path):
+        self.llm = llm
+        self.path = path
+        self.hits = 0
+        self.answers = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.answers = json.load(f)
+
+    async def complete(self, prompt, max_tokens=200):
+        key = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        if key in self.answers:
+            self.hits += 1
+            return self.answers[key]
+        result = await self.llm.complete(prompt, max_tokens=max_tokens)
+        self.answers[key] = result
+        return result
+
+    def save(self):
+        """Сохраняет кэш (атомарной заменой файла)"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.answers, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def signal_stats(prices, signals, fee=0.0):
+    """Доходность и точность сигналов: позиция держится до следующей точки решения"""
+    prices = np.asarray(prices, dtype=float)
+    signals = np.asarray(signals, dtype=float)
+    if len(prices) < 2:
+        return None
+    returns = prices[1:] / prices[:-1] - 1
+    positions = signals[:-1]
+    turnover = np.abs(np.diff(np.concatenate([[0.0], positions])))
+    equity = np.cumprod(1 + positions * returns - fee * turnover)
+    active = positions != 0
+    hits = np.sign(returns[active]) == positions[active]
+    return {
+        "return_pct": round(float(equity[-1] - 1) * 100, 2),
+        "buy_hold_pct": round(float(prices[-1] / prices[0] - 1) * 100, 2),
+        "max_drawdown_pct": round(float((equity / np.maximum.accumulate(equity) - 1).min()) * 100, 2),
+        "accuracy_pct": round(float(hits.mean()) * 100, 2) if active.any() else None,
+        "trades": int(np.count_nonzero(turnover)),
+        "buy": int(np.count_nonzero(positions == BUY)),
+        "sell": int(np.count_nonzero(positions == SELL)),
+    }
+
+
+async def replay(series, llm, step=3600, capacity=1000, budget=400, model=None, fee=0.0):
+    """Проигрывает ряды {монета: (времена, цены)} через конвейер анализа.
+
+    В каждой точке решения (раз в step секунд) строит снимок в формате
+    fetch_crypto_data с индикаторами, получает анализ (с кэшем по данным,
+    как у бота), формирует сообщение и извлекает сигналы. Возвращает
+    (лента сигналов, отчет).
+    """
+    from prompt import PromptBuilder
+    from working_bot import analysis_cache_key, format_analysis_message, is_analysis_ok, round_indicators
+
+    started = time.perf_counter()
+    columns = {}
+    for coin, (times, prices) in series.items():
+        columns[coin] = (times, prices, indicator_series(prices, capacity), change_24h(times, prices))
+    indicators_s = time.perf_counter() - started
+
+    first = max(times[0] for times, *_ in columns.values())
+    last = min(times[-1] for times, *_ in columns.values())
+    if last < first:
+        raise ValueError("Ряды монет не пересекаются по времени")
+    grid = np.arange(math.ceil(first / step) * step, last + 1, step, dtype=float)
+    # Значения каждой монеты в точках решения: последний отсчет не позже точки
+    points = {}
+    for coin, (times, prices, indicators, changes) in columns.items():
+        at = np.searchsorted(times, grid, side="right") - 1
+        points[coin] = {
+            'usd': prices[at].tolist(),
+            'usd_24h_change': changes[at].tolist(),
+            'last_updated_at': times[at].astype(int).tolist(),
+            'indicators': {name: values[at].tolist() for name, values in indicators.items()},
+        }
+
+    builder = PromptBuilder(budget, priority=list(series), model=model)
+    analyses = {}
+    timeline = []
+    message_chars = 0
+    started = time.perf_counter()
+    for point, moment in enumerate(grid.tolist()):
+        data = {}
+        for coin, values in points.items():
+            data[coin] = {
+                'usd': values['usd'][point],
+                'usd_24h_change': values['usd_24h_change'][point],
+                'last_updated_at': values['last_updated_at'][point],
+                'indicators': round_indicators({
+                    name: None if math.isnan(series_values[point]) else series_values[point]
+                    for name, series_values in values['indicators'].items()
+                }),
+            }
+
+        # Тот же ключ кэша, что у бота: одинаковые данные не анализируются дважды
+        key = analysis_cache_key(data)
+        analysis = analyses.get(key)
+        if analysis is None:
+            prompt, _, _ = builder.build(data)
+            try:
+                result = await llm.complete(prompt, max_tokens=200)
+                analysis = result.get('choices', [{}])[0].get('message', {}).get('content', 'Ошибка анализа')
+            except Exception as e:
+                analysis = f"Ошибка анализа: {e}"
+                logger.error(f"Ошибка анализа в точке {moment}: {e}")
+            if is_analysis_ok(analysis):
+                analyses[key] = analysis
+        message_chars += len(format_analysis_message(data, analysis))
+
+        for coin, coin_data in data.items():
+            timeline.append({
+                'time': moment,
+                'coin': coin,
+                'price': coin_data['usd'],
+                'rsi': coin_data['indicators']['rsi'],
+                'ema': coin_data['indicators']['ema'],
+                'rule': rule_signal(coin_data['usd'], coin_data['indicators']),
+                'ai': commentary_signal(analysis, coin) if is_analysis_ok(analysis) else HOLD,
+            })
+    pipeline_s = time.perf_counter() - started
+
+    coins = {}
+    for coin in columns:
+        rows = [row for row in timeline if row['coin'] == coin]
+        prices = [row['price'] for row in rows]
+        coins[coin] = {
+            "samples": int(len(columns[coin][1])),
+            "rule": signal_stats(prices, [row['rule'] for row in rows], fee),
+            "ai": signal_stats(prices, [row['ai'] for row in rows], fee),
+        }
+    report = {
+        "from": datetime.fromtimestamp(grid[0], timezone.utc).isoformat() if len(grid) else None,
+        "to": datetime.fromtimestamp(grid[-1], timezone.utc).isoformat() if len(grid) else None,
+        "step_s": step,
+        "decisions": int(len(grid)),
+        "analyses": len(analyses),
+        "message_chars": message_chars,
+        "indicators_s": round(indicators_s, 3),
+        "pipeline_s": round(pipeline_s, 3),
+        "decisions_per_s": round(len(grid) / pipeline_s, 1) if pipeline_s > 0 else None,
+        "coins": coins,
+    }
+    return timeline, report
+
+
+def write_timeline(path, timeline):
+    """Сохраняет ленту сигналов в CSV"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time", "coin", "price", "rsi", "ema", "rule", "ai"])
+        for row in timeline:
+            writer.writerow([
+                datetime.fromtimestamp(row['time'], timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                row['coin'], row['price'], "" if row['rsi'] is None else row['rsi'], row['ema'],
+                row['rule'], row['ai'],
+            ])
+
+
+def make_llm(args):
+    """ИИ для прогона: заглушка или ProxyAPI из .env, при необходимости с кэшем на диске"""
+    if args.llm == "api":
+        from dotenv import load_dotenv
+        from clients import AIClient
+        load_dotenv()
+        llm = AIClient(os.getenv("PROXYAPI_URL"), os.getenv("PROXYAPI_KEY"), args.model)
+    else:
+        llm = StubLLM()
+    return CachedLLM(llm, args.llm_cache) if args.llm_cache else llm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="файлы CSV (можно .csv.gz) или Parquet")
+    parser.add_argument("--coin", help="монета для файлов с одной ценой (по умолчанию — из имени файла)")
+    parser.add_argument("--step", type=int, default=3600, help="шаг точек решения, с (по умолчанию: час)")
+    parser.add_argument("--capacity", type=int, default=int(os.getenv("PRICE_HISTORY_SIZE", "1000")),
+                        help="размер буфера истории, как PRICE_HISTORY_SIZE бота")
+    parser.add_argument("--budget", type=int, default=int(os.getenv("PROMPT_TOKEN_BUDGET", "400")))
+    parser.add_argument("--model", default=os.getenv("AI_MODEL", "gpt-3.5-turbo"))
+    parser.add_argument("--llm", choices=("stub", "api"), default="stub")
+    parser.add_argument("--llm-cache", help="файл кэша ответов ИИ между прогонами")
+    parser.add_argument("--fee", type=float, default=0.001, help="комиссия за смену позиции (доля)")
+    parser.add_argument("--timeline", help="CSV для ленты сигналов")
+    parser.add_argument("--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("❌ Для бэктеста нужен NumPy: pip install numpy")
+
+    started = time.perf_counter()
+    series = load_prices(args.paths, args.coin)
+    if not series:
+        sys.exit("❌ В файлах нет цен")
+    load_s = time.perf_counter() - started
+    print(f"📂 Загружено {sum(len(prices) for _, prices in series.values())} цен по монетам: "
+          f"{', '.join(series)} за {load_s:.2f} с", file=sys.stderr)
+
+    llm = make_llm(args)
+    timeline, report = asyncio.run(replay(series, llm, args.step, args.capacity, args.budget, args.model, args.fee))
+    if isinstance(llm, CachedLLM):
+        llm.save()
+        report["llm_cache_hits"] = llm.hits
+    report = {"load_s": round(load_s, 3), **report}
+
+    if args.timeline:
+        write_timeline(args.timeline, timeline)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
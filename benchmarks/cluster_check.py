@@ -0,0 +1,148 @@
+"""Локальная проверка шардированной рассылки: смена лидера и доставка ровно один раз.
+
+Запускает заглушки и --workers процессов `working_bot.py --worker` на общей
+временной базе с --chats подписчиками, публикует тик (как это делает лидер),
+через --kill-after секунд останавливает лидера сигналом --signal и ждет, пока
+остальные воркеры доставят все шарды. По счетчику заглушки Telegram проверяет,
+что каждый чат получил сообщение ровно один раз и что выбран новый лидер.
+
+    python benchmarks/cluster_check.py
+    python benchmarks/cluster_check.py --workers 4 --chats 50000 --signal KILL
+
+При SIGTERM воркер дожидается начатых отправок и записывает прогресс, поэтому
+повторов быть не должно. При SIGKILL повторно могут уйти только сообщения,
+отправленные после последней записи прогресса: отправки в полете и исходы одной
+незаписанной транзакции, не больше удвоенного числа одновременных отправок воркера.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_servers import add_arguments, serve_forever  # noqa: E402
+from cluster import DONE, ClusterCoordinator  # noqa: E402
+from subscribers import SQLiteSubscriberStore  # noqa: E402
+
+INTERVAL = 3600
+CONCURRENCY = 50
+
+
+def wait_for(condition, timeout, step=0.2):
+    """Ждет, пока condition() не вернет истину; возвращает ее значение или None"""
+    give_up_at = time.monotonic() + timeout
+    while time.monotonic() < give_up_at:
+        value = condition()
+        if value:
+            return value
+        time.sleep(step)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=5000)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--lease", type=float, default=3.0, help="CLUSTER_LEASE_SECONDS воркеров")
+    parser.add_argument("--kill-after", type=float, default=1.0, help="через сколько секунд после тика остановить лидера")
+    parser.add_argument("--signal", choices=("TERM", "KILL"), default="TERM")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.set_defaults(telegram_latency=0.005)
+    args = parser.parse_args()
+
+    urls_queue = multiprocessing.Queue()
+    servers = multiprocessing.Process(target=serve_forever, args=(args, urls_queue), daemon=True)
+    servers.start()
+    urls = urls_queue.get(timeout=30)
+
+    workdir = tempfile.mkdtemp(prefix="tradebot-cluster-")
+    db_path = os.path.join(workdir, "subscribers.db")
+    store = SQLiteSubscriberStore(db_path, default_interval=INTERVAL)
+    with store.batch():
+        for chat_id in range(1, args.chats + 1):
+            store.add(chat_id, "bench")
+    store.close()
+
+    env = dict(
+        os.environ, **urls,
+        TELEGRAM_TOKEN="123456:CLUSTER",
+        PROXYAPI_KEY="benchmark",
+        SUBSCRIBERS_DB=db_path,
+        PRICE_HISTORY_FILE=os.path.join(workdir, "price_history.json"),
+        TELEGRAM_RATE_LIMIT="1000000",
+        BROADCAST_CONCURRENCY=str(CONCURRENCY),
+        CLUSTER_ENABLED="true",
+        CLUSTER_SHARDS=str(args.shards),
+        CLUSTER_LEASE_SECONDS=str(args.lease),
+        CLUSTER_POLL_INTERVAL="0.5",
+        # Тик публикует сама проверка, плановые рассылки воркеров не нужны
+        SCHEDULER_ENABLED="false",
+        METRICS_PORT="0",
+    )
+    workers = {}
+    for index in range(args.workers):
+        worker_id = f"worker-{index}"
+        workers[worker_id] = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "working_bot.py"), "--worker"],
+            env={**env, "CLUSTER_WORKER_ID": worker_id}, cwd=workdir,
+            stdout=open(os.path.join(workdir, f"{worker_id}.log"), "w"), stderr=subprocess.STDOUT
+        )
+
+    coordinator = ClusterCoordinator(db_path, worker_id="cluster-check", shards=args.shards)
+    telegram = httpx.Client(base_url=urls["TELEGRAM_API_URL"])
+    report = {"workers": args.workers, "chats": args.chats, "shards": args.shards, "signal": args.signal,
+              # Там же логи воркеров worker-N.log
+              "workdir": workdir}
+    try:
+        old_leader = wait_for(coordinator.leader, 30)
+        report["leader_before"] = old_leader
+        tick_id = f"{INTERVAL}:{int(time.time())}"
+        started = time.monotonic()
+        coordinator.publish(tick_id, INTERVAL, "cluster check")
+
+        time.sleep(args.kill_after)
+        workers[old_leader].send_signal(getattr(signal, f"SIG{args.signal}"))
+        workers[old_leader].wait(timeout=60)
+        report["progress_at_kill"] = coordinator.progress(tick_id)
+
+        report["leader_after"] = wait_for(
+            lambda: (lambda leader: leader if leader not in (None, old_leader) else None)(coordinator.leader()),
+            args.lease * 3
+        )
+        done = wait_for(lambda: coordinator.progress(tick_id).get(DONE) == args.shards, args.timeout)
+        report["elapsed_s"] = round(time.monotonic() - started, 3)
+        report["progress"] = coordinator.progress(tick_id)
+        report["telegram"] = telegram.get("/stats").json()
+        # Отправки в полете и исходы, накопленные за одну незаписанную транзакцию
+        report["max_duplicates"] = 0 if args.signal == "TERM" else 2 * CONCURRENCY
+        report["ok"] = bool(
+            done
+            and report["leader_after"]
+            and report["telegram"]["chats"] == args.chats
+            and report["telegram"]["duplicates"] <= report["max_duplicates"]
+        )
+    finally:
+        for process in workers.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in workers.values():
+            process.wait(timeout=60)
+        servers.terminate()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
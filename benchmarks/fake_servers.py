@@ -0,0 +1,400 @@
+"""Локальные заглушки Telegram Bot API, CoinGecko simple/price, CoinCap assets и ProxyAPI.
+
+Минимальный HTTP/1.1 сервер на asyncio с keep-alive: хватает, чтобы выдерживать
+десятки тысяч запросов в секунду от бенчмарка. У каждой заглушки настраиваются
+задержка, доля ошибок 5xx и лимит запросов в секунду (сверх лимита — 429).
+Заглушка ProxyAPI на запрос с "stream": true отвечает потоком SSE за то же
+общее время: первое слово через STREAM_FIRST_CHUNK_SHARE задержки, остальные
+равномерно за оставшееся время.
+
+    python benchmarks/fake_servers.py --telegram-latency 0.05 --ai-latency 1.5
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+# Доля задержки ИИ до первого фрагмента потокового ответа
+STREAM_FIRST_CHUNK_SHARE = 0.2
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Behaviour:
+    """Задержка, доля ошибок и лимит запросов одной заглушки"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.tokens = rate_limit
+        self.updated = time.monotonic()
+        self.requests = 0
+
+    def rate_limited(self):
+        """Проверяет лимит запросов (ведро токенов)"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return False
+        return True
+
+    async def apply(self, latency=None):
+        """Возвращает код ошибки (429/503) или None, предварительно выждав задержку"""
+        self.requests += 1
+        if self.rate_limited():
+            return 429
+        latency = self.latency if latency is None else latency
+        if latency:
+            await asyncio.sleep(latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return 503
+        return None
+
+
+class FakeServer:
+    """Базовый HTTP-сервер: разбирает запросы и отдает JSON"""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.server = None
+
+    async def handle_request(self, method, target, headers, body):
+        """Возвращает (статус, JSON, дополнительные заголовки); вместо JSON — асинхронный итератор строк SSE"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Счетчики заглушки для GET /stats"""
+        return {"requests": self.behaviour.requests}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if target.split('?', 1)[0] == "/stats":
+                    status, payload, extra_headers = 200, self.stats(), {}
+                else:
+                    status, payload, extra_headers = await self.handle_request(method, target, headers, body)
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}"]
+                head += [f"{name}: {value}" for name, value in extra_headers.items()]
+                if hasattr(payload, "__aiter__"):
+                    head += ["Content-Type: text/event-stream", "Transfer-Encoding: chunked"]
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+                    async for event in payload:
+                        data = f"data: {event}\n\n".encode()
+                        writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                    continue
+                data = json.dumps(payload).encode()
+                head += ["Content-Type: application/json", f"Content-Length: {len(data)}"]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Запускает сервер и возвращает его порт"""
+        self.server = await asyncio.start_server(self._handle_connection, host, port, backlog=4096)
+        return self.server.sockets[0].getsockname()[1]
+
+
+class FakeTelegram(FakeServer):
+    """Заглушка Telegram Bot API: getMe, getUpdates, sendMessage и прочие методы отвечают ok.
+
+    GET /stats возвращает число доставленных сообщений и повторных доставок в один чат,
+    число отправленных картинок (photos) и сколько из них загружено файлом (uploads),
+    а для чатов, от имени которых через POST /updates отправлены сообщения боту, —
+    время каждого ответа бота.
+    """
+
+    def __init__(self, behaviour):
+        super().__init__(behaviour)
+        self.message_id = 0
+        self.delivered = Counter()
+        self.edits = 0
+        self.photos = 0
+        self.uploads = 0
+        self.update_id = 0
+        self.updates = []
+        self.updates_ready = asyncio.Event()
+        self.replies = {}
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "messages": sum(self.delivered.values()),
+            "chats": len(self.delivered),
+            "duplicates": sum(count - 1 for count in self.delivered.values() if count > 1),
+            "edits": self.edits,
+            "photos": self.photos,
+            "uploads": self.uploads,
+            "replies": self.replies,
+        }
+
+    def push_update(self, chat_id, text, date=None):
+        """Ставит в очередь getUpdates сообщение пользователя chat_id"""
+        self.update_id += 1
+        self.message_id += 1
+        self.replies.setdefault(chat_id, [])
+        self.updates.append({
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.message_id, "date": int(date or time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"user{chat_id}"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                if text.startswith("/") else [],
+            },
+        })
+        self.updates_ready.set()
+        return self.update_id
+
+    async def get_updates(self, params):
+        """getUpdates: подтверждает обновления до offset и ждет новых не дольше timeout"""
+        offset = int(params.get("offset") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self.updates_ready.clear()
+            try:
+                await asyncio.wait_for(self.updates_ready.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates
+
+    async def handle_request(self, method, target, headers, body):
+        if target.split('?', 1)[0] == "/stats/reset":
+            self.delivered.clear()
+            self.edits = 0
+            self.photos = self.uploads = 0
+            self.replies = {chat_id: [] for chat_id in self.replies}
+            return 200, {"ok": True}, {}
+        if target.split('?', 1)[0] == "/updates":
+            params = parse_body(headers, body)
+            update_id = self.push_update(int(params["chat_id"]), params["text"], params.get("date"))
+            return 200, {"ok": True, "result": update_id}, {}
+        error = await self.behaviour.apply()
+        if error == 429:
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                         "parameters": {"retry_after": 1}}, {}
+        if error:
+            return error, {"ok": False, "error_code": error, "description": "Fake error"}, {}
+
+        api_method = target.rsplit('/', 1)[-1].split('?', 1)[0]
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench",
+                                                "username": "bench_bot"}}, {}
+        if api_method == "getUpdates":
+            return 200, {"ok": True, "result": await self.get_updates(parse_body(headers, body))}, {}
+        if api_method == "sendMessage":
+            params = parse_body(headers, body)
+            self.message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            self.delivered[chat_id] += 1
+            if chat_id in self.replies:
+                self.replies[chat_id].append(time.time())
+            message = {"message_id": self.message_id, "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                       "text": params.get("text", "")}
+            return 200, {"ok": True, "result": message}, {}
+        if api_method == "sendPhoto":
+            params = parse_body(headers, body)
+            self.message_id += 1
+            self.photos += 1
+            file_id = params.get("photo")
+            if not file_id:
+                # Картинка пришла файлом: выдаем ей новый file_id
+                self.uploads += 1
+                file_id = f"photo-{self.uploads}"
+            chat_id = int(params.get("chat_id", 0))
+            message = {"message_id": self.message_id, "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                       "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 480, "height": 288}]}
+            return 200, {"ok": True, "result": message}, {}
+        if api_method == "editMessageText":
+            self.edits += 1
+        return 200, {"ok": True, "result": True}, {}
+
+
+class FakeCoinGecko(FakeServer):
+    """Заглушка simple/price: цены случайно блуждают от запроса к запросу"""
+
+    def __init__(self, behaviour):
+        super().__init__(behaviour)
+        self.prices = {}
+
+    async def handle_request(self, method, target, headers, body):
+        error = await self.behaviour.apply()
+        if error:
+            return error, {"status": {"error_code": error}}, {"Retry-After": "1"} if error == 429 else {}
+        query = parse_qs(urlsplit(target).query)
+        ids = query.get('ids', [''])[0].split(',')
+        result = {}
+        for coin in filter(None, ids):
+            price = self.prices.get(coin) or random.uniform(0.1, 70000)
+            price *= 1 + random.gauss(0, 0.002)
+            self.prices[coin] = price
+            result[coin] = {"usd": price, "usd_24h_change": random.uniform(-5, 5),
+                            "last_updated_at": int(time.time())}
+        return 200, result, {}
+
+
+class FakeCoinCap(FakeServer):
+    """Заглушка CoinCap v2/assets: те же блуждающие цены, что у заглушки CoinGecko, в формате CoinCap"""
+
+    def __init__(self, behaviour, prices):
+        super().__init__(behaviour)
+        self.prices = prices
+
+    async def handle_request(self, method, target, headers, body):
+        error = await self.behaviour.apply()
+        if error:
+            return error, {"error": "Fake error"}, {"Retry-After": "1"} if error == 429 else {}
+        query = parse_qs(urlsplit(target).query)
+        ids = query.get('ids', [''])[0].split(',')
+        assets = []
+        for coin in filter(None, ids):
+            price = self.prices.get(coin) or random.uniform(0.1, 70000)
+            price *= 1 + random.gauss(0, 0.002)
+            self.prices[coin] = price
+            assets.append({"id": coin, "priceUsd": str(price), "changePercent24Hr": str(random.uniform(-5, 5))})
+        return 200, {"data": assets, "timestamp": int(time.time() * 1000)}, {}
+
+
+class FakeProxyAPI(FakeServer):
+    """Заглушка OpenAI-совместимого chat/completions.
+
+    На пакетный промпт (таблицы под строками «### N») отвечает разделами
+    «### N» с ответом на каждую таблицу.
+    """
+
+    ANSWER = "Рынок движется в боковом диапазоне, заметных импульсов нет. Волатильность умеренная."
+    async def handle_request(self, method, target, headers, body):
+        params = parse_body(headers, body)
+        streaming = bool(params.get("stream"))
+        latency = self.behaviour.latency * STREAM_FIRST_CHUNK_SHARE if streaming else None
+        error = await self.behaviour.apply(latency)
+        if error:
+            return error, {"error": {"message": "Fake error"}}, {"Retry-After": "1"} if error == 429 else {}
+        prompt = "\n".join(message.get("content", "") for message in params.get("messages", []))
+        sections = len(re.findall(r"^### \d+", prompt, re.M))
+        content = "\n".join(f"### {i}\n{self.ANSWER}" for i in range(1, sections + 1)) if sections else self.ANSWER
+        usage = {"prompt_tokens": len(json.dumps(params.get("messages", []))) // 4,
+                 "completion_tokens": 40 * max(sections, 1), "total_tokens": 0}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if streaming:
+            return 200, self.stream(usage), {}
+        return 200, {"choices": [{"message": {"role": "assistant", "content": content},
+                                  "index": 0, "finish_reason": "stop"}],
+                     "usage": usage}, {}
+
+    async def stream(self, usage):
+        """События SSE в формате chat.completion.chunk: ответ по словам, затем usage и [DONE]"""
+        words = self.ANSWER.split(" ")
+        delay = self.behaviour.latency * (1 - STREAM_FIRST_CHUNK_SHARE) / max(len(words) - 1, 1)
+        for i, word in enumerate(words):
+            if i and delay:
+                await asyncio.sleep(delay)
+            content = word if i == 0 else f" {word}"
+            yield json.dumps({"choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]})
+        yield json.dumps({"choices": [], "usage": usage})
+        yield "[DONE]"
+
+
+def parse_body(headers, body):
+    """Разбирает тело запроса (JSON, форма или multipart; файлы multipart пропускаются)"""
+    if not body:
+        return {}
+    content_type = headers.get('content-type', '')
+    if 'json' in content_type:
+        return json.loads(body)
+    if 'multipart' in content_type:
+        boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+        fields = {}
+        for part in body.split(b'--' + boundary):
+            head, _, value = part.partition(b'\r\n\r\n')
+            match = re.search(rb'name="([^"]+)"', head)
+            if match and b'filename=' not in head:
+                fields[match.group(1).decode()] = value.rstrip(b'\r\n').decode()
+        return fields
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def add_arguments(parser):
+    """Добавляет в argparse настройки заглушек"""
+    for name in ("telegram", "market", "coincap", "ai"):
+        parser.add_argument(f"--{name}-latency", type=float, default=0.0, help="задержка ответа, с")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0, help="доля ответов 503")
+        parser.add_argument(f"--{name}-rate-limit", type=float, default=0.0, help="запросов в секунду (0 - без лимита)")
+
+
+async def start_all(args):
+    """Запускает все заглушки, возвращает словарь с адресами"""
+    market = FakeCoinGecko(Behaviour(args.market_latency, args.market_error_rate, args.market_rate_limit))
+    servers = {
+        "telegram": FakeTelegram(Behaviour(args.telegram_latency, args.telegram_error_rate, args.telegram_rate_limit)),
+        "market": market,
+        "coincap": FakeCoinCap(Behaviour(args.coincap_latency, args.coincap_error_rate, args.coincap_rate_limit),
+                               market.prices),
+        "ai": FakeProxyAPI(Behaviour(args.ai_latency, args.ai_error_rate, args.ai_rate_limit)),
+    }
+    ports = {name: await server.start() for name, server in servers.items()}
+    return servers, {
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{ports['telegram']}",
+        "CRYPTO_API_URL": f"http://127.0.0.1:{ports['market']}/api/v3/simple/price",
+        "COINCAP_API_URL": f"http://127.0.0.1:{ports['coincap']}/v2/assets",
+        "PROXYAPI_URL": f"http://127.0.0.1:{ports['ai']}/openai/v1/chat/completions",
+    }
+
+
+def serve_forever(args, urls_queue):
+    """Точка входа отдельного процесса: запускает заглушки и отдает адреса через очередь"""
+    async def run():
+        _, urls = await start_all(args)
+        urls_queue.put(urls)
+        await asyncio.Event().wait()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    _, urls = await start_all(args)
+    for name, url in urls.items():
+        print(f"{name}={url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
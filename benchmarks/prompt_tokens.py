@@ -0,0 +1,88 @@
+"""Сравнение старого промпта (json.dumps с отступами) и компактной таблицы.
+
+Берет снимок рынка из fixtures/market_snapshot.json, считает токены обоих
+вариантов и при указании --url отправляет каждый промпт в OpenAI-совместимый
+API, измеряя задержку и токены из поля usage. Результат печатается в JSON.
+
+    python benchmarks/prompt_tokens.py
+    python benchmarks/prompt_tokens.py --coins 3 --url http://127.0.0.1:8081/v1/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clients import AIClient  # noqa: E402
+from prompt import PromptBuilder, count_tokens  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "market_snapshot.json")
+
+
+def legacy_prompt(data):
+    """Промпт в том виде, в каком его строил analyze_with_proxyapi до сжатия"""
+    return f"""
+            Проанализируй следующие данные о криптовалютах и дай краткий анализ:
+            {json.dumps(data, indent=2, ensure_ascii=False)}
+
+            Дай краткий анализ (2-3 предложения) на русском языке о текущем состоянии рынка.
+            """
+
+
+async def measure_latency(client, prompt, repeats):
+    """Отправляет промпт repeats раз, возвращает задержки и usage последнего ответа"""
+    latencies = []
+    usage = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = await client.complete(prompt, max_tokens=200)
+        latencies.append(time.perf_counter() - start)
+        usage = result.get('usage', usage)
+    return latencies, usage
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--coins", type=int, default=0, help="сколько монет взять из снимка (0 - все)")
+    parser.add_argument("--budget", type=int, default=400)
+    parser.add_argument("--url", help="адрес chat/completions для замера задержки")
+    parser.add_argument("--key", default=os.getenv("PROXYAPI_KEY", "test"))
+    parser.add_argument("--model", default=os.getenv("AI_MODEL", "gpt-3.5-turbo"))
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.fixture, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if args.coins:
+        data = dict(list(data.items())[:args.coins])
+
+    before = legacy_prompt(data)
+    after, estimated, dropped = PromptBuilder(args.budget, priority=list(data), model=args.model).build(data)
+    report = {
+        "coins": len(data),
+        "budget": args.budget,
+        "before": {"chars": len(before), "tokens": count_tokens(before, args.model)},
+        "after": {"chars": len(after), "tokens": estimated, "dropped": dropped},
+    }
+
+    if args.url:
+        client = AIClient(args.url, args.key, args.model)
+        try:
+            for name, prompt in (("before", before), ("after", after)):
+                latencies, usage = await measure_latency(client, prompt, args.repeats)
+                report[name]["latency_p50"] = statistics.median(latencies)
+                report[name]["latency_max"] = max(latencies)
+                report[name]["usage"] = usage
+        finally:
+            await client.aclose()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""Память и скорость реестра подписчиков: прежний словарь active_chats против SubscriberRegistry.
+
+Строит N синтетических подписчиков в трех видах: словарь
+{str(chat_id): {"username", "added_at" (ISO)}}, каким был active_chats,
+компактный SubscriberRegistry и SQLiteSubscriberStore без реестра. Для
+каждого меряет память на подписчика (tracemalloc), проверку подписки,
+перебор всех чатов и одного шарда рассылки, а для реестра — применение
+одиночных изменений (подписок и отписок). Результат печатается в JSON.
+
+    python benchmarks/registry.py
+    python benchmarks/registry.py --chats 100000 --lookups 50000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subscribers import DEFAULT_WATCHLIST, SQLiteSubscriberStore, SubscriberRegistry  # noqa: E402
+
+# Каждый сотый чат — с личным списком монет из WATCHLISTS вариантов
+WATCHLISTS = 50
+
+
+def make_chats(count, seed=1):
+    """count строк (chat_id, интервал, подпись списка монет, порог, время подписки, имя) по возрастанию chat_id"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    rows = []
+    for chat_id in sorted(rng.sample(range(10 ** 9, 7 * 10 ** 9), count)):
+        watchlist = f"bitcoin,coin-{chat_id % WATCHLISTS}" if chat_id % 100 == 0 else DEFAULT_WATCHLIST
+        rows.append((chat_id, 3600, watchlist, None, now - rng.randrange(365 * 86400), f"user{chat_id}"))
+    return rows
+
+
+def measure_memory(build):
+    """Результат build() и сколько памяти он занимает (по tracemalloc)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return value, used
+
+
+def timed(function):
+    """Время выполнения function() в секундах"""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def legacy_dict(rows):
+    """Подписчики в виде прежнего active_chats"""
+    return {
+        str(chat_id): {"username": username, "added_at": datetime.fromtimestamp(added_at).isoformat()}
+        for chat_id, _, _, _, added_at, username in rows
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200_000, help="сколько проверок подписки (половина — промахи)")
+    parser.add_argument("--shards", type=int, default=16, help="на сколько шардов делится рассылка")
+    parser.add_argument("--changes", type=int, default=50_000, help="сколько одиночных изменений применить к реестру")
+    args = parser.parse_args()
+
+    rows = make_chats(args.chats)
+    rng = random.Random(2)
+    lookups = [rng.choice(rows)[0] if i % 2 else rng.randrange(10 ** 9, 7 * 10 ** 9) for i in range(args.lookups)]
+    report = {"chats": args.chats, "lookups": args.lookups}
+
+    chats, used = measure_memory(lambda: legacy_dict(rows))
+
+    def iterate_dict():
+        for key in chats:
+            int(key)
+
+    report["dict"] = {
+        "bytes_per_chat": round(used / args.chats, 1),
+        "lookup_us": round(timed(lambda: [str(chat_id) in chats for chat_id in lookups]) / args.lookups * 1e6, 3),
+        "iterate_s": round(timed(iterate_dict), 3),
+    }
+    del chats
+
+    registry, used = measure_memory(lambda: SubscriberRegistry.from_rows(rows))
+
+    def apply_changes():
+        # Каждая подписка или отписка применяется отдельно, как после /start и /stop
+        for index in range(args.changes):
+            if index % 2:
+                registry.apply([(rows[index][0], None)])
+            else:
+                registry.apply([(rng.randrange(10 ** 9, 7 * 10 ** 9), (3600, DEFAULT_WATCHLIST, None, 0))])
+
+    report["registry"] = {
+        "bytes_per_chat": round(used / args.chats, 1),
+        "lookup_us": round(timed(lambda: [chat_id in registry for chat_id in lookups]) / args.lookups * 1e6, 3),
+        "iterate_s": round(timed(lambda: sum(1 for _ in registry.iter_rows())), 3),
+        "iterate_shard_s": round(timed(lambda: sum(1 for _ in registry.iter_rows(shard=(0, args.shards)))), 3),
+        "groups_s": round(timed(registry.groups), 3),
+        "apply_us": round(timed(apply_changes) / max(args.changes, 1) * 1e6, 3),
+        # Перебор с накопленными изменениями поверх колонок
+        "iterate_with_changes_s": round(timed(lambda: sum(1 for _ in registry.iter_rows())), 3),
+    }
+
+    with tempfile.TemporaryDirectory(prefix="tradebot-registry-") as workdir:
+        store = SQLiteSubscriberStore(os.path.join(workdir, "subscribers.db"))
+        with store.batch():
+            store._conn.executemany(
+                "INSERT INTO subscribers (chat_id, username, added_at, interval, watchlist, threshold) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((chat_id, username, added_at, interval, watchlist, threshold)
+                 for chat_id, interval, watchlist, threshold, added_at, username in rows)
+            )
+        sql_lookups = lookups[:max(args.lookups // 10, 1)]
+        report["sqlite"] = {
+            "lookup_us": round(timed(lambda: [chat_id in store for chat_id in sql_lookups]) / len(sql_lookups) * 1e6, 3),
+            "iterate_s": round(timed(lambda: sum(1 for _ in store.iter_subscriptions())), 3),
+            "iterate_shard_s": round(timed(lambda: sum(1 for _ in store.iter_subscriptions(shard=(0, args.shards)))), 3),
+            "groups_s": round(timed(store.groups), 3),
+        }
+        store.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""Сквозной бенчмарк бота на локальных заглушках Telegram, CoinGecko и ProxyAPI.
+
+Запускает заглушки (benchmarks/fake_servers.py) в отдельном процессе, создает
+TradingBot с временной базой и прогоняет два сценария:
+
+* рассылка планового анализа 1k/10k/100k синтетическим чатам (с --watchlists N
+  чаты делятся между N личными списками монет, с --ticks N --threshold P
+  повторяется N тиков подряд с порогом изменения цены P%, с --charts перед
+  анализом отправляется график, --batch-size и --quiet-model настраивают
+  пакетный анализ и выбор модели);
+* серии одновременных /analyze на холодном и прогретом кэше;
+* допуск запросов: тик рассылки на фоне --flood различных анализов по
+  запросу пользователей и один чат, отправляющий --spam команд /analyze подряд.
+
+Печатает JSON с задержками p50/p95/p99, пропускной способностью и пиковым
+RSS процесса — результаты разных коммитов можно сравнивать между собой.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --chats 1000,10000 --telegram-latency 0.02 --output before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_servers import add_arguments, serve_forever  # noqa: E402
+
+# Идентификаторы синтетических чатов каждого сценария не пересекаются,
+# чтобы лимит «одно сообщение в секунду на чат» не влиял на следующий прогон
+CHAT_ID_STEP = 10_000_000
+
+# Допустимая доля логирования во времени тика рассылки
+LOG_OVERHEAD_BUDGET = 0.01
+
+
+def percentiles(samples):
+    """p50/p95/p99, среднее и максимум выборки в миллисекундах"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса, МБ (ru_maxrss в Linux — в КБ, в macOS — в байтах)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_revision():
+    """Текущий коммит и признак незакоммиченных изменений"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=ROOT, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def start_fake_servers(args):
+    """Запускает заглушки в отдельном процессе, чтобы они не делили цикл событий с ботом"""
+    urls_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_forever, args=(args, urls_queue), daemon=True)
+    process.start()
+    return process, urls_queue.get(timeout=30)
+
+
+def configure_environment(args, urls, workdir):
+    """Переменные окружения бота: все адреса указывают на заглушки, файлы — во временный каталог"""
+    os.environ.update(urls)
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:BENCHMARK",
+        "PROXYAPI_KEY": "benchmark",
+        "SUBSCRIBERS_DB": os.path.join(workdir, "subscribers.db"),
+        "PRICE_HISTORY_FILE": os.path.join(workdir, "price_history.json"),
+        "LOG_FILE": os.path.join(workdir, "trading_bot.log"),
+        "BROADCAST_CONCURRENCY": str(args.concurrency),
+        "TELEGRAM_RATE_LIMIT": str(args.rate),
+        "DELTA_THRESHOLD": str(args.threshold),
+        "CHARTS_ENABLED": "true" if args.charts else "false",
+        "MARKET_SOURCES": args.market_sources,
+        "MARKET_AGGREGATION": args.market_aggregation,
+        "AI_BATCH_SIZE": str(args.batch_size),
+        "AI_QUIET_MODEL": args.quiet_model,
+        "AI_QUEUE_LIMIT": str(args.ai_queue_limit),
+    })
+
+
+def make_watchlists(count):
+    """count различных списков монет: у каждого общая монета и своя синтетическая"""
+    return [f"bitcoin,bench-coin-{index:05d}" for index in range(count)]
+
+
+def market_calls(bot):
+    """Число запросов ко всем источникам цен"""
+    return sum(source.policy.calls for source in bot.prices.sources)
+
+
+def seed_history(bot, points=168):
+    """Заполняет историю цен монет рассылки случайным блужданием, чтобы было что рисовать на графиках"""
+    now = time.time()
+    rng = random.Random(1)
+    for coin in bot.market_ids:
+        if len(bot.history.prices(coin)) >= 2:
+            continue
+        price = 100.0
+        for index in range(points):
+            price *= 1 + rng.gauss(0, 0.01)
+            bot.history.update({coin: {"usd": price}}, timestamp=now - (points - index) * 3600)
+
+
+async def run_broadcast(bot, chats, scenario, watchlists=0, ticks=1, charts=False):
+    """Рассылка планового анализа chats синтетическим чатам"""
+    import working_bot
+    log_handler = working_bot.log_handler
+    first_id = (scenario + 1) * CHAT_ID_STEP
+    signatures = make_watchlists(watchlists)
+    with bot.subscribers.batch():
+        for chat_id in range(first_id, first_id + chats):
+            bot.subscribers.add(chat_id, "bench")
+            if signatures:
+                bot.subscribers.set_watchlist(chat_id, signatures[chat_id % len(signatures)])
+    bot.refresh_market_ids()
+    if charts:
+        seed_history(bot)
+    # Каждый сценарий начинается с пустого кэша, чтобы число запросов к API было сравнимо
+    bot.market_cache.clear()
+    bot.analysis_cache.clear()
+    bot.deltas.clear()
+    market_requests = market_calls(bot)
+    ai_calls = bot.ai_client.policy.calls
+    routed = dict(bot.router.routed)
+    log_records, log_seconds = log_handler.records, log_handler.seconds
+
+    start = time.perf_counter()
+    result = await bot.scheduled_analysis()
+    wall = time.perf_counter() - start
+    log_records, log_seconds = log_handler.records - log_records, log_handler.seconds - log_seconds
+    market_requests, ai_calls = market_calls(bot) - market_requests, bot.ai_client.policy.calls - ai_calls
+    routed = {model: count - routed.get(model, 0) for model, count in bot.router.routed.items()
+              if count > routed.get(model, 0)}
+
+    # Следующие тики: у заглушки CoinGecko цены на каждом запросе сдвигаются случайно (~0.2%)
+    next_ticks = []
+    for _ in range(ticks - 1):
+        bot.market_cache.clear()
+        tick_ai_calls = bot.ai_client.policy.calls
+        tick = await bot.scheduled_analysis()
+        next_ticks.append({"sent": tick.sent, "ai_requests": bot.ai_client.policy.calls - tick_ai_calls})
+
+    bot.remove_chats(list(range(first_id, first_id + chats)))
+    bot.refresh_market_ids()
+    return {
+        "chats": chats,
+        "watchlists": len(signatures),
+        "market_requests": market_requests,
+        "ai_requests": ai_calls,
+        # Сколько анализов групп написала каждая модель
+        "ai_models": routed,
+        "sent": result.sent,
+        "failed": result.failed,
+        "retried": result.retried,
+        "photos": result.photos,
+        "uploads": result.uploads,
+        "wall_s": round(wall, 3),
+        # Данные и анализ до начала отправки
+        "render_s": round(wall - result.elapsed, 3),
+        "broadcast_s": round(result.elapsed, 3),
+        "throughput_msg_s": round(result.throughput, 1),
+        "latency": percentiles(result.latencies),
+        # Время, которое логирование отняло у тика (запись в очередь; диск пишет отдельный поток)
+        "log_records": log_records,
+        "log_overhead_ms": round(log_seconds * 1000, 3),
+        "log_share": round(log_seconds / wall, 5) if wall > 0 else 0.0,
+        "log_within_budget": log_seconds <= LOG_OVERHEAD_BUDGET * wall,
+        "next_ticks": next_ticks,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_analyze_burst(bot, concurrency, cold):
+    """concurrency одновременных /analyze; cold — с пустым кэшем данных и анализа"""
+    if cold:
+        bot.market_cache.clear()
+        bot.analysis_cache.clear()
+    market_requests = market_calls(bot)
+    ai_calls = bot.ai_client.policy.calls
+    latencies = []
+
+    async def analyze(chat_id):
+        start = time.perf_counter()
+        await bot.hourly_analysis(chat_id)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(analyze(chat_id) for chat_id in range(1, concurrency + 1)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "cache": "cold" if cold else "warm",
+        "wall_s": round(wall, 3),
+        "throughput_req_s": round(concurrency / wall, 1) if wall > 0 else 0.0,
+        "market_requests": market_calls(bot) - market_requests,
+        "ai_requests": bot.ai_client.policy.calls - ai_calls,
+        "latency": percentiles(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_admission(bot, flood, spam, scenario, watchlists):
+    """Тик рассылки, пока ИИ занят flood анализами по запросу, и spam команд /analyze от одного чата"""
+    from admission import ON_DEMAND
+    shed = dict(bot.ai_slots.shed_counts())
+    flood_latencies = []
+    max_depth = 0
+
+    async def on_demand(index):
+        # Различные данные: каждый анализ — отдельный запрос к ИИ, кэш и схлопывание не помогают
+        start = time.perf_counter()
+        await bot.analyze_with_proxyapi({"bitcoin": {"usd": 50_000 + index, "usd_24h_change": 1.0}}, priority=ON_DEMAND)
+        flood_latencies.append(time.perf_counter() - start)
+
+    async def watch_depth():
+        nonlocal max_depth
+        while True:
+            max_depth = max(max_depth, bot.ai_slots.depth()["on_demand"])
+            await asyncio.sleep(0.01)
+
+    watcher = asyncio.create_task(watch_depth())
+    flood_tasks = [asyncio.create_task(on_demand(index)) for index in range(flood)]
+    await asyncio.sleep(0)
+    tick = await run_broadcast(bot, 1000, scenario, watchlists or 20)
+    await asyncio.gather(*flood_tasks)
+    watcher.cancel()
+
+    # Один чат нажимает /analyze spam раз подряд: анализ получают первые ANALYZE_BURST
+    chat_id = (scenario + 1) * CHAT_ID_STEP - 1
+    bot.subscribers.add(chat_id, "bench")
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=SimpleNamespace(reply_text=reply_text))
+    limited = bot.analyze_limiter.limited
+    start = time.perf_counter()
+    for _ in range(spam):
+        await bot.analyze_command(update, None)
+    spam_wall = time.perf_counter() - start
+    bot.remove_chats([chat_id])
+    return {
+        "flood": flood,
+        "broadcast_render_s": tick["render_s"],
+        "flood_latency": percentiles(flood_latencies),
+        "flood_shed": bot.ai_slots.shed_counts()["on_demand"] - shed["on_demand"],
+        "max_queue_depth": max_depth,
+        "spam": spam,
+        "spam_limited": bot.analyze_limiter.limited - limited,
+        # Ответы бота чату: «Выполняю анализ» на допущенные и одно уведомление с кэшированным анализом
+        "spam_replies": len(replies),
+        "spam_wall_s": round(spam_wall, 3),
+    }
+
+
+async def run_benchmark(args, bot):
+    """Прогоняет все сценарии и собирает отчет"""
+    bot.loop = asyncio.get_running_loop()
+    bot.broadcaster.record_latencies = True
+    await bot.bot.initialize()
+
+    report = {"broadcast": [], "analyze": []}
+    try:
+        for scenario, chats in enumerate(args.chats):
+            report["broadcast"].append(await run_broadcast(bot, chats, scenario, args.watchlists, args.ticks, args.charts))
+        for _ in range(args.bursts):
+            for cold in (True, False):
+                report["analyze"].append(await run_analyze_burst(bot, args.analyze_concurrency, cold))
+        if args.flood or args.spam:
+            report["admission"] = await run_admission(bot, args.flood, args.spam, len(args.chats), args.watchlists)
+        # Какие источники цен бот выбрал и сколько раз подстраховывал медленный
+        report["market_sources"] = {
+            source.policy.name: {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "hedged": stats.hedged,
+                "outliers": stats.outliers,
+                "p50_ms": round(stats.quantile(0.5) * 1000, 1) if stats.latencies else None,
+                "p90_ms": round(stats.quantile(0.9) * 1000, 1) if stats.latencies else None,
+            } for source, stats in bot.prices.stats.items()
+        }
+    finally:
+        await bot.bot.shutdown()
+        await bot.on_shutdown(bot.app)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--chats", default="1000,10000,100000",
+                        help="размеры рассылки через запятую")
+    parser.add_argument("--watchlists", type=int, default=0,
+                        help="сколько различных личных списков монет у чатов рассылки (0 — общий список)")
+    parser.add_argument("--ticks", type=int, default=1, help="сколько тиков рассылки подряд в каждом сценарии")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="DELTA_THRESHOLD бота, %% (по умолчанию 0: каждый тик рассылается всем)")
+    parser.add_argument("--charts", action="store_true", help="отправлять график перед плановым анализом")
+    parser.add_argument("--market-sources", default="coingecko",
+                        help="MARKET_SOURCES бота: источники цен через запятую (coingecko, coincap)")
+    parser.add_argument("--market-aggregation", default="first", choices=("first", "median"),
+                        help="MARKET_AGGREGATION бота")
+    parser.add_argument("--batch-size", type=int, default=5,
+                        help="AI_BATCH_SIZE бота: анализов групп в одном запросе к ИИ (1 — без пакетов)")
+    parser.add_argument("--quiet-model", default="", help="AI_QUIET_MODEL бота: модель для спокойного рынка")
+    parser.add_argument("--concurrency", type=int, default=50, help="BROADCAST_CONCURRENCY бота")
+    parser.add_argument("--rate", type=float, default=1_000_000,
+                        help="TELEGRAM_RATE_LIMIT бота (по умолчанию лимит фактически снят)")
+    parser.add_argument("--analyze-concurrency", type=int, default=100, help="одновременных /analyze в серии")
+    parser.add_argument("--bursts", type=int, default=3, help="сколько серий /analyze прогнать")
+    parser.add_argument("--flood", type=int, default=0,
+                        help="сколько различных анализов по запросу держат ИИ занятым во время тика рассылки")
+    parser.add_argument("--spam", type=int, default=0, help="сколько /analyze подряд отправляет один чат")
+    parser.add_argument("--ai-queue-limit", type=int, default=32, help="AI_QUEUE_LIMIT бота")
+    parser.add_argument("--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать вывод бота")
+    args = parser.parse_args()
+    args.chats = [int(value) for value in args.chats.split(",") if value]
+
+    process, urls = start_fake_servers(args)
+    workdir = tempfile.mkdtemp(prefix="tradebot-bench-")
+    configure_environment(args, urls, workdir)
+    # Лог бота тоже пишется в текущий каталог
+    os.chdir(workdir)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    try:
+        with output:
+            import working_bot
+            bot = working_bot.TradingBot()
+            report = asyncio.run(run_benchmark(args, bot))
+    finally:
+        process.terminate()
+
+    report = {
+        "commit": git_revision(),
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "analyze_concurrency": args.analyze_concurrency,
+            "watchlists": args.watchlists,
+            "ticks": args.ticks,
+            "threshold": args.threshold,
+            "charts": args.charts,
+            "market_sources": args.market_sources,
+            "market_aggregation": args.market_aggregation,
+            "batch_size": args.batch_size,
+            "quiet_model": args.quiet_model,
+            "flood": args.flood,
+            "spam": args.spam,
+            "ai_queue_limit": args.ai_queue_limit,
+            "fake_servers": {
+                name: {
+                    "latency": getattr(args, f"{name}_latency"),
+                    "error_rate": getattr(args, f"{name}_error_rate"),
+                    "rate_limit": getattr(args, f"{name}_rate_limit"),
+                } for name in ("telegram", "market", "coincap", "ai")
+            },
+        },
+        **report,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Время перезапуска бота: от старта процесса до ответа на /analyze, присланный во время простоя.
+
+Запускает заглушки, подписывает чат на временной базе и дважды повторяет:
+ставит в очередь getUpdates сообщение /analyze, запускает `working_bot.py`
+(polling) и ждет ответов бота, после чего останавливает его SIGTERM.
+Первый прогон — холодный, второй — после перезапуска с сохраненным
+состоянием (CHECKPOINT_FILE): снимок и анализ должны браться из него,
+без запросов к CoinGecko и ИИ.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --ai-latency 1.5 --target 2
+
+Код выхода 1, если время до первого ответа превысило --target.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_servers import add_arguments, serve_forever  # noqa: E402
+from subscribers import SQLiteSubscriberStore  # noqa: E402
+
+CHAT_ID = 1
+
+
+def wait_for(condition, timeout, step=0.02):
+    """Ждет, пока condition() не вернет истину; возвращает ее значение или None"""
+    give_up_at = time.monotonic() + timeout
+    while time.monotonic() < give_up_at:
+        value = condition()
+        if value:
+            return value
+        time.sleep(step)
+    return None
+
+
+def restart(args, env, workdir, clients, run):
+    """Один перезапуск: /analyze ждет в очереди, бот стартует и отвечает на него"""
+    telegram = clients["telegram"]
+    telegram.post("/stats/reset")
+    before = {name: client.get("/stats").json()["requests"] for name, client in clients.items()}
+    # Сообщение пользователя отправлено, пока бот был остановлен
+    telegram.post("/updates", json={"chat_id": CHAT_ID, "text": "/analyze", "date": time.time() - 1})
+
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "working_bot.py")], env=env, cwd=workdir,
+        stdout=open(os.path.join(workdir, f"bot-{run}.log"), "w"), stderr=subprocess.STDOUT
+    )
+    try:
+        # Первый ответ — «Выполняю анализ...», второй — сам анализ
+        replies = wait_for(
+            lambda: (lambda times: times if len(times) >= 2 else None)(
+                telegram.get("/stats").json()["replies"].get(str(CHAT_ID), [])),
+            args.timeout
+        )
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+    after = {name: client.get("/stats").json()["requests"] for name, client in clients.items()}
+
+    report = {"run": run, "exit_code": process.returncode}
+    if replies:
+        report["first_reply_s"] = round(replies[0] - started, 3)
+        report["analysis_reply_s"] = round(replies[1] - started, 3)
+    report["market_requests"] = after["market"] - before["market"]
+    report["ai_requests"] = after["ai"] - before["ai"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--target", type=float, default=3.0, help="цель для времени до первого ответа, с")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.set_defaults(ai_latency=1.0)
+    args = parser.parse_args()
+
+    urls_queue = multiprocessing.Queue()
+    servers = multiprocessing.Process(target=serve_forever, args=(args, urls_queue), daemon=True)
+    servers.start()
+    urls = urls_queue.get(timeout=30)
+
+    workdir = tempfile.mkdtemp(prefix="tradebot-startup-")
+    db_path = os.path.join(workdir, "subscribers.db")
+    store = SQLiteSubscriberStore(db_path)
+    store.add(CHAT_ID, "bench")
+    store.close()
+
+    env = dict(
+        os.environ, **urls,
+        TELEGRAM_TOKEN="123456:STARTUP",
+        PROXYAPI_KEY="benchmark",
+        SUBSCRIBERS_DB=db_path,
+        PRICE_HISTORY_FILE=os.path.join(workdir, "price_history.json"),
+        CHECKPOINT_FILE=os.path.join(workdir, "bot_state.json"),
+        STARTUP_TARGET_SECONDS=str(args.target),
+        METRICS_PORT="0",
+    )
+    clients = {
+        "telegram": httpx.Client(base_url=urls["TELEGRAM_API_URL"]),
+        "market": httpx.Client(base_url=urls["CRYPTO_API_URL"].split("/api/", 1)[0]),
+        "ai": httpx.Client(base_url=urls["PROXYAPI_URL"].split("/openai/", 1)[0]),
+    }
+    try:
+        runs = [restart(args, env, workdir, clients, run) for run in ("cold", "warm")]
+    finally:
+        servers.terminate()
+
+    report = {
+        "target_s": args.target,
+        "ai_latency_s": args.ai_latency,
+        # Там же логи бота bot-cold.log и bot-warm.log
+        "workdir": workdir,
+        "runs": runs,
+    }
+    report["ok"] = all(run.get("first_reply_s", float("inf")) <= args.target for run in runs)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
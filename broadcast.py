@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import httpx
+
+from clients import AsyncHTTPClient
+from resilience import CircuitOpenError, UpstreamPolicy
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Лимиты Telegram Bot API: ~30 сообщений в секунду суммарно,
+# не чаще 1 сообщения в секунду в личный чат и 20 в минуту в группу
+GLOBAL_RATE_LIMIT = 30
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+# Коды ответов, после которых чат больше не может получать сообщения
+DEAD_CHAT_STATUSES = (400, 403)
+
+# Исходы отправки одного сообщения
+SENT = "sent"
+DEAD = "dead"      # чат недоступен, его нужно отписать
+RETRY = "retry"    # временная ошибка (429, 5xx, сеть): можно повторить позже
+FAILED = "failed"  # постоянная ошибка, повтор не поможет
+
+# Сколько чатов с ошибкой перечислять в итоговой записи лога рассылки
+ERROR_SAMPLE_SIZE = 5
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду с запасом capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Приостанавливает выдачу токенов (ответ 429 с retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def try_acquire(self):
+        """Забирает токен, если он есть сейчас; не ждет"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Ждет, пока в ведре появится токен, и забирает его"""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class BroadcastResult:
+    """Итоги одной рассылки"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+    # Графики, отправленные перед текстом, и сколько из них пришлось загружать
+    photos: int = 0
+    uploads: int = 0
+    dead_chats: list = field(default_factory=list)
+    # Ошибки по причинам и несколько чатов для примера: в лог они попадают одной записью на рассылку
+    errors: Counter = field(default_factory=Counter)
+    error_chats: list = field(default_factory=list)
+    # Время доставки каждого сообщения, если включен record_latencies
+    latencies: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        """Пропускная способность, сообщений в секунду"""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add_error(self, chat_id, reason):
+        """Учитывает ошибку отправки в чат"""
+        self.errors[reason] += 1
+        if len(self.error_chats) < ERROR_SAMPLE_SIZE:
+            self.error_chats.append(chat_id)
+
+    def log_errors(self):
+        """Пишет ошибки рассылки в лог одной записью"""
+        if not self.errors:
+            return
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in self.errors.most_common())
+        logger.error(
+            f"Ошибки отправки: {sum(self.errors.values())} ({reasons}), например чаты {self.error_chats}",
+            extra={"errors": dict(self.errors), "error_chats": self.error_chats}
+        )
+
+
+class Broadcaster:
+    """Параллельная рассылка сообщений с учетом лимитов Telegram"""
+
+    def __init__(self, token, concurrency=50, rate=GLOBAL_RATE_LIMIT,
+                 max_retries=3, timeout=10, base_url=TELEGRAM_API_URL, policy=None, metrics=None):
+        self.url = f"{base_url}/bot{token}/sendMessage"
+        self.photo_url = f"{base_url}/bot{token}/sendPhoto"
+        # 429 обрабатывается здесь (общая пауза ведра), политика повторяет только сбои сервера
+        self.policy = policy or UpstreamPolicy("Telegram", deadline=timeout * 3,
+                                               retry_statuses=(500, 502, 503, 504))
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # Пул соединений общий для всех рассылок, а не создается на каждую
+        self.http = AsyncHTTPClient(connect_timeout=timeout, read_timeout=timeout,
+                                    max_connections=concurrency, policy=self.policy)
+        # Общее ведро на все рассылки: одновременные рассылки разных групп
+        # вместе не превышают лимит Telegram
+        self.bucket = TokenBucket(rate)
+        # Время, раньше которого нельзя писать в конкретный чат
+        self._chat_next_send = {}
+        # Замер времени доставки каждого сообщения (для бенчмарка)
+        self.record_latencies = False
+        # Метрики этапа отправки: объект этапа берется один раз, а не на каждое сообщение
+        self.send_stage = metrics.stage("send") if metrics is not None else None
+
+    def _chat_interval(self, chat_id):
+        """Минимальный интервал между сообщениями в один чат"""
+        # У групп и каналов отрицательные идентификаторы
+        return GROUP_CHAT_INTERVAL if int(chat_id) < 0 else PRIVATE_CHAT_INTERVAL
+
+    async def _wait_for_chat(self, chat_id):
+        """Соблюдает лимит на количество сообщений в один чат"""
+        now = time.monotonic()
+        next_send = self._chat_next_send.get(chat_id, 0.0)
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+        self._chat_next_send[chat_id] = max(now, next_send) + self._chat_interval(chat_id)
+
+    async def _post(self, client, bucket, chat_id, request, result):
+        """Один запрос к Bot API с учетом лимитов; после 429 ждет retry_after и повторяет.
+
+        Возвращает последний ответ; сетевые ошибки и разомкнутый предохранитель пробрасываются.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await bucket.acquire()
+            stage = self.send_stage
+            status = "error"
+            if stage is not None:
+                stage.in_flight += 1
+            started = time.perf_counter()
+            try:
+                response = await self.policy.call(request)
+                status = str(response.status_code)
+            finally:
+                if stage is not None:
+                    stage.in_flight -= 1
+                    stage.record(time.perf_counter() - started, status)
+
+            if response.status_code == 429 and attempt < self.max_retries:
+                try:
+                    retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    retry_after = 1
+                bucket.pause(retry_after)
+                result.retried += 1
+                continue
+            return response
+
+    async def _send(self, client, bucket, chat_id, text, result):
+        """Отправляет одно сообщение, повторяя попытку после 429.
+
+        text может быть парой (график, текст): тогда перед текстом отправляется график.
+        Возвращает (исход, описание ошибки).
+        """
+        if isinstance(text, tuple):
+            chart, text = text
+            await self._send_chart(client, bucket, chat_id, chart, result)
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+        try:
+            response = await self._post(client, bucket, chat_id, lambda: client.post(self.url, json=payload), result)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            result.add_error(chat_id, type(e).__name__)
+            result.failed += 1
+            return RETRY, str(e) or type(e).__name__
+
+        if response.status_code == 200:
+            result.sent += 1
+            return SENT, None
+        result.add_error(chat_id, f"HTTP {response.status_code}")
+        result.failed += 1
+        if response.status_code in DEAD_CHAT_STATUSES:
+            result.dead_chats.append(chat_id)
+            return DEAD, f"HTTP {response.status_code}"
+        if response.status_code == 429 or response.status_code >= 500:
+            return RETRY, f"HTTP {response.status_code}"
+        return FAILED, f"HTTP {response.status_code}"
+
+    async def _send_chart(self, client, bucket, chat_id, chart, result):
+        """Отправляет график (chart.Chart): первый раз загружает файл, дальше — по file_id.
+
+        Пока график загружается, остальные отправки того же графика ждут его
+        file_id, поэтому картинка загружается в Telegram один раз на все чаты.
+        Ошибка графика не мешает отправке текста и не влияет на исход.
+        """
+        if chart.file_id is None:
+            async with chart.lock:
+                # Пока ждали, график мог загрузить другой воркер
+                if chart.file_id is None:
+                    response = await self._post_chart(client, bucket, chat_id, chart, result, upload=True)
+                    if response is not None and response.status_code == 200:
+                        try:
+                            chart.file_id = response.json()["result"]["photo"][-1]["file_id"]
+                        except (ValueError, KeyError, IndexError, TypeError) as e:
+                            logger.error(f"Ошибка разбора ответа на загрузку графика: {e}")
+                        result.uploads += 1
+                        result.photos += 1
+                    return
+        response = await self._post_chart(client, bucket, chat_id, chart, result)
+        if response is None:
+            return
+        if response.status_code == 200:
+            result.photos += 1
+        elif response.status_code == 400:
+            # Telegram не принял file_id: следующая отправка загрузит график заново
+            chart.file_id = None
+
+    async def _post_chart(self, client, bucket, chat_id, chart, result, upload=False):
+        """Запрос sendPhoto; возвращает ответ или None при сетевой ошибке"""
+        if upload:
+            def request():
+                return client.post(self.photo_url, data={"chat_id": str(chat_id), "caption": chart.caption},
+                                   files={"photo": ("chart.png", chart.png, "image/png")})
+        else:
+            payload = {"chat_id": chat_id, "photo": chart.file_id, "caption": chart.caption}
+
+            def request():
+                return client.post(self.photo_url, json=payload)
+        try:
+            response = await self._post(client, bucket, chat_id, request, result)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            result.add_error(chat_id, f"график: {type(e).__name__}")
+            return None
+        if response.status_code != 200:
+            result.add_error(chat_id, f"график: HTTP {response.status_code}")
+        return response
+
+    async def deliver(self, messages, on_result=None):
+        """Отправляет пары (chat_id, text) и возвращает BroadcastResult.
+
+        on_result(chat_id, исход, ошибка) вызывается после каждого сообщения.
+        """
+        result = BroadcastResult()
+        bucket = self.bucket
+        messages = iter(messages)
+        start = time.monotonic()
+
+        async def worker(client):
+            # Все воркеры читают из одного итератора, поэтому список чатов
+            # не нужно целиком раскладывать по очередям
+            for chat_id, text in messages:
+                result.total += 1
+                sent_at = time.monotonic()
+                outcome, error = await self._send(client, bucket, chat_id, text, result)
+                if on_result is not None:
+                    on_result(chat_id, outcome, error)
+                if self.record_latencies:
+                    result.latencies.append(time.monotonic() - sent_at)
+
+        async with self.http.session() as client:
+            await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+
+        result.elapsed = time.monotonic() - start
+        result.log_errors()
+        self._prune_chat_limits()
+        return result
+
+    async def aclose(self):
+        """Закрывает пул соединений рассылки"""
+        await self.http.aclose()
+
+    def _prune_chat_limits(self):
+        """Забывает чаты, для которых лимит уже истек"""
+        now = time.monotonic()
+        self._chat_next_send = {
+            chat_id: next_send for chat_id, next_send in self._chat_next_send.items()
+            if next_send > now
+        }
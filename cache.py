@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Маркер отсутствующего значения (None тоже может быть значением)
+MISSING = object()
+
+
+class _LoadAbandoned(Exception):
+    """Загружавший отменен: ожидающие повторяют запрос, а не получают чужую отмену"""
+
+
+class TTLCache:
+    """Кэш с временем жизни записей, вытеснением LRU и схлопыванием одновременных запросов.
+
+    Если значение по ключу уже загружается, остальные вызывающие (из потоков
+    или из корутин) ждут этот же запрос, а не запускают свой.
+    """
+
+    def __init__(self, ttl, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get_locked(self, key):
+        """Возвращает значение из кэша или MISSING (под блокировкой)"""
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        value, expires_at = entry
+        # Устаревшая запись остается до вытеснения: ее можно отдать через get_stale
+        if expires_at <= time.monotonic():
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _set_locked(self, key, value, ttl):
+        """Сохраняет значение и вытесняет самые старые записи (под блокировкой)"""
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Возвращает значение из кэша, если оно еще не устарело"""
+        with self._lock:
+            value = self._get_locked(key)
+        return default if value is MISSING else value
+
+    def get_stale(self, key, default=None):
+        """Возвращает последнее значение по ключу, даже если срок его жизни истек"""
+        with self._lock:
+            entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Кладет значение в кэш"""
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._data.clear()
+
+    def _begin(self, key, force):
+        """Ищет значение или регистрирует новую загрузку.
+
+        Возвращает (значение, None, False) при попадании, (None, future, False)
+        если нужно дождаться чужой загрузки и (None, future, True) если
+        загружать должен сам вызывающий.
+        """
+        with self._lock:
+            if not force:
+                value = self._get_locked(key)
+                if value is not MISSING:
+                    self.hits += 1
+                    return value, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return None, future, True
+
+    def _abandon(self, key, future):
+        """Снимает загрузку без результата; ожидающие начнут ее заново"""
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_exception(_LoadAbandoned())
+
+    def _finish(self, key, future, value, error, ttl, cacheable):
+        """Завершает загрузку: сохраняет результат и будит ожидающих"""
+        with self._lock:
+            self._inflight.pop(key, None)
+            if error is None and (cacheable is None or cacheable(value)):
+                self._set_locked(key, value, ttl)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get_or_load(self, key, loader, ttl=None, cacheable=None, force=False):
+        """Возвращает значение из кэша или вызывает loader() один раз на всех.
+
+        cacheable(value) позволяет не кэшировать неудачные результаты,
+        force=True пропускает поиск в кэше, но результат все равно сохраняется.
+        """
+        while True:
+            value, future, leader = self._begin(key, force)
+            if future is None:
+                return value
+            if leader:
+                break
+            try:
+                return future.result()
+            except _LoadAbandoned:
+                continue
+        try:
+            value = loader()
+        except Exception as e:
+            self._finish(key, future, None, e, ttl, cacheable)
+            raise
+        self._finish(key, future, value, None, ttl, cacheable)
+        return value
+
+    async def aget_or_load(self, key, loader, ttl=None, cacheable=None, force=False):
+        """Асинхронный вариант get_or_load: loader() возвращает корутину.
+
+        Если загружавшего отменили (например, по таймауту его обработчика),
+        ожидающие не получают его отмену: один из них загружает значение заново.
+        """
+        while True:
+            value, future, leader = self._begin(key, force)
+            if future is None:
+                return value
+            if leader:
+                break
+            try:
+                return await asyncio.wrap_future(future)
+            except _LoadAbandoned:
+                continue
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            # Отмена касается только загружавшего, но ожидающих нужно разбудить, иначе они зависнут
+            self._abandon(key, future)
+            raise
+        except BaseException as e:
+            self._finish(key, future, None, e, ttl, cacheable)
+            raise
+        self._finish(key, future, value, None, ttl, cacheable)
+        return value
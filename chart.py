@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import struct
+import zlib
+from dataclasses import dataclass, field
+
+from cache import TTLCache
+
+# Размеры графика: одна полоса на монету
+CHART_WIDTH = 480
+PANEL_HEIGHT = 96
+PADDING = 8
+
+BACKGROUND = (255, 255, 255)
+GRID = (225, 228, 232)
+SEPARATOR = (200, 204, 210)
+RISING = (46, 160, 67)
+FALLING = (207, 34, 46)
+
+
+@dataclass
+class Chart:
+    """Отрисованный график и file_id, под которым Telegram хранит его после первой загрузки"""
+    key: str
+    png: bytes
+    caption: str
+    file_id: str = None
+    # Загрузка одна на график: остальные отправки ждут file_id
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+def encode_png(width, height, rows):
+    """Кодирует RGB-изображение в PNG.
+
+    rows — bytes или bytearray, в котором каждая строка из width * 3 байт
+    предварена байтом фильтра (0).
+    """
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(bytes(rows), 6)) + chunk(b"IEND", b""))
+
+
+def resample(prices, count):
+    """Не больше count цен, равномерно выбранных из ряда (первая и последняя сохраняются)"""
+    if len(prices) <= count:
+        return list(prices)
+    step = (len(prices) - 1) / (count - 1)
+    return [prices[round(i * step)] for i in range(count)]
+
+
+def render_sparklines(series, width=CHART_WIDTH, panel_height=PANEL_HEIGHT):
+    """Рисует спарклайны монет одной картинкой: полоса на монету, сверху вниз.
+
+    series — список рядов цен. Линия зеленая, если цена за период выросла,
+    и красная, если упала; пунктир отмечает первую цену периода.
+    """
+    height = panel_height * len(series)
+    stride = 1 + width * 3
+    rows = bytearray((b"\x00" + bytes(BACKGROUND) * width) * height)
+
+    def put(x, y, color):
+        offset = y * stride + 1 + x * 3
+        rows[offset:offset + 3] = color
+
+    for index, prices in enumerate(series):
+        top = index * panel_height
+        if index:
+            rows[top * stride + 1:(top + 1) * stride] = bytes(SEPARATOR) * width
+        points = resample(prices, width - 2 * PADDING)
+        low, high = min(points), max(points)
+        span = high - low
+        inner = panel_height - 2 * PADDING
+
+        def y_of(price):
+            # Ровная цена рисуется посередине полосы
+            share = (price - low) / span if span else 0.5
+            return top + PADDING + round((1 - share) * (inner - 1))
+
+        base_y = y_of(points[0])
+        for x in range(PADDING, width - PADDING, 4):
+            put(x, base_y, GRID)
+            put(x + 1, base_y, GRID)
+
+        color = bytes(RISING if points[-1] >= points[0] else FALLING)
+        step = (width - 2 * PADDING - 1) / max(len(points) - 1, 1)
+        previous_x, previous_y = PADDING, y_of(points[0])
+        for i in range(1, len(points)):
+            x, y = PADDING + round(i * step), y_of(points[i])
+            # Отрезок рисуется вертикальными штрихами по столбцам: линия без разрывов толщиной 2 пикселя
+            for column in range(previous_x, x + 1):
+                share = (column - previous_x) / (x - previous_x) if x > previous_x else 1
+                target = round(previous_y + (y - previous_y) * share)
+                start = min(previous_y, target) if column == previous_x else min(last, target)
+                end = max(previous_y, target) if column == previous_x else max(last, target)
+                for row in range(start, end + 1):
+                    put(column, row, color)
+                    if row + 1 < top + panel_height:
+                        put(column, row + 1, color)
+                last = target
+            previous_x, previous_y = x, y
+
+    return encode_png(width, height, rows)
+
+
+def chart_key(coins, series, width):
+    """Адрес графика по содержимому: одинаковые ряды дают один ключ"""
+    digest = hashlib.sha1(repr((width, coins, series)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ChartRenderer:
+    """Графики цен с кэшем по содержимому.
+
+    Ключ графика — хеш рядов, по которым он рисуется, поэтому одинаковые
+    списки монет на одном тике рисуются один раз, а file_id, полученный после
+    первой загрузки в Telegram, переиспользуется всеми следующими отправками.
+    Старые графики вытесняются по LRU.
+    """
+
+    def __init__(self, maxsize=128, points=168, width=CHART_WIDTH):
+        self.points = points
+        self.width = width
+        self.cache = TTLCache(float("inf"), maxsize=maxsize)
+
+    def render(self, series, caption):
+        """График по рядам {монета: [цены]} или None, если ни у одной монеты нет хотя бы двух цен"""
+        coins = [coin for coin, prices in series.items() if len(prices) >= 2]
+        if not coins:
+            return None
+        rows = [list(series[coin][-self.points:]) for coin in coins]
+        key = chart_key(coins, rows, self.width)
+        # Одновременные запросы одного графика ждут одну отрисовку и получают один объект с общим file_id
+        return self.cache.get_or_load(key, lambda: Chart(key, render_sparklines(rows, self.width), caption))
+
+    def get(self, key):
+        """График по ключу или None, если он уже вытеснен"""
+        return self.cache.get(key)
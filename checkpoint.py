@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Компактное состояние бота для быстрого перезапуска.
+
+    Хранит последний снимок рынка, последний удачный анализ, дедлайны
+    выполненных плановых рассылок и хеш меню команд. Размер файла растет со
+    снимком рынка, примерно на 200 байт на монету: при сотнях монет в списках
+    чатов это сотни килобайт. Поэтому update() только меняет состояние в
+    памяти, а на диск оно пишется не чаще вызова write() по расписанию.
+    Файл перезаписывается атомарно, поэтому падение процесса во время
+    записи оставляет предыдущую версию.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        self._dirty = False
+
+    def load(self):
+        """Читает состояние с диска; отсутствующий или поврежденный файл дает пустое состояние"""
+        if not self.path or not os.path.exists(self.path):
+            return self.state
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.state = state if isinstance(state, dict) else {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка загрузки состояния бота: {e}")
+            self.state = {}
+        return self.state
+
+    def get(self, key, default=None):
+        """Значение поля состояния"""
+        return self.state.get(key, default)
+
+    def update(self, **values):
+        """Обновляет поля состояния в памяти; на диск они попадут при следующей записи"""
+        self.state.update(values)
+        self._dirty = True
+
+    def snapshot(self):
+        """Состояние в JSON для write(): снимается там, где оно меняется, а пишется где угодно.
+
+        None, если с прошлого снимка ничего не менялось.
+        """
+        if not self.path or not self._dirty:
+            return None
+        self._dirty = False
+        return json.dumps(self.state, ensure_ascii=False, separators=(',', ':'))
+
+    def write(self, data):
+        """Записывает снимок на диск (атомарной заменой файла); можно вызывать из другого потока"""
+        if data is None:
+            return
+        try:
+            # Воркеры кластера могут делить каталог: у каждого процесса свой временный файл
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния бота: {e}")
+            # Следующая запись повторит попытку
+            self._dirty = True
+
+    def save(self):
+        """Сохраняет изменения на диск (синхронно)"""
+        self.write(self.snapshot())
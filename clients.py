@@ -0,0 +1,231 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import httpx
+
+from resilience import UpstreamPolicy
+
+
+class AsyncHTTPClient:
+    """Пул HTTP-соединений с явными таймаутами подключения и чтения.
+
+    Пул создается в первом цикле событий, который к нему обратился. Вызовы из
+    другого цикла (например, asyncio.run в отдельном потоке) получают разовое
+    соединение, потому что соединения httpx нельзя переносить между циклами.
+    Все запросы идут через UpstreamPolicy: общий срок, повторы и предохранитель.
+    """
+
+    def __init__(self, connect_timeout=5.0, read_timeout=30.0, max_connections=20, policy=None):
+        self.policy = policy or UpstreamPolicy(type(self).__name__)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self._client = None
+        self._loop = None
+
+    def _new_client(self):
+        return httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+    @asynccontextmanager
+    async def session(self):
+        """Возвращает клиент из пула текущего цикла событий"""
+        loop = asyncio.get_running_loop()
+        # Пул, оставшийся от уже закрытого цикла, использовать нельзя
+        if self._client is None or self._client.is_closed or self._loop.is_closed():
+            self._client = self._new_client()
+            self._loop = loop
+        if self._loop is loop:
+            yield self._client
+        else:
+            async with self._new_client() as client:
+                yield client
+
+    async def aclose(self):
+        """Закрывает пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def chunk_ids(ids, max_length):
+    """Делит список id на части, чтобы каждая через запятую была не длиннее max_length символов"""
+    chunk, length = [], 0
+    for coin in ids:
+        extra = len(coin) + (1 if chunk else 0)
+        if chunk and length + extra > max_length:
+            yield chunk
+            chunk, length = [], 0
+            extra = len(coin)
+        chunk.append(coin)
+        length += extra
+    if chunk:
+        yield chunk
+
+
+class MarketDataClient(AsyncHTTPClient):
+    """Асинхронный клиент CoinGecko simple/price.
+
+    Длинный список монет не помещается в один URL, поэтому он делится на
+    части не длиннее max_ids_length символов, которые запрашиваются параллельно.
+    """
+
+    def __init__(self, url, max_ids_length=1500, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.max_ids_length = max_ids_length
+
+    async def get_prices(self, ids):
+        """Возвращает цены и изменение за 24 часа для списка монет"""
+        chunks = list(chunk_ids(ids, self.max_ids_length))
+        if len(chunks) <= 1:
+            return await self._get_chunk(chunks[0] if chunks else [])
+        results = await asyncio.gather(*(self._get_chunk(chunk) for chunk in chunks), return_exceptions=True)
+        data = {}
+        for result in results:
+            # Снимок без части монет хуже прошлого полного: ошибка любой части — ошибка всего запроса
+            if isinstance(result, BaseException):
+                raise result
+            data.update(result)
+        return data
+
+    async def _get_chunk(self, ids):
+        params = {
+            'ids': ','.join(ids),
+            'vs_currencies': 'usd',
+            'include_24hr_change': 'true',
+            'include_last_updated_at': 'true'
+        }
+        async with self.session() as client:
+            response = await self.policy.call(lambda: client.get(self.url, params=params))
+        response.raise_for_status()
+        return response.json()
+
+
+class CoinCapClient(AsyncHTTPClient):
+    """Асинхронный клиент CoinCap assets: запасной источник цен.
+
+    id монет CoinCap совпадают с id CoinGecko для большинства монет; ответ
+    переводится в формат CoinGecko simple/price, монеты, которых CoinCap не
+    знает, в нем просто отсутствуют.
+    """
+
+    def __init__(self, url, max_ids_length=1500, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.max_ids_length = max_ids_length
+
+    async def get_prices(self, ids):
+        """Возвращает цены в формате CoinGecko: {coin: {'usd', 'usd_24h_change', 'last_updated_at'}}"""
+        data = {}
+        results = await asyncio.gather(
+            *(self._get_chunk(chunk) for chunk in chunk_ids(ids, self.max_ids_length)), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+            data.update(result)
+        return data
+
+    async def _get_chunk(self, ids):
+        async with self.session() as client:
+            response = await self.policy.call(lambda: client.get(self.url, params={'ids': ','.join(ids)}))
+        response.raise_for_status()
+        body = response.json()
+        updated_at = int(body.get('timestamp', 0) / 1000) or None
+        data = {}
+        for asset in body.get('data', []):
+            try:
+                coin_data = {'usd': float(asset['priceUsd'])}
+            except (KeyError, TypeError, ValueError):
+                continue
+            if asset.get('changePercent24Hr') is not None:
+                coin_data['usd_24h_change'] = float(asset['changePercent24Hr'])
+            if updated_at:
+                coin_data['last_updated_at'] = updated_at
+            data[asset['id']] = coin_data
+        return data
+
+
+class AIClient(AsyncHTTPClient):
+    """Асинхронный клиент OpenAI-совместимого API (ProxyAPI)"""
+
+    def __init__(self, url, api_key, model, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+
+    async def complete(self, prompt, max_tokens=200, model=None):
+        """Отправляет запрос и возвращает ответ модели в виде JSON (model — вместо модели по умолчанию)"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens
+        }
+        async with self.session() as client:
+            response = await self.policy.call(lambda: client.post(self.url, headers=headers, json=payload))
+        return response.json()
+
+    async def stream_complete(self, prompt, max_tokens=200, on_delta=None, model=None):
+        """Запрашивает ответ в потоковом режиме (SSE) и вызывает on_delta(фрагмент) по мере генерации.
+
+        Возвращает собранный ответ в том же виде, что complete(). Если сервис
+        ответил ошибкой или обычным JSON, он возвращается как есть.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        parts = []
+        usage = None
+        async with self.session() as client:
+            request = client.build_request("POST", self.url, headers=headers, json=payload)
+            # Повторы и срок policy действуют до получения заголовков, дальше — таймаут чтения;
+            # успех учитывается в предохранителе, только когда поток дочитан до конца
+            async with self.policy.stream(lambda: client.send(request, stream=True)) as response:
+                try:
+                    if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                        await response.aread()
+                        return response.json()
+                    finished = False
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            finished = True
+                            break
+                        chunk = json.loads(data)
+                        usage = chunk.get("usage") or usage
+                        for choice in chunk.get("choices") or []:
+                            if choice.get("finish_reason"):
+                                finished = True
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                parts.append(delta)
+                                if on_delta is not None:
+                                    on_delta(delta)
+                    if not finished:
+                        raise httpx.RemoteProtocolError(f"{self.policy.name}: поток оборвался до конца ответа")
+                finally:
+                    await response.aclose()
+        result = {"usage": usage}
+        if parts:
+            result["choices"] = [{"message": {"role": "assistant", "content": "".join(parts)}}]
+        return result
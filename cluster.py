@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+
+
+@dataclass
+class ShardTask:
+    """Шард тика, который воркер взял на доставку"""
+    tick_id: str
+    shard: int
+    interval: int
+    text: str
+    # Тексты по группам рассылки: {ключ группы: текст}; пустой — всем чатам text
+    texts: dict = field(default_factory=dict)
+
+
+class ClusterCoordinator:
+    """Координация нескольких процессов рассылки через общую базу SQLite.
+
+    Лидер выбирается арендой (lease) в таблице cluster_leader: только он
+    получает данные, запрашивает анализ и публикует готовое сообщение тика.
+    Подписчики тика разбиты на shards частей по chat_id; воркеры забирают
+    шарды по одному, и шард умершего воркера (без heartbeat дольше
+    worker_timeout) забирает другой. Отправленные чаты записываются в
+    cluster_delivered, поэтому подхвативший шард воркер их пропускает.
+    """
+
+    def __init__(self, path, worker_id=None, shards=16, lease_seconds=15.0, worker_timeout=15.0):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.worker_timeout = worker_timeout
+        self.is_leader = False
+        # Каждый воркер начинает обход шардов со своего места, чтобы реже сталкиваться
+        self._offset = zlib.crc32(self.worker_id.encode()) % shards
+        # timeout: ожидание блокировки базы, которую держит другой процесс
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS cluster_workers ("
+            "worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS cluster_leader ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), worker_id TEXT, expires_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS cluster_ticks ("
+            "tick_id TEXT PRIMARY KEY, interval INTEGER NOT NULL, text TEXT NOT NULL, "
+            "created_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS cluster_shards ("
+            "tick_id TEXT NOT NULL, shard INTEGER NOT NULL, status TEXT NOT NULL, "
+            "worker_id TEXT, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (tick_id, shard)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS cluster_shards_status ON cluster_shards (status);"
+            "CREATE TABLE IF NOT EXISTS cluster_delivered ("
+            "tick_id TEXT NOT NULL, shard INTEGER NOT NULL, chat_id INTEGER NOT NULL, "
+            "PRIMARY KEY (tick_id, shard, chat_id)) WITHOUT ROWID;"
+            "INSERT OR IGNORE INTO cluster_leader (id, worker_id, expires_at) VALUES (1, NULL, 0);"
+        )
+        if "texts" not in {row[1] for row in self._conn.execute("PRAGMA table_info(cluster_ticks)")}:
+            self._conn.execute("ALTER TABLE cluster_ticks ADD COLUMN texts TEXT")
+
+    def _transaction(self, statements):
+        """Выполняет функцию statements(conn) в транзакции с блокировкой на запись"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def heartbeat(self):
+        """Отмечает воркер живым и продлевает (или захватывает) аренду лидера"""
+        now = time.time()
+
+        def statements(conn):
+            conn.execute(
+                "INSERT INTO cluster_workers (worker_id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.worker_id, now)
+            )
+            cursor = conn.execute(
+                "UPDATE cluster_leader SET worker_id = ?, expires_at = ? "
+                "WHERE id = 1 AND (worker_id = ? OR expires_at < ?)",
+                (self.worker_id, now + self.lease_seconds, self.worker_id, now)
+            )
+            return cursor.rowcount > 0
+
+        is_leader = self._transaction(statements)
+        if is_leader != self.is_leader:
+            print(f"👑 Воркер {self.worker_id} {'стал лидером' if is_leader else 'больше не лидер'}")
+        self.is_leader = is_leader
+        return is_leader
+
+    def live_workers(self):
+        """Идентификаторы воркеров с недавним heartbeat"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker_id FROM cluster_workers WHERE heartbeat >= ? ORDER BY worker_id",
+                (time.time() - self.worker_timeout,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def leader(self):
+        """Текущий лидер или None, если аренда истекла"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT worker_id FROM cluster_leader WHERE id = 1 AND expires_at >= ?", (time.time(),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def has_tick(self, tick_id):
+        """Опубликован ли тик"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM cluster_ticks WHERE tick_id = ?", (tick_id,)).fetchone()
+        return row is not None
+
+    def publish(self, tick_id, interval, text, texts=None):
+        """Публикует сообщение тика и создает его шарды; повторная публикация игнорируется.
+
+        texts — тексты по группам рассылки, {ключ группы: текст}: чаты группы
+        без текста в этом тике ничего не получают.
+        """
+        now = time.time()
+        encoded = json.dumps(texts, ensure_ascii=False) if texts else None
+
+        def statements(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cluster_ticks (tick_id, interval, text, texts, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (tick_id, int(interval), text, encoded, now)
+            )
+            if cursor.rowcount == 0:
+                return False
+            conn.executemany(
+                "INSERT INTO cluster_shards (tick_id, shard, status, worker_id, updated_at) "
+                "VALUES (?, ?, ?, NULL, ?)",
+                ((tick_id, shard, PENDING, now) for shard in range(self.shards))
+            )
+            return True
+
+        return self._transaction(statements)
+
+    def claim_shard(self):
+        """Забирает свободный шард или шард умершего воркера; None, если доставлять нечего"""
+        now = time.time()
+
+        def statements(conn):
+            row = conn.execute(
+                "SELECT s.tick_id, s.shard, t.interval, t.text, t.texts FROM cluster_shards s "
+                "JOIN cluster_ticks t ON t.tick_id = s.tick_id "
+                "WHERE s.status = ? OR (s.status = ? AND s.worker_id != ? AND NOT EXISTS ("
+                "  SELECT 1 FROM cluster_workers w WHERE w.worker_id = s.worker_id AND w.heartbeat >= ?)) "
+                "ORDER BY t.created_at, (s.shard - ? + ?) % ? LIMIT 1",
+                (PENDING, CLAIMED, self.worker_id, now - self.worker_timeout,
+                 self._offset, self.shards, self.shards)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE cluster_shards SET status = ?, worker_id = ?, updated_at = ? "
+                "WHERE tick_id = ? AND shard = ?",
+                (CLAIMED, self.worker_id, now, row[0], row[1])
+            )
+            return ShardTask(*row[:4], texts=json.loads(row[4]) if row[4] else {})
+
+        task = self._transaction(statements)
+        if task is not None:
+            print(f"📦 {self.worker_id}: шард {task.shard} тика {task.tick_id}")
+        return task
+
+    def delivered_chats(self, tick_id, shard):
+        """Чаты шарда, которым сообщение тика уже отправлено"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id FROM cluster_delivered WHERE tick_id = ? AND shard = ?", (tick_id, shard)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_delivered(self, tick_id, shard, chat_ids):
+        """Записывает отправленные чаты одной транзакцией"""
+        if not chat_ids:
+            return
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO cluster_delivered (tick_id, shard, chat_id) VALUES (?, ?, ?)",
+            ((tick_id, shard, int(chat_id)) for chat_id in chat_ids)
+        ))
+
+    def finish_shard(self, tick_id, shard):
+        """Отмечает шард доставленным"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE cluster_shards SET status = ?, updated_at = ? WHERE tick_id = ? AND shard = ? AND worker_id = ?",
+            (DONE, time.time(), tick_id, shard, self.worker_id)
+        ))
+
+    def release_shard(self, tick_id, shard):
+        """Возвращает недоставленный шард другим воркерам (при остановке)"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE cluster_shards SET status = ?, worker_id = NULL, updated_at = ? "
+            "WHERE tick_id = ? AND shard = ? AND worker_id = ? AND status = ?",
+            (PENDING, time.time(), tick_id, shard, self.worker_id, CLAIMED)
+        ))
+
+    def progress(self, tick_id):
+        """Число шардов тика по статусам"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM cluster_shards WHERE tick_id = ? GROUP BY status", (tick_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def prune(self, older_than):
+        """Удаляет тики старше older_than секунд вместе с прогрессом и давно молчащих воркеров"""
+        cutoff = time.time() - older_than
+
+        def statements(conn):
+            tick_ids = [row[0] for row in conn.execute(
+                "SELECT tick_id FROM cluster_ticks WHERE created_at < ?", (cutoff,)
+            )]
+            for table in ("cluster_delivered", "cluster_shards", "cluster_ticks"):
+                conn.executemany(f"DELETE FROM {table} WHERE tick_id = ?", ((tick_id,) for tick_id in tick_ids))
+            conn.execute("DELETE FROM cluster_workers WHERE heartbeat < ?", (cutoff,))
+            return len(tick_ids)
+
+        return self._transaction(statements)
+
+    def leave(self):
+        """Снимает воркер с учета и отдает аренду лидера"""
+        def statements(conn):
+            conn.execute("DELETE FROM cluster_workers WHERE worker_id = ?", (self.worker_id,))
+            conn.execute("UPDATE cluster_leader SET expires_at = 0 WHERE id = 1 AND worker_id = ?", (self.worker_id,))
+
+        self._transaction(statements)
+        self.is_leader = False
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,151 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Решения по группе рассылки на очередном тике
+SEND = "send"      # цены изменились сильнее порога: полный анализ
+DIGEST = "digest"  # изменений нет давно: сводка без анализа ИИ
+SKIP = "skip"      # изменения ниже порога: тик пропускается
+
+
+@dataclass
+class DeliveryState:
+    """Последнее сообщение, доставленное группе, и тики, пропущенные после него"""
+    prices: dict
+    delivered_at: float
+    skipped: int = 0
+    # Минимальные и максимальные цены с момента последнего сообщения
+    lows: dict = field(default_factory=dict)
+    highs: dict = field(default_factory=dict)
+
+
+def max_change(base, prices):
+    """Наибольшее изменение цены относительно base в процентах.
+
+    Монета без базовой цены (например, только что добавленная в список)
+    считается сильным изменением.
+    """
+    change = 0.0
+    for coin, price in prices.items():
+        previous = base.get(coin)
+        if not previous:
+            return float('inf')
+        change = max(change, abs(price / previous - 1) * 100)
+    return change
+
+
+class DeltaEngine:
+    """Подавление рассылки без заметных изменений цен.
+
+    Для каждой группы рассылки (интервал, список монет, порог) хранится снимок
+    цен, отправленный ей последним. Если ни одна монета с тех пор не сдвинулась
+    на порог, тик пропускается без запроса к ИИ и отправки; пропущенные тики
+    копятся и раз в digest_interval уходят одной сводкой. Движение на порог
+    и больше отправляется всегда. Состояние групп хранится в SQLite, чтобы
+    перезапуск не вызывал лишнюю рассылку.
+    """
+
+    def __init__(self, path, digest_interval=21600):
+        self.digest_interval = digest_interval
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS delivery_state ("
+            "group_key TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.states = {}
+        self._dirty = set()
+        self.reload()
+
+    def reload(self):
+        """Перечитывает состояние групп из базы, забывая записанное только в памяти.
+
+        Нужно процессу, который стал лидером кластера: пока лидером был
+        другой процесс, состояние в базе менял он.
+        """
+        states = {}
+        with self._lock:
+            rows = self._conn.execute("SELECT group_key, state FROM delivery_state").fetchall()
+        for key, state in rows:
+            try:
+                states[key] = DeliveryState(**json.loads(state))
+            except (TypeError, ValueError) as e:
+                logger.error(f"Ошибка чтения состояния группы {key}: {e}")
+        self.states = states
+        self._dirty.clear()
+
+    def decide(self, key, prices, threshold, now=None):
+        """Решение для группы: SEND, DIGEST или SKIP"""
+        now = time.time() if now is None else now
+        state = self.states.get(key)
+        if state is None or threshold <= 0 or max_change(state.prices, prices) >= threshold:
+            return SEND
+        if now - state.delivered_at >= self.digest_interval:
+            return DIGEST
+        return SKIP
+
+    def skip(self, key, prices):
+        """Учитывает пропущенный тик группы; возвращает ее состояние"""
+        state = self.states[key]
+        state.skipped += 1
+        for coin, price in prices.items():
+            state.lows[coin] = min(state.lows.get(coin, price), price)
+            state.highs[coin] = max(state.highs.get(coin, price), price)
+        self._dirty.add(key)
+        return state
+
+    def delivered(self, key, prices, now=None):
+        """Запоминает снимок, отправленный группе: следующие тики сравниваются с ним.
+
+        Вызывается только после успешной отправки: если анализ или рассылка не
+        удались, следующий тик сравнивается с прежним снимком и отправляется снова.
+        """
+        now = time.time() if now is None else now
+        self.states[key] = DeliveryState(dict(prices), now, lows=dict(prices), highs=dict(prices))
+        self._dirty.add(key)
+
+    def flush(self):
+        """Записывает измененные состояния групп одной транзакцией"""
+        if not self._dirty:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO delivery_state (group_key, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(group_key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                ((key, json.dumps(asdict(self.states[key])), now) for key in self._dirty if key in self.states)
+            )
+            self._conn.commit()
+        self._dirty.clear()
+
+    def prune(self, older_than):
+        """Забывает группы, по которым не было тиков дольше older_than секунд (в них не осталось чатов)"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(
+                "SELECT group_key FROM delivery_state WHERE updated_at < ?", (cutoff,)
+            )]
+            self._conn.execute("DELETE FROM delivery_state WHERE updated_at < ?", (cutoff,))
+            self._conn.commit()
+        for key in keys:
+            self.states.pop(key, None)
+
+    def clear(self):
+        """Забывает состояние всех групп: следующий тик отправляется всем"""
+        with self._lock:
+            self._conn.execute("DELETE FROM delivery_state")
+            self._conn.commit()
+        self.states.clear()
+        self._dirty.clear()
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,300 @@
+import base64
+import json
+import logging
+import math
+import os
+import time
+from array import array
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Модуль NumPy (False, если не установлен); загружается при первом пересчете
+_numpy_module = None
+
+# Параметры индикаторов по умолчанию (в отсчетах, а не в часах)
+SMA_WINDOW = 24
+EMA_PERIOD = 12
+RSI_PERIOD = 14
+VOLATILITY_WINDOW = 24
+
+
+def _numpy():
+    """NumPy или None: импорт отложен, потому что заметно удлиняет запуск бота"""
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+
+class CoinSeries:
+    """Кольцевой буфер цен одной монеты с индикаторами, обновляемыми за O(1).
+
+    Хранит отметки времени и цены в массивах array('d') фиксированного размера.
+    SMA и волатильность считаются по скользящим суммам, EMA и RSI (сглаживание
+    Уайлдера) — рекуррентно, просадка — от максимума в буфере через монотонную очередь.
+    """
+
+    def __init__(self, capacity=1000, sma_window=SMA_WINDOW, ema_period=EMA_PERIOD,
+                 rsi_period=RSI_PERIOD, volatility_window=VOLATILITY_WINDOW):
+        # Окна должны помещаться в буфер: вытесняемые значения читаются из него
+        self.capacity = max(capacity, sma_window + 1, volatility_window + 2)
+        self.sma_window = sma_window
+        self.ema_alpha = 2 / (ema_period + 1)
+        self.rsi_period = rsi_period
+        self.volatility_window = volatility_window
+        self.times = array('d', bytes(8 * self.capacity))
+        self.prices = array('d', bytes(8 * self.capacity))
+        self.count = 0
+        self._reset_state()
+
+    def _reset_state(self):
+        self.price_sum = 0.0
+        self.return_sum = 0.0
+        self.return_sq_sum = 0.0
+        self.ema = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.rsi_samples = 0
+        self._peaks = deque()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def price_at(self, index):
+        """Цена по абсолютному номеру отсчета (должна еще быть в буфере)"""
+        return self.prices[index % self.capacity]
+
+    def _return_at(self, index):
+        """Логарифмическая доходность отсчета index относительно предыдущего"""
+        return math.log(self.price_at(index) / self.price_at(index - 1))
+
+    def append(self, timestamp, price):
+        """Добавляет отсчет и обновляет индикаторы"""
+        index = self.count
+        previous = self.price_at(index - 1) if index > 0 else None
+        self.times[index % self.capacity] = timestamp
+        self.prices[index % self.capacity] = price
+        self.count += 1
+
+        # SMA: прибавляем новую цену и вычитаем вышедшую из окна
+        self.price_sum += price
+        if index >= self.sma_window:
+            self.price_sum -= self.price_at(index - self.sma_window)
+
+        # EMA
+        self.ema = price if self.ema is None else self.ema + self.ema_alpha * (price - self.ema)
+
+        if previous is not None:
+            # Волатильность: скользящие суммы доходностей и их квадратов
+            log_return = math.log(price / previous)
+            self.return_sum += log_return
+            self.return_sq_sum += log_return * log_return
+            if index > self.volatility_window:
+                old_return = self._return_at(index - self.volatility_window)
+                self.return_sum -= old_return
+                self.return_sq_sum -= old_return * old_return
+
+            # RSI: сглаживание Уайлдера
+            change = price - previous
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            self.rsi_samples += 1
+            weight = 1 / min(self.rsi_samples, self.rsi_period)
+            self.avg_gain += weight * (gain - self.avg_gain)
+            self.avg_loss += weight * (loss - self.avg_loss)
+
+        # Просадка: в очереди только цены, которые еще могут стать максимумом
+        while self._peaks and self._peaks[-1][1] <= price:
+            self._peaks.pop()
+        self._peaks.append((index, price))
+        while self._peaks[0][0] <= index - self.capacity:
+            self._peaks.popleft()
+
+    def indicators(self):
+        """Текущие значения индикаторов или None, если отсчетов нет"""
+        if self.count == 0:
+            return None
+        price = self.price_at(self.count - 1)
+        sma_count = min(self.count, self.sma_window)
+        returns_count = min(self.count - 1, self.volatility_window)
+        volatility = None
+        if returns_count >= 2:
+            mean = self.return_sum / returns_count
+            variance = max(self.return_sq_sum / returns_count - mean * mean, 0.0)
+            volatility = math.sqrt(variance) * 100
+        rsi = None
+        if self.rsi_samples >= self.rsi_period:
+            rsi = 100.0 if self.avg_loss == 0 else 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+        return {
+            'samples': len(self),
+            'sma': self.price_sum / sma_count,
+            'ema': self.ema,
+            'rsi': rsi,
+            'volatility': volatility,
+            'drawdown': (price / self._peaks[0][1] - 1) * 100
+        }
+
+    def series(self):
+        """Отметки времени и цены из буфера в хронологическом порядке"""
+        start = max(0, self.count - self.capacity)
+        indices = [i % self.capacity for i in range(start, self.count)]
+        return [self.times[i] for i in indices], [self.prices[i] for i in indices]
+
+    def recompute(self):
+        """Пересчитывает состояние индикаторов по содержимому буфера.
+
+        Убирает накопленную погрешность скользящих сумм. С NumPy итоговые
+        значения считаются векторно, без NumPy отсчеты проигрываются заново.
+        """
+        times, prices = self.series()
+        np = _numpy()
+        if np is None or len(prices) < 2:
+            self.count = 0
+            self._reset_state()
+            for timestamp, price in zip(times, prices):
+                self.append(timestamp, price)
+            return
+
+        values = np.asarray(prices, dtype=float)
+        self._reset_state()
+        self.price_sum = float(values[-self.sma_window:].sum())
+        returns = np.diff(np.log(values))
+        window_returns = returns[-self.volatility_window:]
+        self.return_sum = float(window_returns.sum())
+        self.return_sq_sum = float((window_returns * window_returns).sum())
+        self.ema = ewm_last(values, self.ema_alpha)
+        changes = np.diff(values)
+        self.rsi_samples = len(changes)
+        self.avg_gain = wilder_last(np.maximum(changes, 0.0), self.rsi_period)
+        self.avg_loss = wilder_last(np.maximum(-changes, 0.0), self.rsi_period)
+        # Монотонная очередь максимумов: цены, которые больше всех последующих
+        suffix_max = np.maximum.accumulate(values[::-1])[::-1]
+        start = self.count - len(values)
+        for offset in range(len(values)):
+            later = suffix_max[offset + 1] if offset + 1 < len(values) else -math.inf
+            if values[offset] > later:
+                self._peaks.append((start + offset, float(values[offset])))
+
+
+def ewm_last(values, alpha):
+    """Последнее значение экспоненциального среднего, начиная с первого элемента"""
+    np = _numpy()
+    weights = (1 - alpha) ** np.arange(len(values) - 1, -1, -1, dtype=float)
+    weights[1:] *= alpha
+    return float(np.dot(weights, values))
+
+
+def wilder_last(values, period):
+    """Последнее значение сглаживания Уайлдера (первые period отсчетов — простое среднее)"""
+    if len(values) <= period:
+        return float(values.mean())
+    seed = values[:period].mean()
+    return ewm_last(_numpy().concatenate(([seed], values[period:])), 1 / period)
+
+
+class PriceHistory:
+    """История цен по монетам с сохранением на диск"""
+
+    def __init__(self, path=None, capacity=1000):
+        self.path = path
+        self.capacity = capacity
+        self.coins = {}
+        # Отложенная загрузка: файл читается при первом обращении к истории
+        self._load_pending = False
+
+    def update(self, snapshot, timestamp=None):
+        """Добавляет цены из ответа CoinGecko ({coin: {'usd': ...}})"""
+        self._ensure_loaded()
+        timestamp = time.time() if timestamp is None else timestamp
+        for coin, data in snapshot.items():
+            price = data.get('usd') if isinstance(data, dict) else None
+            if not isinstance(price, (int, float)) or price <= 0:
+                continue
+            series = self.coins.get(coin)
+            if series is None:
+                series = self.coins[coin] = CoinSeries(self.capacity)
+            series.append(timestamp, float(price))
+
+    def indicators(self, coin):
+        """Индикаторы монеты или None, если истории нет"""
+        self._ensure_loaded()
+        series = self.coins.get(coin)
+        return series.indicators() if series is not None else None
+
+    def prices(self, coin, limit=None):
+        """Последние limit цен монеты в хронологическом порядке (пустой список, если истории нет)"""
+        self._ensure_loaded()
+        series = self.coins.get(coin)
+        if series is None:
+            return []
+        prices = series.series()[1]
+        return prices[-limit:] if limit else prices
+
+    def snapshot(self):
+        """Копия буферов для write(): снимается там, где история меняется, а пишется где угодно.
+
+        None, если сохранять нечего: не загруженная история не менялась, и
+        перезапись файла пустой историей потеряла бы ее.
+        """
+        if not self.path or self._load_pending:
+            return None
+        state = {}
+        for coin, series in self.coins.items():
+            times, prices = series.series()
+            state[coin] = {'times': array('d', times).tobytes(), 'prices': array('d', prices).tobytes()}
+        return state
+
+    def write(self, state):
+        """Записывает снимок буферов на диск (атомарной заменой файла); можно вызывать из другого потока"""
+        if state is None:
+            return
+        try:
+            coins = {
+                coin: {key: base64.b64encode(value).decode('ascii') for key, value in data.items()}
+                for coin, data in state.items()
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'capacity': self.capacity, 'coins': coins}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения истории цен: {e}")
+
+    def save(self):
+        """Сохраняет буферы на диск (синхронно)"""
+        self.write(self.snapshot())
+
+    def _ensure_loaded(self):
+        if self._load_pending:
+            self.load()
+
+    def load(self, lazy=False):
+        """Загружает буферы с диска и пересчитывает индикаторы.
+
+        lazy=True откладывает загрузку до первого обращения к истории.
+        """
+        self._load_pending = lazy
+        if lazy or not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            for coin, data in state.get('coins', {}).items():
+                times = array('d', base64.b64decode(data['times']))
+                prices = array('d', base64.b64decode(data['prices']))
+                series = CoinSeries(self.capacity)
+                # Последние отсчеты раскладываются в буфер, индикаторы считаются разом
+                for timestamp, price in list(zip(times, prices))[-series.capacity:]:
+                    series.times[series.count % series.capacity] = timestamp
+                    series.prices[series.count % series.capacity] = price
+                    series.count += 1
+                series.recompute()
+                self.coins[coin] = series
+            print(f"📈 Загружена история цен: {len(self.coins)} монет")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки истории цен: {e}")
+            print(f"Ошибка загрузки истории цен: {e}")
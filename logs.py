@@ -0,0 +1,105 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import datetime, timedelta
+
+# Атрибуты, которые есть у любой записи: все остальные пришли через extra и попадают в JSON
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Библиотеки, которые пишут строку на каждый HTTP-запрос: при рассылке это строка на чат
+NOISY_LOGGERS = ("httpx", "httpcore")
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Файл лога, который ротируется по размеру и в полночь.
+
+    Прошлые файлы получают номера .1, .2, ... (.1 — самый свежий), хранится
+    не больше backup_count файлов. Файл, оставшийся со вчерашнего дня,
+    ротируется при первой записи после перезапуска.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=7):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        started = os.path.getmtime(path) if os.path.exists(path) else time.time()
+        self.rollover_at = next_midnight(started)
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = next_midnight(time.time())
+
+
+def next_midnight(timestamp):
+    """Отметка времени ближайшей полуночи (по местному времени) после timestamp"""
+    day = datetime.fromtimestamp(timestamp).date() + timedelta(days=1)
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+class TimedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который считает записи и время, потраченное на них вызывающим кодом.
+
+    Вызывающий поток только кладет запись в очередь; форматирование и запись
+    на диск идут в потоке QueueListener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.records = 0
+        self.seconds = 0.0
+
+    def handle(self, record):
+        started = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            self.records += 1
+            self.seconds += time.perf_counter() - started
+
+
+def setup_logging(path, level="INFO", max_bytes=10 * 1024 * 1024, backup_count=7):
+    """Настраивает неблокирующее логирование в JSON с ротацией.
+
+    Все логгеры пишут в очередь, файл пишет отдельный поток; перед выходом
+    очередь дописывается. Возвращает TimedQueueHandler: по нему видно, во
+    сколько логирование обходится вызывающему коду.
+    """
+    file_handler = RotatingLogHandler(path, max_bytes=max_bytes, backup_count=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    handler = TimedQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.addHandler(handler)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    return handler
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "tradebot"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: запись — один bisect и два сложения"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Последняя ячейка — значения больше самой верхней границы (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Добавляет наблюдение"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Пары (граница, число наблюдений не больше нее), как в формате Prometheus"""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Оценка квантиля сверху: граница корзины, в которую он попадает"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class Stage:
+    """Метрики одного этапа: задержка, исходы по статусам и число выполняемых сейчас"""
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.latency = Histogram(buckets)
+        self.statuses = {}
+        self.in_flight = 0
+
+    def record(self, seconds, status="ok"):
+        """Учитывает завершенный вызов"""
+        self.latency.observe(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class Span:
+    """Текущий замер внутри Metrics.track: вызывающий может поменять статус"""
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "ok"
+
+
+class Family:
+    """Счетчик или датчик с одной меткой; значения читаются функцией read() -> {значение метки: число}"""
+
+    def __init__(self, name, kind, help_text, label, read):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.label = label
+        self.read = read
+
+
+class Metrics:
+    """Реестр метрик по этапам (данные, анализ, форматирование, отправка).
+
+    Метрики обновляются без блокировок из цикла событий бота: запись стоит
+    несколько операций со словарем и списком, поэтому подходит и для
+    отправки десятков тысяч сообщений за рассылку.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        # Счетчики и датчики, которые считают сами компоненты бота (очереди, лимиты)
+        self.families = {}
+        self.started_at = time.time()
+
+    def stage(self, name):
+        """Возвращает (создает при первом обращении) метрики этапа"""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name, self.buckets)
+        return stage
+
+    def record(self, name, seconds, status="ok"):
+        """Учитывает завершенный вызов этапа"""
+        self.stage(name).record(seconds, status)
+
+    def register(self, name, kind, help_text, label, read):
+        """Публикует значения компонента: kind — "counter" или "gauge", read() -> {значение метки: число}"""
+        self.families[name] = Family(name, kind, help_text, label, read)
+
+    @contextmanager
+    def track(self, name):
+        """Замеряет блок кода как вызов этапа; исключение учитывается как error"""
+        stage = self.stage(name)
+        span = Span()
+        stage.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            stage.in_flight -= 1
+            stage.record(time.perf_counter() - start, span.status)
+
+    def render(self):
+        """Текст в формате Prometheus exposition"""
+        lines = [
+            f"# HELP {PREFIX}_stage_duration_seconds Длительность этапа",
+            f"# TYPE {PREFIX}_stage_duration_seconds histogram",
+        ]
+        for name, stage in sorted(self.stages.items()):
+            for bound, total in stage.latency.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{PREFIX}_stage_duration_seconds_bucket{{stage="{name}",le="{le}"}} {total}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_sum{{stage="{name}"}} {stage.latency.sum}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_count{{stage="{name}"}} {stage.latency.count}')
+
+        lines += [
+            f"# HELP {PREFIX}_stage_requests_total Завершенные вызовы этапа по статусу",
+            f"# TYPE {PREFIX}_stage_requests_total counter",
+        ]
+        for name, stage in sorted(self.stages.items()):
+            for status, count in sorted(stage.statuses.items()):
+                lines.append(f'{PREFIX}_stage_requests_total{{stage="{name}",status="{status}"}} {count}')
+
+        lines += [
+            f"# HELP {PREFIX}_stage_in_flight Вызовы этапа, выполняемые сейчас",
+            f"# TYPE {PREFIX}_stage_in_flight gauge",
+        ]
+        for name, stage in sorted(self.stages.items()):
+            lines.append(f'{PREFIX}_stage_in_flight{{stage="{name}"}} {stage.in_flight}')
+
+        for name, family in sorted(self.families.items()):
+            lines += [
+                f"# HELP {PREFIX}_{name} {family.help}",
+                f"# TYPE {PREFIX}_{name} {family.kind}",
+            ]
+            for value, count in sorted(family.read().items()):
+                lines.append(f'{PREFIX}_{name}{{{family.label}="{value}"}} {count}')
+
+        lines += [
+            f"# HELP {PREFIX}_start_time_seconds Время запуска бота",
+            f"# TYPE {PREFIX}_start_time_seconds gauge",
+            f"{PREFIX}_start_time_seconds {self.started_at}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Краткая сводка по этапам для админ-команды"""
+        if not self.stages and not self.families:
+            return ["Пока нет данных"]
+        lines = []
+        for name, stage in sorted(self.stages.items()):
+            latency = stage.latency
+            if not latency.count:
+                continue
+            statuses = ", ".join(f"{status}: {count}" for status, count in sorted(stage.statuses.items()))
+            lines.append(
+                f"{name}: {latency.count} вызовов, среднее {latency.sum / latency.count:.3f} с, "
+                f"p50 ≤ {latency.quantile(0.5):g} с, p95 ≤ {latency.quantile(0.95):g} с, "
+                f"в работе {stage.in_flight} ({statuses})"
+            )
+        for name, family in sorted(self.families.items()):
+            values = ", ".join(f"{value}: {count}" for value, count in sorted(family.read().items()))
+            lines.append(f"{name}: {values or 'нет данных'}")
+        return lines
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus на цикле событий бота"""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Заголовки не нужны, но их нужно дочитать
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+                status, body = "200 OK", self.metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.error(f"Ошибка ответа на запрос метрик: {e}")
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Начинает принимать запросы"""
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        """Останавливает сервер"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,261 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from broadcast import DEAD, FAILED, RETRY, SENT
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+# Сообщение устарело раньше, чем его удалось доставить
+EXPIRED = "expired"
+
+# Сколько исходов отправки копится в памяти перед записью в базу
+RECORD_BATCH = 100
+
+
+class Outbox:
+    """Постоянная очередь доставки сообщений в SQLite.
+
+    Перед рассылкой каждый получатель тика записывается в таблицу outbox.
+    Доставленные строки удаляются, временные ошибки (429, 5xx, сеть)
+    откладываются на растущую задержку, после max_attempts попыток строка
+    остается со статусом failed. Если процесс упал посреди рассылки,
+    недоставленные строки остаются в базе и отправляются после перезапуска.
+    Строки тика старше ttl секунд не отправляются, а помечаются expired:
+    после долгого простоя чаты не получают устаревший анализ рынка.
+
+    Текст хранится один раз на тик: по одному на каждую группу рассылки
+    (строка помнит только ключ своей группы), отдельный текст строки — только
+    у алертов. Графики групп в базе не хранятся: в тике записаны только их
+    ключи, а сами картинки берутся из кэша графиков при отправке.
+    """
+
+    def __init__(self, path, max_attempts=5, base_delay=30.0, max_delay=1800.0, ttl=None):
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_ticks ("
+            "tick_id TEXT PRIMARY KEY, text TEXT, created_at REAL NOT NULL)"
+        )
+        # text строки задается, только если он отличается от общего текста тика (алерты)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "tick_id TEXT NOT NULL, chat_id INTEGER NOT NULL, text TEXT, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL DEFAULT 0, error TEXT, "
+            "PRIMARY KEY (tick_id, chat_id)) WITHOUT ROWID"
+        )
+        # Тексты тика по группам рассылки (JSON {ключ группы: текст}) и ключ группы строки
+        tick_columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox_ticks)")}
+        if "texts" not in tick_columns:
+            self._conn.execute("ALTER TABLE outbox_ticks ADD COLUMN texts TEXT")
+        # Ключи графиков тика по группам рассылки (JSON {ключ группы: ключ графика})
+        if "charts" not in tick_columns:
+            self._conn.execute("ALTER TABLE outbox_ticks ADD COLUMN charts TEXT")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "watchlist" in columns:
+            # Раньше группой рассылки был только список монет
+            self._conn.execute("ALTER TABLE outbox RENAME COLUMN watchlist TO group_key")
+        elif "group_key" not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN group_key TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._conn.commit()
+
+    def enqueue_messages(self, tick_id, messages):
+        """Записывает пары (chat_id, text) с отдельным текстом для каждого чата"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox_ticks (tick_id, text, created_at) VALUES (?, NULL, ?)",
+                (tick_id, time.time())
+            )
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (tick_id, chat_id, text, status) VALUES (?, ?, ?, ?)",
+                ((tick_id, int(chat_id), text, PENDING) for chat_id, text in messages)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def enqueue_groups(self, tick_id, members, texts, charts=None):
+        """Записывает пары (chat_id, ключ группы) с текстами групп {ключ группы: текст}.
+
+        charts — ключи графиков, которые отправляются перед текстом группы
+        ({ключ группы: ключ графика}). Чаты, для группы которых нет текста (тик
+        группы пропущен или чат сменил группу после подготовки тика), не записываются.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox_ticks (tick_id, text, texts, charts, created_at) VALUES (?, NULL, ?, ?, ?)",
+                (tick_id, json.dumps(texts, ensure_ascii=False), json.dumps(charts) if charts else None, time.time())
+            )
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (tick_id, chat_id, group_key, status) VALUES (?, ?, ?, ?)",
+                ((tick_id, int(chat_id), group, PENDING) for chat_id, group in members if group in texts)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def due_ticks(self):
+        """Тики, у которых есть строки, готовые к отправке (устаревшие строки перед этим помечаются expired)"""
+        self.expire()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT o.tick_id FROM outbox o JOIN outbox_ticks t ON t.tick_id = o.tick_id "
+                "WHERE o.status = ? AND o.next_attempt_at <= ? ORDER BY t.created_at",
+                (PENDING, time.time())
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_due(self, tick_id, batch_size=1000, chart_store=None):
+        """Постранично перебирает пары (chat_id, text) тика, готовые к отправке.
+
+        Если у группы строки есть график и он еще есть в chart_store (объект с
+        get(ключ)), вместо текста отдается пара (график, текст). Вытесненный
+        график (например, после перезапуска) пропускается: текст доставляется без него.
+        """
+        text, texts, charts = None, {}, {}
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, texts, charts FROM outbox_ticks WHERE tick_id = ?", (tick_id,)
+            ).fetchone()
+        if row is not None:
+            text = row[0]
+            texts = json.loads(row[1]) if row[1] else {}
+            if row[2] and chart_store is not None:
+                charts = {group: chart_store.get(key) for group, key in json.loads(row[2]).items()}
+        # Момент начала фиксируется: отложенные во время перебора строки не попадут в него снова
+        now = time.time()
+        last_id = -2 ** 63
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT chat_id, text, group_key FROM outbox "
+                    "WHERE tick_id = ? AND chat_id > ? AND status = ? AND next_attempt_at <= ? "
+                    "ORDER BY chat_id LIMIT ?",
+                    (tick_id, last_id, PENDING, now, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for chat_id, chat_text, group in rows:
+                if chat_text is None:
+                    chat_text = texts.get(group, text) if group is not None else text
+                chart = charts.get(group)
+                yield chat_id, (chart, chat_text) if chart is not None else chat_text
+            last_id = rows[-1][0]
+
+    def expire(self):
+        """Помечает expired недоставленные строки тиков старше ttl; возвращает их число"""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE outbox SET status = '{EXPIRED}' WHERE status = ? AND tick_id IN "
+                f"(SELECT tick_id FROM outbox_ticks WHERE created_at < ?)",
+                (PENDING, time.time() - self.ttl)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.warning(f"Очередь доставки: {cursor.rowcount} сообщений устарели и не будут отправлены")
+        return cursor.rowcount
+
+    def backoff(self, attempts):
+        """Задержка перед следующей попыткой: экспоненциальная со случайным разбросом"""
+        delay = min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0))
+        return delay * random.uniform(0.5, 1.0)
+
+    def record(self, tick_id, outcomes):
+        """Записывает исходы [(chat_id, исход, ошибка)] одной транзакцией"""
+        if not outcomes:
+            return
+        now = time.time()
+        done, retries, failed = [], [], []
+        for chat_id, outcome, error in outcomes:
+            if outcome in (SENT, DEAD):
+                # Доставленные и недоступные чаты больше не нужны в очереди
+                done.append((tick_id, int(chat_id)))
+            elif outcome == RETRY:
+                retries.append((chat_id, error))
+            else:
+                failed.append((error, tick_id, int(chat_id)))
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE tick_id = ? AND chat_id = ?", done)
+            if retries:
+                attempts = dict(self._conn.execute(
+                    f"SELECT chat_id, attempts FROM outbox WHERE tick_id = ? "
+                    f"AND chat_id IN ({','.join('?' * len(retries))})",
+                    (tick_id, *(int(chat_id) for chat_id, _ in retries))
+                ).fetchall())
+                updates = []
+                for chat_id, error in retries:
+                    attempt = attempts.get(int(chat_id), 0) + 1
+                    if attempt >= self.max_attempts:
+                        failed.append((error, tick_id, int(chat_id)))
+                    else:
+                        updates.append((attempt, now + self.backoff(attempt), error, tick_id, int(chat_id)))
+                self._conn.executemany(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, error = ? WHERE tick_id = ? AND chat_id = ?",
+                    updates
+                )
+            self._conn.executemany(
+                f"UPDATE outbox SET status = '{FAILED}', attempts = attempts + 1, error = ? "
+                f"WHERE tick_id = ? AND chat_id = ?",
+                failed
+            )
+            self._conn.commit()
+
+    def recorder(self, tick_id):
+        """Функция для Broadcaster.deliver(on_result=...), записывающая исходы пачками.
+
+        Возвращает (on_result, flush): flush() нужно вызвать в конце рассылки.
+        """
+        buffer = []
+
+        def flush():
+            self.record(tick_id, buffer)
+            buffer.clear()
+
+        def on_result(chat_id, outcome, error=None):
+            buffer.append((chat_id, outcome, error))
+            if len(buffer) >= RECORD_BATCH:
+                flush()
+
+        return on_result, flush
+
+    def stats(self):
+        """Число строк очереди по статусам и число отложенных на повтор"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            counts["retrying"] = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = ? AND attempts > 0", (PENDING,)
+            ).fetchone()[0]
+        return counts
+
+    def prune(self, older_than):
+        """Удаляет неудавшиеся и устаревшие строки старше older_than секунд и тики без строк"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM outbox WHERE status IN (?, ?) AND tick_id IN "
+                "(SELECT tick_id FROM outbox_ticks WHERE created_at < ?)",
+                (FAILED, EXPIRED, cutoff)
+            )
+            self._conn.execute(
+                "DELETE FROM outbox_ticks WHERE NOT EXISTS "
+                "(SELECT 1 FROM outbox o WHERE o.tick_id = outbox_ticks.tick_id)"
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Закрывает соединение с базой"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+
+from resilience import OPEN
+
+logger = logging.getLogger(__name__)
+
+# Режимы сбора цен
+FIRST = "first"    # первый годный ответ; следующий источник запускается, если текущий задерживается
+MEDIAN = "median"  # все источники параллельно, цена монеты — медиана ответов
+
+
+class SourceStats:
+    """Задержки и качество ответов одного источника цен"""
+
+    def __init__(self, window=50):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.stale = 0
+        self.outliers = 0
+        # Сколько раз источник не ответил за свою p90 и был подстрахован следующим
+        self.hedged = 0
+        # Возраст данных в последнем ответе, секунд
+        self.last_age = None
+        self.last_request_at = 0.0
+        # Отмененный запрос длился не меньше стольких секунд: нижняя оценка задержки,
+        # в выборку latencies не попадает и сбрасывается первым настоящим замером
+        self.lower_bound = None
+
+    def quantile(self, q):
+        """Квантиль задержки по последним ответам или None, если ответов еще не было"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def data_age(data, now=None):
+    """Возраст самых свежих данных ответа в секундах (None, если источник не сообщает время)"""
+    now = time.time() if now is None else now
+    updated_at = [quote['last_updated_at'] for quote in data.values() if quote.get('last_updated_at')]
+    return now - max(updated_at) if updated_at else None
+
+
+class PriceAggregator:
+    """Цены из нескольких источников с подстраховкой медленных запросов.
+
+    Источник — любой объект с policy (UpstreamPolicy, ее имя — имя источника)
+    и async get_prices(ids), возвращающий цены в формате CoinGecko simple/price.
+
+    Источники упорядочиваются по здоровью и медианной задержке: первым
+    запрашивается самый быстрый здоровый. В режиме FIRST следующий источник
+    запускается, если текущий не ответил за свою p90 задержки, и сразу, если
+    он ответил ошибкой или устаревшими данными; побеждает первый годный ответ,
+    остальные запросы отменяются. Источник, к которому не обращались дольше
+    probe_interval секунд, запрашивается параллельно с первым, и этот пробный
+    запрос не отменяется, а доживает в фоне: так видно, что медленный или
+    упавший источник снова в порядке. Отмененный запрос дает только нижнюю
+    оценку задержки источника: она может опустить источник в очереди, но в
+    квантили задержки не попадает. В режиме MEDIAN
+    опрашиваются все источники сразу. Если годных ответов несколько, цена
+    монеты — медиана, а цены, отклонившиеся от нее больше чем на
+    max_deviation процентов, отбрасываются как выбросы.
+    """
+
+    def __init__(self, sources, mode=FIRST, hedge_quantile=0.9, default_hedge_delay=1.0, min_samples=5,
+                 max_deviation=5.0, stale_after=900.0, unhealthy_after=3, probe_interval=300.0):
+        self.sources = list(sources)
+        self.mode = mode
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.max_deviation = max_deviation
+        self.stale_after = stale_after
+        self.unhealthy_after = unhealthy_after
+        self.probe_interval = probe_interval
+        self.stats = {source: SourceStats() for source in self.sources}
+        # Пробные запросы, которые доживают после ответа get_prices
+        self.probes = set()
+        # Последние принятые цены: по ним выбирается одна из двух расходящихся цен
+        self.last_prices = {}
+
+    def healthy(self, source):
+        """Источник отвечает: нет серии ошибок и предохранитель не разомкнут"""
+        return (self.stats[source].consecutive_errors < self.unhealthy_after
+                and source.policy.breaker.state != OPEN)
+
+    def ranked(self):
+        """Источники в порядке опроса: сначала здоровые, среди них — самые быстрые"""
+        def key(source):
+            stats = self.stats[source]
+            p50 = stats.quantile(0.5)
+            latency = self.default_hedge_delay if p50 is None else p50
+            if stats.lower_bound is not None:
+                latency = max(latency, stats.lower_bound)
+            return not self.healthy(source), latency
+        return sorted(self.sources, key=key)
+
+    def hedge_delay(self, source):
+        """Сколько ждать источник, прежде чем запустить следующий"""
+        stats = self.stats[source]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return stats.quantile(self.hedge_quantile)
+
+    async def get_prices(self, ids):
+        """Цены монет ids в формате CoinGecko; исключение, если ни один источник не ответил"""
+        queue = self.ranked()
+        started = {}
+        probes = set()
+        fresh, stale, errors = {}, {}, []
+
+        def start(index=0):
+            source = queue.pop(index)
+            task = asyncio.ensure_future(source.get_prices(ids))
+            started[task] = (source, time.monotonic())
+            self.stats[source].requests += 1
+            self.stats[source].last_request_at = time.monotonic()
+            return task
+
+        pending = {start()}
+        if self.mode == MEDIAN:
+            while queue:
+                pending.add(start())
+        for source in list(queue):
+            if time.monotonic() - self.stats[source].last_request_at >= self.probe_interval:
+                task = start(queue.index(source))
+                probes.add(task)
+                pending.add(task)
+        try:
+            while pending:
+                # Пробы идут к источникам, которые считаются худшими: по ним подстраховка не отсчитывается
+                primary = [task for task in pending if task not in probes]
+                if not primary and queue:
+                    # Основные запросы ответили неудачно, ждать остается только проб: сразу следующий
+                    pending.add(start())
+                    continue
+                timeout = None
+                if queue:
+                    last = max(primary, key=lambda task: started[task][1])
+                    source, started_at = started[last]
+                    timeout = max(0.0, started_at + self.hedge_delay(source) - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Текущий источник задерживается: подстраховываемся следующим, не отменяя его
+                    self.stats[source].hedged += 1
+                    pending.add(start())
+                    continue
+                for task in done:
+                    self._record(task, started[task], fresh, stale, errors)
+                if self.mode == FIRST and fresh:
+                    break
+                if not pending and queue:
+                    # Все запущенные источники ответили неудачно: сразу следующий
+                    pending.add(start())
+        finally:
+            now = time.monotonic()
+            for task in pending:
+                if task in probes:
+                    # Проба доживает в фоне: ее ответ обновит задержку и замкнет предохранитель источника
+                    self.probes.add(task)
+                    task.add_done_callback(lambda task, info=started[task]: self._finish_probe(task, info))
+                    continue
+                task.cancel()
+                # Отмененный запрос длился не меньше этого: медленный источник теряет место в очереди
+                source, started_at = started[task]
+                stats = self.stats[source]
+                stats.lower_bound = max(stats.lower_bound or 0.0, now - started_at)
+
+        if fresh:
+            return self.combine(fresh)
+        if stale:
+            # Устаревшие данные лучше, чем никаких: в сообщении будет видно их время
+            return self.combine(stale)
+        raise errors[-1] if errors else ValueError("нет цен ни от одного источника")
+
+    def _finish_probe(self, task, started):
+        """Учитывает пробный запрос, завершившийся после ответа get_prices"""
+        self.probes.discard(task)
+        if not task.cancelled():
+            self._record(task, started, {}, {}, [])
+
+    def _record(self, task, started, fresh, stale, errors):
+        """Учитывает завершенный запрос к источнику"""
+        source, started_at = started
+        stats = self.stats[source]
+        try:
+            data = task.result()
+        except Exception as e:
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            errors.append(e)
+            logger.error(f"Ошибка источника цен {source.policy.name}: {e}")
+            return
+        stats.latencies.append(time.monotonic() - started_at)
+        stats.lower_bound = None
+        stats.consecutive_errors = 0
+        if not data:
+            errors.append(ValueError(f"{source.policy.name}: пустой ответ"))
+            return
+        stats.last_age = data_age(data)
+        if stats.last_age is not None and stats.last_age > self.stale_after:
+            stats.stale += 1
+            stale[source] = data
+        else:
+            fresh[source] = data
+
+    def combine(self, results):
+        """Сводит ответы источников в один снимок: медиана цен без выбросов"""
+        if len(results) == 1:
+            data = next(iter(results.values()))
+            self._remember(data)
+            return data
+
+        merged = {}
+        outliers = []
+        coins = dict.fromkeys(coin for data in results.values() for coin in data)
+        for coin in coins:
+            quotes = [(source, data[coin]) for source, data in results.items()
+                      if coin in data and isinstance(data[coin].get('usd'), (int, float)) and data[coin]['usd'] > 0]
+            if not quotes:
+                continue
+            kept = self._without_outliers(coin, quotes)
+            for source, _ in quotes:
+                if all(source is not kept_source for kept_source, _ in kept):
+                    self.stats[source].outliers += 1
+                    outliers.append(f"{coin} ({source.policy.name})")
+            price = statistics.median(quote['usd'] for _, quote in kept)
+            # Остальные поля (изменение за сутки, время) берутся у цены, ближайшей к медиане
+            _, closest = min(kept, key=lambda item: abs(item[1]['usd'] - price))
+            merged[coin] = {**closest, 'usd': price}
+        if outliers:
+            logger.warning(f"Цены отброшены как выбросы: {', '.join(sorted(outliers))}")
+        self._remember(merged)
+        return merged
+
+    def _without_outliers(self, coin, quotes):
+        """Цены монеты, не отклоняющиеся от остальных больше чем на max_deviation процентов"""
+        median = statistics.median(quote['usd'] for _, quote in quotes)
+        kept = [(source, quote) for source, quote in quotes
+                if abs(quote['usd'] / median - 1) * 100 <= self.max_deviation]
+        if kept:
+            return kept
+        # Две цены разошлись: при медиане посередине неясно, какая неверна.
+        # Берется ближайшая к последней принятой цене, без нее — от первого ответившего источника
+        previous = self.last_prices.get(coin)
+        if previous:
+            return [min(quotes, key=lambda item: abs(item[1]['usd'] / previous - 1))]
+        return [quotes[0]]
+
+    def _remember(self, data):
+        for coin, quote in data.items():
+            if isinstance(quote.get('usd'), (int, float)):
+                self.last_prices[coin] = quote['usd']
+
+    def status(self):
+        """Строки состояния источников для /status"""
+        lines = []
+        for source in self.ranked():
+            stats = self.stats[source]
+            p50, p90 = stats.quantile(0.5), stats.quantile(0.9)
+            latency = f"p50 {p50 * 1000:.0f} мс, p90 {p90 * 1000:.0f} мс" if p50 is not None else "нет замеров"
+            age = f", возраст данных {stats.last_age:.0f} с" if stats.last_age is not None else ""
+            lines.append(
+                f"{'✅' if self.healthy(source) else '⚠️'} {source.policy.name}: {latency}{age}, "
+                f"запросов {stats.requests}, ошибок {stats.errors}, устаревших {stats.stale}, "
+                f"выбросов {stats.outliers}, подстраховано {stats.hedged}"
+            )
+        return lines
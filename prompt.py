@@ -0,0 +1,155 @@
+import re
+
+INSTRUCTION = (
+    "Ты криптоаналитик. Ниже таблица рынка (USD). "
+    "Дай краткий анализ (2-3 предложения) на русском языке о текущем состоянии рынка."
+)
+
+# Несколько таблиц в одном запросе: ответ делится на разделы по номерам таблиц
+SECTION_MARK = "###"
+BATCH_INSTRUCTION = (
+    "Ты криптоаналитик. Ниже несколько таблиц рынка (USD), перед каждой строка "
+    f"«{SECTION_MARK} N» с ее номером. Для каждой таблицы дай отдельный краткий анализ "
+    "(2-3 предложения) на русском языке о текущем состоянии рынка. Отвечай разделами "
+    f"в том же порядке: строка «{SECTION_MARK} N», затем анализ таблицы N."
+)
+_SECTION_PATTERN = re.compile(r"^[ \t]*#{1,6}[ \t]*(\d+)[.:)]?", re.M)
+
+# Колонки индикаторов в порядке удаления при нехватке бюджета (первые удаляются раньше)
+INDICATOR_COLUMNS = [
+    ('sma', 'sma'),
+    ('ema', 'ema'),
+    ('dd%', 'drawdown'),
+    ('vol%', 'volatility'),
+    ('rsi', 'rsi'),
+]
+
+# Грубая оценка без tiktoken: слова и отдельные знаки, кириллица дробится сильнее
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|[А-Яа-яЁё]{1,3}|\d{1,3}|[^\sA-Za-zА-Яа-яЁё\d]")
+
+# Кодировки tiktoken по модели (None, если tiktoken не установлен)
+_encodings = {}
+
+
+def _encoding(model):
+    """Кодировка tiktoken для модели: импорт и загрузка словаря откладываются до первого подсчета"""
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            _encodings[model] = None
+            return None
+        try:
+            encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """Считает токены: точно через tiktoken, если он установлен, иначе приблизительно"""
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def format_number(value):
+    """Короткая запись числа: значащие цифры без лишних нулей"""
+    if value is None:
+        return "-"
+    if abs(value) >= 100:
+        return f"{value:.0f}"
+    if abs(value) >= 1:
+        return f"{value:.2f}".rstrip('0').rstrip('.')
+    return f"{value:.4g}"
+
+
+class PromptBuilder:
+    """Собирает компактный промпт с таблицей рынка в пределах бюджета токенов.
+
+    Если промпт не помещается в бюджет, сначала убираются колонки индикаторов
+    (в порядке INDICATOR_COLUMNS), затем монеты с конца списка приоритета.
+    """
+
+    def __init__(self, budget=400, priority=None, model=None):
+        self.budget = budget
+        self.priority = priority or []
+        self.model = model
+
+    def _ordered_coins(self, data):
+        rank = {coin: i for i, coin in enumerate(self.priority)}
+        return sorted(data, key=lambda coin: rank.get(coin, len(rank)))
+
+    def table(self, data, coins, columns):
+        """Таблица рынка для выбранных монет и колонок индикаторов"""
+        header = ["coin", "price", "24h%"] + [name for name, _ in columns]
+        rows = ["|".join(header)]
+        for coin in coins:
+            coin_data = data[coin]
+            change = coin_data.get('usd_24h_change')
+            row = [
+                coin,
+                format_number(coin_data.get('usd')),
+                f"{change:+.2f}" if isinstance(change, (int, float)) else "-"
+            ]
+            indicators = coin_data.get('indicators') or {}
+            row += [format_number(indicators.get(key)) for _, key in columns]
+            rows.append("|".join(row))
+        return "\n".join(rows)
+
+    def render(self, data, coins, columns):
+        """Промпт для выбранных монет и колонок индикаторов"""
+        return f"{INSTRUCTION}\n" + self.table(data, coins, columns)
+
+    def _fit(self, data, render):
+        """Сокращает render(монеты, колонки) до бюджета: (текст, число токенов, удаленные колонки и монеты)"""
+        coins = self._ordered_coins(data)
+        has_indicators = any(data[coin].get('indicators') for coin in coins)
+        columns = list(INDICATOR_COLUMNS) if has_indicators else []
+        dropped = []
+
+        text = render(coins, columns)
+        tokens = count_tokens(text, self.model)
+        while tokens > self.budget and (columns or len(coins) > 1):
+            if columns:
+                dropped.append(columns.pop(0)[0])
+            else:
+                dropped.append(coins.pop())
+            text = render(coins, columns)
+            tokens = count_tokens(text, self.model)
+        return text, tokens, dropped
+
+    def build(self, data):
+        """Возвращает (промпт, число токенов, список удаленных колонок и монет)"""
+        return self._fit(data, lambda coins, columns: self.render(data, coins, columns))
+
+    def build_batch(self, datasets):
+        """Один промпт на несколько снимков: (промпт, число токенов, удаленные колонки и монеты).
+
+        Каждая таблица сокращается до бюджета отдельно, как в build(), так что
+        пакет из N снимков занимает не больше N бюджетов.
+        """
+        sections, dropped = [], []
+        for number, data in enumerate(datasets, 1):
+            section, _, section_dropped = self._fit(
+                data, lambda coins, columns: f"{SECTION_MARK} {number}\n" + self.table(data, coins, columns)
+            )
+            sections.append(section)
+            dropped += section_dropped
+        prompt = f"{BATCH_INSTRUCTION}\n" + "\n".join(sections)
+        return prompt, count_tokens(prompt, self.model), dropped
+
+
+def parse_batch(text, count):
+    """Разбирает ответ на build_batch(): список из count анализов, None — раздел не найден или пуст"""
+    answers = [None] * count
+    matches = list(_SECTION_PATTERN.finditer(text or ""))
+    for i, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[match.end():end].strip()
+        if 1 <= number <= count and body and answers[number - 1] is None:
+            answers[number - 1] = body
+    return answers
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: запрос к сервису не выполняется"""
+
+
+class CircuitBreaker:
+    """Предохранитель: после серии ошибок временно перестает пускать запросы.
+
+    После reset_timeout секунд пропускает один пробный запрос (half-open):
+    успех замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def allow(self):
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        """Запрос выполнен успешно"""
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release(self):
+        """Запрос отменен без ответа сервиса: пробный запрос освобождается, исход не учитывается"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        """Запрос завершился ошибкой"""
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+                logger.error(f"{self.name}: предохранитель разомкнут после {self.consecutive_failures} ошибок подряд")
+                print(f"⛔ {self.name}: предохранитель разомкнут")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamPolicy:
+    """Общие правила обращения к внешнему сервису.
+
+    Ограничивает время всего вызова (deadline) вместе с повторами, повторяет
+    сетевые ошибки и ответы из retry_statuses с экспоненциальной задержкой
+    со случайным разбросом (full jitter) и ведет предохранитель.
+    """
+
+    def __init__(self, name, deadline=30.0, max_retries=3, base_delay=0.5, max_delay=10.0,
+                 retry_statuses=RETRY_STATUSES, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def backoff(self, attempt, retry_after=None):
+        """Задержка перед повтором: retry_after от сервиса или случайная в [0, base * 2^attempt]"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response):
+        """Значение заголовка Retry-After в секундах, если есть"""
+        value = response.headers.get("Retry-After")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    async def call(self, request):
+        """Выполняет request() (корутину, возвращающую httpx.Response) с повторами"""
+        response, _ = await self._call(request, defer_success=False)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, request):
+        """Как call(), но для потокового ответа: исход учитывается, когда тело прочитано.
+
+        Успехом считается только выход из блока без ошибки, поэтому поток,
+        оборвавшийся посреди тела, — ошибка сервиса; отмена исхода не дает.
+        """
+        response, pending = await self._call(request, defer_success=True)
+        if pending is None:
+            # Ответ с ошибкой уже учтен
+            yield response
+            return
+        try:
+            yield response
+        except asyncio.CancelledError:
+            if pending is HALF_OPEN:
+                self.breaker.release()
+            raise
+        except Exception:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    async def _call(self, request, defer_success):
+        """Выполняет запрос с повторами; возвращает (ответ, отложенный исход).
+
+        Отложенный исход — None, если исход уже учтен в предохранителе, иначе
+        состояние предохранителя при выдаче запроса (HALF_OPEN — пробный запрос).
+        Без defer_success успех учитывается сразу.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}: сервис временно недоступен")
+
+        # Этот вызов — пробный запрос полуоткрытого предохранителя
+        probe = self.breaker.state == HALF_OPEN
+        self.calls += 1
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        # Учтен ли исход вызова в предохранителе: любой выход без исхода освобождает пробный запрос
+        recorded = False
+        try:
+            while True:
+                remaining = deadline_at - time.monotonic()
+                error = None
+                response = None
+                try:
+                    response = await asyncio.wait_for(request(), remaining)
+                except (httpx.TransportError, asyncio.TimeoutError) as e:
+                    error = e
+
+                if error is None and response.status_code not in self.retry_statuses:
+                    # Ошибки клиента (кроме 429) не говорят о недоступности сервиса
+                    recorded = True
+                    if defer_success:
+                        return response, HALF_OPEN if probe else CLOSED
+                    self.breaker.record_success()
+                    return response, None
+
+                delay = self.backoff(attempt, self._retry_after(response) if response is not None else None)
+                remaining = deadline_at - time.monotonic()
+                if attempt >= self.max_retries or delay >= remaining:
+                    recorded = True
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    if isinstance(error, asyncio.TimeoutError):
+                        raise httpx.TimeoutException(f"{self.name}: превышен срок {self.deadline} с") from error
+                    if error is not None:
+                        raise error
+                    return response, None
+
+                if response is not None:
+                    # Потоковый ответ держит соединение, пока его не закрыть
+                    await response.aclose()
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # Вызов отменил вызывающий (например, подстраховка источника цен): сервис тут ни при чем
+            if not recorded and probe:
+                self.breaker.release()
+            raise
+        except Exception:
+            # Неожиданная ошибка (разбор ответа, ошибка протокола) считается ошибкой сервиса
+            if not recorded:
+                self.failures += 1
+                self.breaker.record_failure()
+            raise
+
+    def status(self):
+        """Краткое состояние для /status"""
+        state = {CLOSED: "✅", HALF_OPEN: "⚠️", OPEN: "⛔"}[self.breaker.state]
+        return (
+            f"{state} {self.name}: {self.breaker.state}, "
+            f"запросов {self.calls}, повторов {self.retries}, ошибок {self.failures}"
+        )
@@ -0,0 +1,52 @@
+from collections import Counter
+
+
+def market_move(data):
+    """Наибольшее изменение цены за сутки среди монет снимка, % (None, если изменение известно не для всех)"""
+    changes = [coin_data.get('usd_24h_change') for coin_data in data.values()]
+    if not changes or not all(isinstance(change, (int, float)) for change in changes):
+        return None
+    return max(abs(change) for change in changes)
+
+
+class ModelRouter:
+    """Выбор модели ИИ по движению рынка.
+
+    Пока ни одна монета снимка не сдвинулась за сутки на quiet_threshold
+    процентов, анализ пишет дешевая (быстрая) quiet_model; на заметном
+    движении и когда изменение неизвестно — основная model. Без quiet_model
+    все снимки идут в основную модель.
+    """
+
+    def __init__(self, model, quiet_model=None, quiet_threshold=3.0):
+        self.model = model
+        self.quiet_model = quiet_model or None
+        self.quiet_threshold = quiet_threshold
+        # Сколько анализов запрошено у каждой модели (считает вызывающий код)
+        self.routed = Counter()
+
+    def route(self, data):
+        """Модель для анализа снимка"""
+        if self.quiet_model is not None:
+            move = market_move(data)
+            if move is not None and move < self.quiet_threshold:
+                return self.quiet_model
+        return self.model
+
+
+def plan_batches(datasets, router, size):
+    """Делит снимки {ключ: данные} на пакеты для общих запросов: [(модель, {ключ: данные})].
+
+    В пакет попадают снимки одной модели, не больше size штук; порядок снимков сохраняется.
+    """
+    by_model = {}
+    for key, data in datasets.items():
+        by_model.setdefault(router.route(data), {})[key] = data
+    # Размер меньше 1 — каждый снимок отдельным запросом
+    size = max(size, 1)
+    batches = []
+    for model, items in by_model.items():
+        keys = list(items)
+        for start in range(0, len(keys), size):
+            batches.append((model, {key: items[key] for key in keys[start:start + size]}))
+    return batches
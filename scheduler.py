@@ -0,0 +1,109 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Максимальный сон между проверками очереди: защищает от переводов системных часов
+MAX_SLEEP_SECONDS = 60
+
+
+def next_deadline(interval, now=None):
+    """Ближайший дедлайн, кратный interval от начала эпохи (по UTC)"""
+    now = time.time() if now is None else now
+    return (int(now // interval) + 1) * interval
+
+
+class JobScheduler:
+    """Планировщик задач по абсолютным дедлайнам на одной очереди с приоритетом.
+
+    Дедлайны выравниваются по сетке интервала (12:00, 12:15, ...), поэтому время
+    выполнения задачи не накапливается в сдвиг расписания. Задачи с одинаковым
+    дедлайном передаются в on_due одним вызовом. Все задачи живут в одной куче
+    и обслуживаются одной корутиной, без отдельного потока на задачу.
+    """
+
+    def __init__(self, on_due, clock=time.time):
+        self.on_due = on_due
+        self.clock = clock
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running = {}
+        self.running = False
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def schedule(self, key, interval):
+        """Добавляет или перепланирует задачу key с периодом interval секунд"""
+        deadline = next_deadline(interval, self.clock())
+        # Старые записи в куче не удаляются сразу, а пропускаются по номеру версии
+        version = next(self._seq)
+        self._jobs[key] = (interval, version)
+        heapq.heappush(self._heap, (deadline, version, key))
+        self._wakeup.set()
+        return deadline
+
+    def _pop_due(self, now):
+        """Снимает с кучи все задачи, срок которых наступил, и планирует их заново"""
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            deadline, version, key = heapq.heappop(self._heap)
+            job = self._jobs.get(key)
+            if job is None or job[1] != version:
+                continue
+            due.setdefault(deadline, []).append(key)
+            # Следующий дедлайн считается от сетки, а не от времени окончания задачи;
+            # пропущенные дедлайны не догоняются
+            interval = job[0]
+            next_time = deadline + interval
+            if next_time <= now:
+                next_time = next_deadline(interval, now)
+            heapq.heappush(self._heap, (next_time, version, key))
+        return due
+
+    async def _fire(self, deadline, keys):
+        """Запускает обработчик для группы задач с одним дедлайном"""
+        try:
+            await self.on_due(deadline, keys)
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задач {keys}: {e}")
+        finally:
+            for key in keys:
+                self._running.pop(key, None)
+
+    async def run(self):
+        """Основной цикл планировщика"""
+        self.running = True
+        try:
+            while self.running:
+                now = self.clock()
+                for deadline, keys in self._pop_due(now).items():
+                    # Пока предыдущий запуск задачи не закончился, новый пропускается
+                    busy = [key for key in keys if key in self._running]
+                    if busy:
+                        logger.error(f"Пропущен запуск, предыдущий еще выполняется: {busy}")
+                    keys = [key for key in keys if key not in self._running]
+                    if keys:
+                        task = asyncio.create_task(self._fire(deadline, keys))
+                        for key in keys:
+                            self._running[key] = task
+                timeout = MAX_SLEEP_SECONDS
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - self.clock()))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+
+    def stop(self):
+        """Останавливает цикл планировщика"""
+        self.running = False
+        self._wakeup.set()
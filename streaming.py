@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пытаться отправить окончательный текст, если Telegram просит подождать
+FINAL_EDIT_ATTEMPTS = 3
+
+
+class AnalysisStream:
+    """Текст анализа, который ИИ еще дописывает.
+
+    Каждый новый фрагмент срабатывает событие changed и заменяет его свежим,
+    поэтому любое число наблюдателей видит все изменения без общего сброса.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.changed = asyncio.Event()
+
+    def append(self, delta):
+        """Добавляет фрагмент и будит наблюдателей"""
+        self.text += delta
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def watch(self, on_text):
+        """Вызывает on_text(текст) при каждом изменении, пока задачу не отменят"""
+        seen = None
+        while True:
+            changed = self.changed
+            if self.text and self.text != seen:
+                seen = self.text
+                on_text(seen)
+            await changed.wait()
+
+
+class ProgressiveMessage:
+    """Сообщение Telegram, которое дописывается на месте по мере генерации ответа.
+
+    Правки объединяются: промежуточный текст уходит не чаще раза в interval
+    секунд и только если в общем ведре правок есть токен, иначе ждет следующей
+    возможности, а более новый текст заменяет неотправленный. Окончательный
+    текст отправляется всегда и ведро не расходует: он заменяет обычное
+    сообщение с анализом.
+    """
+
+    def __init__(self, bot, chat_id, message_id, text, interval=1.0, bucket=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.bucket = bucket
+        self.sent_text = text
+        self.pending = None
+        self.next_edit_at = time.monotonic() + interval
+        self.edits = 0
+        self._flusher = None
+
+    def update(self, text):
+        """Запоминает новый текст; правка уйдет, когда позволят лимиты"""
+        self.pending = text
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            while self.pending is not None and self.pending != self.sent_text:
+                delay = self.next_edit_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif self.bucket is not None and not self.bucket.try_acquire():
+                    # Общий лимит исчерпан: промежуточная правка подождет
+                    await asyncio.sleep(self.interval / 4)
+                else:
+                    await self._edit(self.pending)
+        finally:
+            self._flusher = None
+
+    async def finish(self, text):
+        """Отправляет окончательный текст вместо отложенной правки"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        self.pending = None
+        for _ in range(FINAL_EDIT_ATTEMPTS):
+            if text == self.sent_text:
+                return True
+            delay = self.next_edit_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(text)
+        return text == self.sent_text
+
+    async def _edit(self, text):
+        """Одна правка сообщения; ошибки Telegram не прерывают генерацию"""
+        self.next_edit_at = time.monotonic() + self.interval
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+            self.sent_text = text
+            self.edits += 1
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + e.retry_after
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.error(f"Ошибка правки сообщения в чате {self.chat_id}: {e}")
+            # Текст уже такой или сообщение недоступно: повторять правку бессмысленно
+            self.sent_text = text
+        except TelegramError as e:
+            logger.error(f"Ошибка правки сообщения в чате {self.chat_id}: {e}")
@@ -0,0 +1,805 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Список монет чата по умолчанию (общий CRYPTO_IDS бота)
+DEFAULT_WATCHLIST = ""
+
+# Флаги чата в SubscriberRegistry
+FLAG_THRESHOLD = 1  # задан личный порог (иначе порог по умолчанию)
+
+# Колонки SubscriberRegistry: имя и тип элемента array
+REGISTRY_COLUMNS = (
+    ("ids", "q"),         # chat_id по возрастанию
+    ("intervals", "I"),   # интервал рассылки, секунды
+    ("watchlists", "I"),  # номер подписи списка монет в signatures
+    ("thresholds", "d"),  # личный порог, % (при FLAG_THRESHOLD)
+    ("flags", "B"),
+    ("added", "I"),       # время подписки, секунды эпохи
+    ("usernames", "I"),   # номер имени пользователя в usernames (0 — без имени)
+)
+
+# Изменения копятся поверх колонок реестра, пока их не больше этой доли от числа чатов (и не меньше COMPACT_MIN)
+COMPACT_RATIO = 1 / 64
+COMPACT_MIN = 1000
+# Как часто реестр в памяти проверяет изменения, сделанные другими процессами
+REGISTRY_REFRESH_SECONDS = 1.0
+# Сколько последних изменений подписчиков хранить в журнале для других процессов
+CHANGE_LOG_SIZE = 100_000
+
+
+class SubscriberStore(ABC):
+    """Интерфейс хранилища подписчиков"""
+
+    @abstractmethod
+    def add(self, chat_id, username=None, added_at=None):
+        """Добавляет или обновляет подписчика"""
+
+    @abstractmethod
+    def remove(self, chat_id):
+        """Удаляет подписчика, возвращает True, если он был"""
+
+    def remove_many(self, chat_ids):
+        """Удаляет нескольких подписчиков одной транзакцией, возвращает их число"""
+        with self.batch():
+            return sum(1 for chat_id in chat_ids if self.remove(chat_id))
+
+    @abstractmethod
+    def __contains__(self, chat_id):
+        """Есть ли такой подписчик"""
+
+    @abstractmethod
+    def set_interval(self, chat_id, interval):
+        """Задает интервал рассылки для чата, возвращает False, если чата нет"""
+
+    @abstractmethod
+    def get_interval(self, chat_id):
+        """Интервал рассылки чата в секундах или None"""
+
+    @abstractmethod
+    def set_watchlist(self, chat_id, watchlist):
+        """Задает список монет чата (подпись списка), возвращает False, если чата нет"""
+
+    @abstractmethod
+    def get_watchlist(self, chat_id):
+        """Подпись списка монет чата (DEFAULT_WATCHLIST — общий список) или None"""
+
+    @abstractmethod
+    def watchlists(self, interval=None):
+        """Различные списки монет и число чатов с каждым: {подпись: количество}"""
+
+    @abstractmethod
+    def watched_coins(self):
+        """Все монеты из личных списков чатов"""
+
+    @abstractmethod
+    def set_threshold(self, chat_id, threshold):
+        """Задает порог изменения цены в процентах (None — порог по умолчанию), возвращает False, если чата нет"""
+
+    @abstractmethod
+    def get_threshold(self, chat_id):
+        """Порог изменения цены чата в процентах или None (порог по умолчанию)"""
+
+    @abstractmethod
+    def groups(self, interval=None):
+        """Группы рассылки и число чатов в каждой: {(подпись списка монет, порог): количество}"""
+
+    @abstractmethod
+    def count(self, interval=None):
+        """Количество подписчиков (всего или с указанным интервалом)"""
+
+    @abstractmethod
+    def get_username(self, chat_id):
+        """Имя пользователя, подписавшего чат, или None"""
+
+    @abstractmethod
+    def iter_subscriptions(self, batch_size=1000, interval=None, shard=None):
+        """Постранично перебирает тройки (chat_id, подпись списка монет, порог), не загружая их все в память.
+
+        shard=(номер, всего) оставляет только чаты с chat_id % всего == номер.
+        """
+
+    @contextmanager
+    def batch(self):
+        """Объединяет несколько изменений в одну транзакцию"""
+        yield self
+
+    def close(self):
+        """Закрывает хранилище"""
+
+
+class SubscriberRegistry:
+    """Компактный реестр подписчиков в памяти.
+
+    Каждая колонка — array по возрастанию chat_id (REGISTRY_COLUMNS): около
+    35 байт на чат вместо сотен у словаря со строковыми ключами. Подписи
+    списков монет и имена пользователей хранятся один раз, у чата — только
+    их номера. Проверка
+    подписки — двоичный поиск без создания объектов.
+
+    Изменения не трогают массивы, а копятся в небольшом словаре поверх них:
+    подписка или отписка стоит одной записи в словарь. Когда изменений
+    набирается больше доли compact_ratio от числа чатов, массивы пересобираются
+    за один проход по памяти, так что на изменение приходится O(1) в среднем.
+    Массивы после сборки не меняются, поэтому начатый перебор идет по снимку.
+    """
+
+    def __init__(self, compact_ratio=COMPACT_RATIO):
+        self.compact_ratio = compact_ratio
+        # Колонки и изменения поверх них {chat_id: (интервал, номер подписи, порог, время, номер имени) или None — удален}
+        # одной ссылкой: читатели не видят реестр наполовину пересобранным
+        self.state = (tuple(array(typecode) for _, typecode in REGISTRY_COLUMNS), {})
+        self.signatures = [DEFAULT_WATCHLIST]
+        self._signature_index = {DEFAULT_WATCHLIST: 0}
+        self.usernames = [None]
+        self._username_index = {None: 0}
+        self._size = 0
+        # Число чатов по группам для каждого интервала: по колонкам (до пересборки) и с изменениями
+        self._base_counts = (None, {})
+        self._counts = {}
+
+    @classmethod
+    def from_rows(cls, rows, compact_ratio=COMPACT_RATIO):
+        """Реестр из строк (chat_id, интервал, подпись списка монет, порог, время подписки[, имя]) по возрастанию chat_id"""
+        registry = cls(compact_ratio)
+        columns, _ = registry.state
+        for row in rows:
+            for column, value in zip(columns, registry._column_values(row[0], registry._pack(row[1:]))):
+                column.append(value)
+        registry._size = len(columns[0])
+        return registry
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, chat_id):
+        return self._find(chat_id) is not None
+
+    @staticmethod
+    def _position(ids, chat_id):
+        position = bisect_left(ids, chat_id)
+        return position if position < len(ids) and ids[position] == chat_id else None
+
+    @staticmethod
+    def _intern(values, index, value):
+        """Номер значения в списке values (с обратным индексом index), новое значение добавляется"""
+        number = index.get(value)
+        if number is None:
+            number = index[value] = len(values)
+            values.append(value)
+        return number
+
+    def _pack(self, row):
+        """(интервал, подпись списка монет, порог, время подписки[, имя]) -> (интервал, номер подписи, порог, время, номер имени)"""
+        interval, watchlist, threshold, added_at = row[:4]
+        username = row[4] if len(row) > 4 else None
+        return (interval, self._intern(self.signatures, self._signature_index, watchlist), threshold,
+                int(added_at), self._intern(self.usernames, self._username_index, username))
+
+    @staticmethod
+    def _column_values(chat_id, packed):
+        interval, index, threshold, added_at, username = packed
+        flags = FLAG_THRESHOLD if threshold is not None else 0
+        return chat_id, interval, index, threshold or 0.0, flags, added_at, username
+
+    @staticmethod
+    def _base_row(columns, chat_id):
+        """Упакованная строка чата из колонок (без изменений поверх них) или None"""
+        ids, intervals, watchlists, thresholds, flags, added, usernames = columns
+        position = SubscriberRegistry._position(ids, chat_id)
+        if position is None:
+            return None
+        threshold = thresholds[position] if flags[position] & FLAG_THRESHOLD else None
+        return intervals[position], watchlists[position], threshold, added[position], usernames[position]
+
+    def _find(self, chat_id):
+        columns, overlay = self.state
+        if chat_id in overlay:
+            return overlay[chat_id]
+        return self._base_row(columns, chat_id)
+
+    def get(self, chat_id):
+        """(интервал, подпись списка монет, порог) чата или None, если его нет"""
+        row = self._find(chat_id)
+        if row is None:
+            return None
+        interval, index, threshold, _, _ = row
+        return interval, self.signatures[index], threshold
+
+    def username(self, chat_id):
+        """Имя пользователя чата или None (нет имени или нет чата)"""
+        row = self._find(chat_id)
+        return self.usernames[row[4]] if row is not None else None
+
+    def apply(self, changes):
+        """Применяет изменения [(chat_id, строка или None — чат удален)].
+
+        Строка — (интервал, подпись списка монет, порог, время подписки[, имя пользователя]).
+        """
+        columns, overlay = self.state
+        for chat_id, row in changes:
+            existed = self._find(chat_id) is not None
+            if row is not None:
+                overlay[chat_id] = self._pack(row)
+            elif self._position(columns[0], chat_id) is not None:
+                overlay[chat_id] = None
+            else:
+                overlay.pop(chat_id, None)
+            self._size += (row is not None) - existed
+        self._counts = {}
+        if len(overlay) > max(len(columns[0]) * self.compact_ratio, COMPACT_MIN):
+            self.compact()
+
+    def compact(self):
+        """Пересобирает колонки с накопленными изменениями.
+
+        Неизмененные участки копируются срезами, так что пересборка стоит
+        одного прохода по памяти, а не цикла по всем чатам.
+        """
+        old, overlay = self.state
+        if not overlay:
+            return
+        ids = old[0]
+        columns = tuple(array(typecode) for _, typecode in REGISTRY_COLUMNS)
+        previous = 0
+        raw = [(memoryview(source).cast("B"), source.itemsize) for source in old]
+
+        def copy(start, stop):
+            for column, (source, size) in zip(columns, raw):
+                column.frombytes(source[start * size:stop * size])
+
+        for chat_id, row in sorted(overlay.items()):
+            position = bisect_left(ids, chat_id, previous)
+            copy(previous, position)
+            if row is not None:
+                for column, value in zip(columns, self._column_values(chat_id, row)):
+                    column.append(value)
+            previous = position + 1 if position < len(ids) and ids[position] == chat_id else position
+        copy(previous, len(ids))
+        self.state = (columns, {})
+        self._counts = {}
+
+    def iter_rows(self, batch_size=1000, interval=None, shard=None, watchlist=None):
+        """Перебирает (chat_id, подпись списка монет, порог) по возрастанию chat_id.
+
+        shard=(номер, всего) оставляет только чаты с chat_id % всего == номер,
+        watchlist — только чаты с этим списком монет.
+        """
+        signatures = self.signatures
+        watchlist_index = None
+        if watchlist is not None:
+            watchlist_index = self._signature_index.get(watchlist)
+            if watchlist_index is None:
+                return
+        shard_index, shards = shard if shard is not None else (0, 1)
+
+        def changed(chat_id, row):
+            """Строка измененного чата, если чат не удален и проходит фильтры"""
+            if row is None:
+                return None
+            chat_interval, index, threshold, _, _ = row
+            if shards > 1 and chat_id % shards != shard_index:
+                return None
+            if interval is not None and chat_interval != interval:
+                return None
+            if watchlist_index is not None and index != watchlist_index:
+                return None
+            return chat_id, signatures[index], threshold
+
+        columns, overlay = self.state
+        # Изменения поверх колонок вливаются в перебор по возрастанию chat_id
+        changes = sorted(overlay.items())
+        changes.append((float("inf"), None))
+        next_change = 0
+        next_id = changes[0][0]
+        views = [memoryview(column) for column in columns]
+        for start in range(0, len(views[0]), batch_size):
+            ids, intervals, watchlists, thresholds, flags, _, _ = (view[start:start + batch_size] for view in views)
+            # Остальные колонки читаются только у чатов, прошедших фильтры
+            for position, chat_id in enumerate(ids):
+                if chat_id >= next_id:
+                    # Изменения чатов перед этим и самого этого чата (оно заменяет строку из колонок)
+                    while next_id <= chat_id:
+                        row = changed(*changes[next_change])
+                        if row is not None:
+                            yield row
+                        next_change += 1
+                        next_id = changes[next_change][0]
+                    if changes[next_change - 1][0] == chat_id:
+                        continue
+                if shards > 1 and chat_id % shards != shard_index:
+                    continue
+                if interval is not None and intervals[position] != interval:
+                    continue
+                index = watchlists[position]
+                if watchlist_index is not None and index != watchlist_index:
+                    continue
+                yield chat_id, signatures[index], thresholds[position] if flags[position] & FLAG_THRESHOLD else None
+        for change in changes[next_change:-1]:
+            row = changed(*change)
+            if row is not None:
+                yield row
+
+    def counts(self, interval=None):
+        """Число чатов по группам {(номер подписи, порог): количество}, с кэшем до следующего изменения"""
+        counts = self._counts.get(interval)
+        if counts is not None:
+            return counts
+        columns, overlay = self.state
+        cached_columns, base = self._base_counts
+        if cached_columns is not columns:
+            base = {}
+            self._base_counts = (columns, base)
+        base_counts = base.get(interval)
+        if base_counts is None:
+            _, intervals, watchlists, thresholds, flags, _, _ = columns
+            rows = zip(watchlists, thresholds, flags, intervals)
+            base_counts = base[interval] = Counter(
+                (index, threshold if chat_flags & FLAG_THRESHOLD else None)
+                for index, threshold, chat_flags, chat_interval in rows
+                if interval is None or chat_interval == interval
+            )
+        counts = Counter(base_counts)
+        for chat_id, row in list(overlay.items()):
+            old = self._base_row(columns, chat_id)
+            if old is not None and (interval is None or old[0] == interval):
+                counts[old[1], old[2]] -= 1
+            if row is not None and (interval is None or row[0] == interval):
+                counts[row[1], row[2]] += 1
+        counts = Counter({key: count for key, count in counts.items() if count > 0})
+        self._counts[interval] = counts
+        return counts
+
+    def groups(self, interval=None):
+        """Группы рассылки и число чатов в каждой: {(подпись списка монет, порог): количество}"""
+        return {(self.signatures[index], threshold): count
+                for (index, threshold), count in self.counts(interval).items()}
+
+    def watchlists(self, interval=None):
+        """Различные списки монет и число чатов с каждым: {подпись: количество}"""
+        result = Counter()
+        for (index, _), count in self.counts(interval).items():
+            result[self.signatures[index]] += count
+        return dict(result)
+
+    def count(self, interval=None):
+        """Количество подписчиков (всего или с указанным интервалом)"""
+        return len(self) if interval is None else sum(self.counts(interval).values())
+
+
+class SQLiteSubscriberStore(SubscriberStore):
+    """Хранилище подписчиков в SQLite (режим WAL).
+
+    С in_memory=True чтения обслуживает SubscriberRegistry. Он загружается в
+    фоне (preload или первое чтение), а пока грузится, чтения идут в базу.
+    Каждая транзакция записывает измененные chat_id в
+    журнал subscriber_changes, и по нему реестр догоняет изменения — и свои,
+    и сделанные другими процессами с той же базой. Перебор и подсчеты
+    сверяются с журналом каждый раз, точечные чтения — не чаще раза в
+    REGISTRY_REFRESH_SECONDS и при каждом промахе.
+    """
+
+    def __init__(self, path, default_interval=3600, in_memory=False):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Доступ из потока планировщика и из цикла событий бота
+        self._lock = threading.RLock()
+        self._depth = 0
+        self.in_memory = in_memory
+        self._registry = None
+        self._loader = None
+        # Последнее изменение из журнала, уже примененное к реестру
+        self._seen_change = 0
+        self._checked_at = 0.0
+        # Чаты, измененные в текущей транзакции
+        self._changed = set()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers ("
+            "chat_id INTEGER PRIMARY KEY, "
+            "username TEXT, "
+            "added_at INTEGER NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(subscribers)")}
+        if "interval" not in columns:
+            self._conn.execute(
+                f"ALTER TABLE subscribers ADD COLUMN interval INTEGER NOT NULL "
+                f"DEFAULT {int(default_interval)}"
+            )
+        if "watchlist" not in columns:
+            # Подпись списка монет: отсортированные id через запятую, пустая — общий список
+            self._conn.execute(
+                f"ALTER TABLE subscribers ADD COLUMN watchlist TEXT NOT NULL DEFAULT '{DEFAULT_WATCHLIST}'"
+            )
+        if "threshold" not in columns:
+            # Порог изменения цены для рассылки, %; NULL — порог по умолчанию
+            self._conn.execute("ALTER TABLE subscribers ADD COLUMN threshold REAL")
+        # Индексы для перебора чатов одной группы расписания и для группировки по спискам монет
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS subscribers_interval ON subscribers (interval, chat_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS subscribers_watchlist ON subscribers (interval, watchlist, chat_id)"
+        )
+        # Журнал изменений для реестров в памяти (своего и других процессов)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscriber_changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    @contextmanager
+    def batch(self):
+        """Объединяет несколько изменений в одну транзакцию"""
+        with self._lock:
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._depth == 1:
+                    self._conn.rollback()
+                    self._changed.clear()
+                raise
+            else:
+                if self._depth == 1:
+                    self._log_changes()
+                    self._conn.commit()
+                    if self._registry is not None:
+                        self._catch_up()
+            finally:
+                self._depth -= 1
+
+    def _log_changes(self):
+        """Записывает измененные в транзакции chat_id в журнал и обрезает его старую часть"""
+        if not self._changed:
+            return
+        self._conn.executemany(
+            "INSERT INTO subscriber_changes (chat_id) VALUES (?)", ((chat_id,) for chat_id in self._changed)
+        )
+        self._conn.execute(
+            "DELETE FROM subscriber_changes WHERE seq <= (SELECT MAX(seq) FROM subscriber_changes) - ?",
+            (CHANGE_LOG_SIZE,)
+        )
+        self._changed.clear()
+
+    def preload(self, wait=False):
+        """Начинает загрузку реестра в памяти в фоновом потоке; wait=True — дождаться ее"""
+        with self._lock:
+            if not self.in_memory or self._registry is not None:
+                return
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load_registry, name="subscriber-registry", daemon=True)
+                self._loader.start()
+            loader = self._loader
+        if wait:
+            loader.join()
+
+    def _load_registry(self):
+        """Загружает реестр из базы целиком.
+
+        Читает отдельным соединением в одной транзакции: запросы к хранилищу
+        на время загрузки не блокируются, а журнал и таблица согласованы.
+        """
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                conn.execute("BEGIN")
+                seen = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM subscriber_changes").fetchone()[0]
+                registry = SubscriberRegistry.from_rows(conn.execute(
+                    "SELECT chat_id, interval, watchlist, threshold, added_at, username FROM subscribers ORDER BY chat_id"
+                ))
+                conn.rollback()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки подписчиков в память: {e}")
+            print(f"⚠️ Ошибка загрузки подписчиков в память, чтение из базы: {e}")
+            self.in_memory = False
+            return
+        with self._lock:
+            self._registry, self._seen_change = registry, seen
+            # Изменения, сделанные во время загрузки
+            self._catch_up()
+
+    def _catch_up(self):
+        """Применяет к реестру изменения из журнала (под блокировкой)"""
+        count, first, last = self._conn.execute(
+            "SELECT COUNT(*), MIN(seq), MAX(seq) FROM subscriber_changes WHERE seq > ?", (self._seen_change,)
+        ).fetchone()
+        self._checked_at = time.monotonic()
+        if not count:
+            return
+        if first != self._seen_change + 1 or count > max(len(self._registry) // 2, 1000):
+            # Нужная часть журнала уже обрезана или изменилась большая часть чатов: проще перечитать всех
+            self._load_registry()
+            return
+        changed = sorted({chat_id for (chat_id,) in self._conn.execute(
+            "SELECT chat_id FROM subscriber_changes WHERE seq > ? AND seq <= ?", (self._seen_change, last)
+        )})
+        found = {}
+        for start in range(0, len(changed), 500):
+            part = changed[start:start + 500]
+            found.update((row[0], row[1:]) for row in self._conn.execute(
+                f"SELECT chat_id, interval, watchlist, threshold, added_at, username FROM subscribers "
+                f"WHERE chat_id IN ({', '.join('?' * len(part))})", part
+            ))
+        self._registry.apply([(chat_id, found.get(chat_id)) for chat_id in changed])
+        self._seen_change = last
+
+    def _memory(self, fresh=True):
+        """Реестр в памяти, сверенный с журналом, или None, если читать нужно из базы.
+
+        fresh=False пропускает сверку, если она была меньше REGISTRY_REFRESH_SECONDS назад.
+        """
+        if not self.in_memory or self._changed:
+            # Незавершенная транзакция видна только в базе
+            return None
+        if self._registry is None:
+            self.preload()
+            return None
+        if not fresh and time.monotonic() - self._checked_at < REGISTRY_REFRESH_SECONDS:
+            return self._registry
+        with self._lock:
+            if self._changed:
+                return None
+            self._catch_up()
+            return self._registry
+
+    def _lookup(self, registry, chat_id):
+        """(интервал, подпись списка монет, порог) чата из реестра или None, если чата нет"""
+        row = registry.get(int(chat_id))
+        if row is None:
+            # Промах сверяется с журналом: чат мог только что подписаться через другой процесс
+            row = (self._memory() or registry).get(int(chat_id))
+        return row
+
+    def add(self, chat_id, username=None, added_at=None):
+        """Добавляет или обновляет подписчика"""
+        with self.batch():
+            self._conn.execute(
+                "INSERT INTO subscribers (chat_id, username, added_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET username = excluded.username",
+                (int(chat_id), username, int(added_at or time.time()))
+            )
+            self._changed.add(int(chat_id))
+
+    def remove(self, chat_id):
+        """Удаляет подписчика, возвращает True, если он был"""
+        with self.batch():
+            cursor = self._conn.execute(
+                "DELETE FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            )
+            self._changed.add(int(chat_id))
+            return cursor.rowcount > 0
+
+    def remove_many(self, chat_ids):
+        """Удаляет нескольких подписчиков одной транзакцией, возвращает их число"""
+        chat_ids = [int(chat_id) for chat_id in chat_ids]
+        with self.batch():
+            cursor = self._conn.executemany(
+                "DELETE FROM subscribers WHERE chat_id = ?", ((chat_id,) for chat_id in chat_ids)
+            )
+            self._changed.update(chat_ids)
+            return cursor.rowcount
+
+    def __contains__(self, chat_id):
+        registry = self._memory(fresh=False)
+        if registry is not None:
+            return self._lookup(registry, chat_id) is not None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            ).fetchone()
+        return row is not None
+
+    def set_interval(self, chat_id, interval):
+        """Задает интервал рассылки для чата, возвращает False, если чата нет"""
+        with self.batch():
+            cursor = self._conn.execute(
+                "UPDATE subscribers SET interval = ? WHERE chat_id = ?",
+                (int(interval), int(chat_id))
+            )
+            self._changed.add(int(chat_id))
+            return cursor.rowcount > 0
+
+    def get_interval(self, chat_id):
+        """Интервал рассылки чата в секундах или None"""
+        registry = self._memory(fresh=False)
+        if registry is not None:
+            row = self._lookup(registry, chat_id)
+            return row[0] if row else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT interval FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_username(self, chat_id):
+        """Имя пользователя, подписавшего чат, или None"""
+        registry = self._memory(fresh=False)
+        if registry is not None:
+            return registry.username(int(chat_id)) if self._lookup(registry, chat_id) else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT username FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_watchlist(self, chat_id, watchlist):
+        """Задает список монет чата (подпись списка), возвращает False, если чата нет"""
+        with self.batch():
+            cursor = self._conn.execute(
+                "UPDATE subscribers SET watchlist = ? WHERE chat_id = ?",
+                (watchlist, int(chat_id))
+            )
+            self._changed.add(int(chat_id))
+            return cursor.rowcount > 0
+
+    def get_watchlist(self, chat_id):
+        """Подпись списка монет чата (DEFAULT_WATCHLIST — общий список) или None"""
+        registry = self._memory(fresh=False)
+        if registry is not None:
+            row = self._lookup(registry, chat_id)
+            return row[1] if row else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT watchlist FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def watchlists(self, interval=None):
+        """Различные списки монет и число чатов с каждым: {подпись: количество}"""
+        registry = self._memory()
+        if registry is not None:
+            return registry.watchlists(interval)
+        with self._lock:
+            if interval is None:
+                rows = self._conn.execute(
+                    "SELECT watchlist, COUNT(*) FROM subscribers GROUP BY watchlist"
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT watchlist, COUNT(*) FROM subscribers WHERE interval = ? GROUP BY watchlist",
+                    (int(interval),)
+                ).fetchall()
+        return dict(rows)
+
+    def watched_coins(self):
+        """Все монеты из личных списков чатов"""
+        registry = self._memory()
+        if registry is not None:
+            return {coin for watchlist in registry.watchlists() if watchlist != DEFAULT_WATCHLIST
+                    for coin in watchlist.split(",")}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT watchlist FROM subscribers WHERE watchlist != ?", (DEFAULT_WATCHLIST,)
+            ).fetchall()
+        return {coin for (watchlist,) in rows for coin in watchlist.split(",")}
+
+    def set_threshold(self, chat_id, threshold):
+        """Задает порог изменения цены в процентах (None — порог по умолчанию), возвращает False, если чата нет"""
+        with self.batch():
+            cursor = self._conn.execute(
+                "UPDATE subscribers SET threshold = ? WHERE chat_id = ?",
+                (threshold, int(chat_id))
+            )
+            self._changed.add(int(chat_id))
+            return cursor.rowcount > 0
+
+    def get_threshold(self, chat_id):
+        """Порог изменения цены чата в процентах или None (порог по умолчанию)"""
+        registry = self._memory(fresh=False)
+        if registry is not None:
+            row = self._lookup(registry, chat_id)
+            return row[2] if row else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT threshold FROM subscribers WHERE chat_id = ?", (int(chat_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def groups(self, interval=None):
+        """Группы рассылки и число чатов в каждой: {(подпись списка монет, порог): количество}"""
+        registry = self._memory()
+        if registry is not None:
+            return registry.groups(interval)
+        query = "SELECT watchlist, threshold, COUNT(*) FROM subscribers"
+        params = ()
+        if interval is not None:
+            query += " WHERE interval = ?"
+            params = (int(interval),)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY watchlist, threshold", params).fetchall()
+        return {(watchlist, threshold): count for watchlist, threshold, count in rows}
+
+    def count(self, interval=None):
+        """Количество подписчиков (всего или с указанным интервалом)"""
+        registry = self._memory()
+        if registry is not None:
+            return registry.count(interval)
+        with self._lock:
+            if interval is None:
+                return self._conn.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM subscribers WHERE interval = ?", (int(interval),)
+            ).fetchone()[0]
+
+    def iter_subscriptions(self, batch_size=1000, interval=None, shard=None):
+        """Постранично перебирает тройки (chat_id, подпись списка монет, порог), не загружая их все в память.
+
+        shard=(номер, всего) оставляет только чаты с chat_id % всего == номер.
+        """
+        registry = self._memory()
+        if registry is not None:
+            return registry.iter_rows(batch_size, interval, shard)
+        return self._iter_table(batch_size, interval, shard)
+
+    def _iter_table(self, batch_size, interval, shard):
+        # Постраничная выборка по ключу: блокировка не держится между страницами,
+        # а подписки и отписки во время рассылки не ломают перебор
+        conditions, params = [], []
+        if interval is not None:
+            conditions.append("interval = ?")
+            params.append(int(interval))
+        if shard is not None:
+            # Остаток в SQLite сохраняет знак делимого, а в Python — нет: приводим к Python
+            index, total = shard
+            conditions.append("((chat_id % ?) + ?) % ? = ?")
+            params += [int(total), int(total), int(total), int(index)]
+        conditions.append("chat_id > ?")
+        query = (
+            f"SELECT chat_id, watchlist, threshold FROM subscribers WHERE {' AND '.join(conditions)} "
+            f"ORDER BY chat_id LIMIT ?"
+        )
+        # Меньше любого идентификатора чата (у каналов они отрицательные)
+        last_id = -2 ** 63
+        while True:
+            with self._lock:
+                rows = self._conn.execute(query, (*params, last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def close(self):
+        """Закрывает хранилище"""
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_from_json(store, json_path):
+    """Однократно переносит подписчиков из старого active_chats.json в хранилище.
+
+    После переноса файл переименовывается в *.migrated, чтобы не загружать его повторно.
+    """
+    if not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            chats = json.load(f)
+        with store.batch():
+            for chat_id, info in chats.items():
+                info = info or {}
+                added_at = None
+                if info.get('added_at'):
+                    added_at = datetime.fromisoformat(info['added_at']).timestamp()
+                store.add(chat_id, info.get('username'), added_at)
+        os.replace(json_path, json_path + ".migrated")
+        print(f"📦 Перенесено {len(chats)} чатов из {json_path}")
+        return len(chats)
+    except Exception as e:
+        logger.error(f"Ошибка переноса чатов из {json_path}: {e}")
+        print(f"Ошибка переноса чатов из {json_path}: {e}")
+        return 0
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import ON_DEMAND, SCHEDULED, ChatRateLimiter, Overloaded, PriorityLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_chat_limit_and_single_notice(clock):
+    limiter = ChatRateLimiter(rate=1.0, burst=2)
+    assert limiter.check(1) is None and limiter.check(1) is None
+    assert limiter.check(1) == pytest.approx(1.0)
+    assert limiter.notify(1) and not limiter.notify(1)
+    # Другие чаты не ограничены
+    assert limiter.check(2) is None
+
+    clock[0] += 1.0
+    assert limiter.check(1) is None
+    # После допущенного запроса чат снова получит ответ об ограничении
+    assert limiter.notify(1)
+    assert limiter.limited == 1
+
+
+def test_refilled_buckets_are_swept(clock):
+    limiter = ChatRateLimiter(rate=1.0, burst=2, sweep_interval=10.0)
+    limiter.check(1)
+    clock[0] += 9.0
+    limiter.check(2)
+    clock[0] += 1.5
+    # Ведро чата 1 наполнилось (burst / rate = 2 с) и удаляется, ведро чата 2 еще нет
+    limiter.check(3)
+    assert set(limiter.buckets) == {2, 3}
+
+
+def test_free_slot_goes_to_scheduled_first():
+    async def main():
+        limiter = PriorityLimiter(1)
+        order = []
+
+        async def request(priority, name):
+            async with limiter.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await limiter.acquire(ON_DEMAND)
+        tasks = [asyncio.ensure_future(request(ON_DEMAND, "user")),
+                 asyncio.ensure_future(request(SCHEDULED, "broadcast"))]
+        await asyncio.sleep(0)
+        assert limiter.depth() == {"scheduled": 1, "on_demand": 1}
+        limiter.release(ON_DEMAND)
+        await asyncio.gather(*tasks)
+        return order, limiter.in_flight()
+
+    order, in_flight = asyncio.run(main())
+    assert order == ["broadcast", "user"]
+    assert in_flight == {"scheduled": 0, "on_demand": 0}
+
+
+def test_on_demand_share_and_shedding():
+    async def main():
+        limiter = PriorityLimiter(2, on_demand_limit=1, max_waiting=1)
+        await limiter.acquire(ON_DEMAND)
+        waiting = asyncio.ensure_future(limiter.acquire(ON_DEMAND))
+        await asyncio.sleep(0)
+        # Свободный слот оставлен рассылке
+        assert not waiting.done()
+        with pytest.raises(Overloaded):
+            await limiter.acquire(ON_DEMAND)
+        await asyncio.wait_for(limiter.acquire(SCHEDULED), 1)
+        # Плановые запросы не отклоняются, даже когда очередь заполнена
+        scheduled = asyncio.ensure_future(limiter.acquire(SCHEDULED))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        limiter.release(ON_DEMAND)
+        await asyncio.wait_for(scheduled, 1)
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.shed_counts() == {"scheduled": 0, "on_demand": 1}
+    assert limiter.in_flight() == {"scheduled": 2, "on_demand": 0}
+    assert limiter.depth() == {"scheduled": 0, "on_demand": 0}
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire(SCHEDULED)
+        waiter = asyncio.ensure_future(limiter.acquire(SCHEDULED))
+        await asyncio.sleep(0)
+        # Слот выдается ждущему, но его отменяют раньше, чем он проснулся
+        limiter.release(SCHEDULED)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(limiter.acquire(SCHEDULED), 1)
+        return limiter.in_flight()
+
+    assert asyncio.run(main()) == {"scheduled": 1, "on_demand": 0}
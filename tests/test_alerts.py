@@ -0,0 +1,64 @@
+import math
+
+import pytest
+
+from alerts import ABOVE, BELOW, AlertEngine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return AlertEngine(str(tmp_path / "alerts.db"), max_per_chat=3)
+
+
+def test_crossed_thresholds_fire_once(engine):
+    up = engine.add(1, "bitcoin", 110.0, 100.0)
+    down = engine.add(2, "bitcoin", 90.0, 100.0)
+    far = engine.add(3, "bitcoin", 200.0, 100.0)
+    assert (up.direction, down.direction) == (ABOVE, BELOW)
+
+    assert engine.check_snapshot({"bitcoin": {"usd": 105.0}}) == []
+    assert engine.check_snapshot({"bitcoin": {"usd": 115.0}}) == [(up, 115.0)]
+    # Порог падения пересечен только на обратном пути
+    assert engine.check_snapshot({"bitcoin": {"usd": 80.0}}) == [(down, 80.0)]
+    assert engine.check_snapshot({"bitcoin": {"usd": 120.0}}) == []
+    assert [alert.alert_id for alert in engine.alerts.values()] == [far.alert_id]
+
+
+def test_remove_and_reload(engine, tmp_path):
+    first = engine.add(1, "bitcoin", 110.0, 100.0)
+    engine.add(1, "ethereum", 5.0, 10.0)
+    assert engine.remove(1, first.alert_id)
+    assert not engine.remove(2, first.alert_id)
+
+    reloaded = AlertEngine(str(tmp_path / "alerts.db"))
+    assert [(alert.coin, alert.threshold) for alert in reloaded.alerts.values()] == [("ethereum", 5.0)]
+    reloaded.last_prices["ethereum"] = 10.0
+    assert len(reloaded.check_snapshot({"ethereum": {"usd": 4.0}})) == 1
+
+
+@pytest.mark.parametrize("threshold", [math.nan, math.inf, -math.inf, 0.0, -5.0])
+def test_invalid_thresholds_are_rejected(engine, threshold):
+    engine.add(1, "bitcoin", 110.0, 100.0)
+    with pytest.raises(ValueError):
+        engine.add(1, "bitcoin", threshold, 100.0)
+    assert len(engine) == 1
+    assert len(engine.check_snapshot({"bitcoin": {"usd": 111.0}})) == 1
+
+
+def test_invalid_prices_are_ignored(engine):
+    alert = engine.add(1, "bitcoin", 110.0, 100.0)
+    assert engine.check_snapshot({"bitcoin": {"usd": math.nan}}) == []
+    assert engine.check_snapshot({"bitcoin": {"usd": 120.0}}) == [(alert, 120.0)]
+
+
+def test_per_chat_limit(engine):
+    for threshold in (1.0, 2.0, 3.0):
+        engine.add(1, "bitcoin", threshold, 100.0)
+    with pytest.raises(ValueError):
+        engine.add(1, "bitcoin", 4.0, 100.0)
+
+
+def test_threshold_at_current_price_is_rejected(engine):
+    with pytest.raises(ValueError, match="текущей ценой"):
+        engine.add(1, "bitcoin", 100.0, 100.0)
+    assert engine.alerts == {}
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import broadcast
+from broadcast import DEAD, FAILED, RETRY, SENT, Broadcaster, TokenBucket
+from resilience import UpstreamPolicy
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: ответ для каждого чата задается списком (код, тело)"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.requests = []
+
+    def __call__(self, request):
+        chat_id = json.loads(request.content)["chat_id"]
+        self.requests.append((chat_id, time.monotonic()))
+        replies = self.replies.get(chat_id, [(200, {"ok": True})])
+        status, body = replies.pop(0) if len(replies) > 1 else replies[0]
+        return httpx.Response(status, json=body)
+
+
+def make_broadcaster(api, concurrency=4):
+    broadcaster = Broadcaster(
+        "TOKEN", concurrency=concurrency, rate=1000, base_url="http://bot.test",
+        policy=UpstreamPolicy("Telegram", max_retries=0, retry_statuses=())
+    )
+    transport = httpx.MockTransport(api)
+    broadcaster.http._new_client = lambda: httpx.AsyncClient(transport=transport)
+    return broadcaster
+
+
+def deliver(broadcaster, messages):
+    outcomes = {}
+
+    async def main():
+        result = await broadcaster.deliver(messages, lambda chat_id, outcome, error: outcomes.setdefault(chat_id, outcome))
+        await broadcaster.aclose()
+        return result
+
+    return asyncio.run(main()), outcomes
+
+
+def test_outcomes_by_telegram_reply(monkeypatch):
+    monkeypatch.setattr(broadcast, "PRIVATE_CHAT_INTERVAL", 0.0)
+    api = FakeBotAPI({
+        1: [(429, {"ok": False, "parameters": {"retry_after": 0.05}}), (200, {"ok": True})],
+        2: [(403, {"ok": False, "description": "Forbidden: bot was blocked by the user"})],
+        3: [(400, {"ok": False, "description": "Bad Request: chat not found"})],
+        4: [(502, {"ok": False})],
+        5: [(409, {"ok": False})],
+    })
+    result, outcomes = deliver(make_broadcaster(api), [(chat_id, "hi") for chat_id in range(1, 7)])
+
+    assert outcomes == {1: SENT, 2: DEAD, 3: DEAD, 4: RETRY, 5: FAILED, 6: SENT}
+    assert sorted(result.dead_chats) == [2, 3]
+    assert (result.total, result.sent, result.failed, result.retried) == (6, 2, 4, 1)
+
+
+def test_retry_after_pauses_all_sends(monkeypatch):
+    monkeypatch.setattr(broadcast, "PRIVATE_CHAT_INTERVAL", 0.0)
+    api = FakeBotAPI({1: [(429, {"ok": False, "parameters": {"retry_after": 0.2}}), (200, {"ok": True})]})
+    result, _ = deliver(make_broadcaster(api, concurrency=1), [(1, "a"), (2, "b"), (3, "c")])
+
+    assert result.sent == 3 and result.retried == 1
+    # После 429 общее ведро закрыто на retry_after: ни один следующий запрос не ушел раньше
+    (first_chat, throttled_at), *later = api.requests
+    assert first_chat == 1 and [chat_id for chat_id, _ in later] == [1, 2, 3]
+    assert all(sent_at >= throttled_at + 0.2 for _, sent_at in later)
+
+
+def test_messages_to_one_chat_are_spaced(monkeypatch):
+    monkeypatch.setattr(broadcast, "PRIVATE_CHAT_INTERVAL", 0.1)
+    api = FakeBotAPI({})
+    started = time.monotonic()
+    result, _ = deliver(make_broadcaster(api), [(7, "a"), (7, "b"), (-7, "c")])
+
+    assert result.sent == 3
+    times = {chat_id: [] for chat_id in (7, -7)}
+    for chat_id, sent_at in api.requests:
+        times[chat_id].append(sent_at)
+    # Интервал отсчитывается от момента, когда первому сообщению выдан слот, а не от его прихода
+    assert times[7][1] - started >= 0.1
+    # Лимит считается по чату: сообщение в другой чат его не ждет
+    assert times[-7][0] < times[7][1]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_rate_and_burst(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock[0] += 0.5
+    assert bucket.try_acquire() and not bucket.try_acquire()
+    # Запас не растет выше capacity
+    clock[0] += 60
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.pause(2)
+    assert not bucket.try_acquire()
+    clock[0] += 1.9
+    assert not bucket.try_acquire()
+    clock[0] += 0.2
+    assert bucket.try_acquire()
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import TTLCache
+
+
+def test_concurrent_loads_are_coalesced():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        values = await asyncio.gather(*(cache.aget_or_load("k", loader) for _ in range(10)))
+        return values, await cache.aget_or_load("k", loader)
+
+    values, cached = asyncio.run(main())
+    assert values == ["value"] * 10 and cached == "value"
+    assert len(calls) == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 9, 1)
+
+
+def test_threads_share_one_load():
+    cache = TTLCache(ttl=60)
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader, *followers]:
+        thread.join()
+    assert results == [42] * 5 and len(calls) == 1
+
+
+def test_failure_reaches_waiters_and_is_not_cached():
+    cache = TTLCache(ttl=60)
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream")
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_load("k", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert cache.get("k") is None
+    assert asyncio.run(cache.aget_or_load("k", lambda: asyncio.sleep(0, result="ok"))) == "ok"
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    cache = TTLCache(ttl=60)
+
+    async def main():
+        leader = asyncio.ensure_future(cache.aget_or_load("k", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache.aget_or_load("k", lambda: asyncio.sleep(0.01, result="fresh")))
+                   for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        # Ожидающие не получают чужую отмену: один загружает заново, остальные ждут его
+        values = await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        assert leader.cancelled()
+        return values
+
+    assert asyncio.run(main()) == ["fresh"] * 3
+    assert cache.get("k") == "fresh"
+    assert cache.misses == 2
+
+
+def test_uncacheable_results_and_expiry():
+    cache = TTLCache(ttl=60)
+    assert cache.get_or_load("bad", lambda: "Ошибка", cacheable=lambda value: not value.startswith("Ошибка")) == "Ошибка"
+    assert cache.get("bad") is None
+
+    cache.set("old", 1, ttl=0)
+    assert cache.get("old") is None
+    # Устаревшее значение остается запасным ответом
+    assert cache.get_stale("old") == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
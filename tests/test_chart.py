@@ -0,0 +1,92 @@
+import asyncio
+import json
+import struct
+import zlib
+
+import httpx
+
+import broadcast
+from broadcast import Broadcaster
+from chart import FALLING, PANEL_HEIGHT, RISING, ChartRenderer, resample
+from resilience import UpstreamPolicy
+
+
+def decode_png(png):
+    """(ширина, высота, строки без байта фильтра) простого PNG из encode_png"""
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+    width, height = struct.unpack(">II", png[16:24])
+    idat = png.index(b"IDAT")
+    length = struct.unpack(">I", png[idat - 4:idat])[0]
+    raw = zlib.decompress(png[idat + 4:idat + 4 + length])
+    stride = 1 + width * 3
+    assert len(raw) == stride * height
+    return width, height, [raw[row * stride + 1:(row + 1) * stride] for row in range(height)]
+
+
+def test_render_draws_one_panel_per_coin():
+    chart = ChartRenderer(width=120).render(
+        {"bitcoin": [1.0, 2.0, 3.0], "ethereum": [3.0, 1.0], "new": [5.0]}, "📈 график"
+    )
+    width, height, rows = decode_png(chart.png)
+    # Монета с одной ценой не рисуется
+    assert (width, height) == (120, 2 * PANEL_HEIGHT)
+    top, bottom = b"".join(rows[:PANEL_HEIGHT]), b"".join(rows[PANEL_HEIGHT:])
+    # Рост рисуется зеленым, падение — красным
+    assert bytes(RISING) in top and bytes(FALLING) not in top
+    assert bytes(FALLING) in bottom and bytes(RISING) not in bottom
+    assert chart.caption == "📈 график" and chart.file_id is None
+
+
+def test_render_without_history_returns_none():
+    assert ChartRenderer().render({"bitcoin": [1.0]}, "") is None
+
+
+def test_resample_keeps_first_and_last_price():
+    assert resample(list(range(100)), 5) == [0, 25, 50, 74, 99]
+    assert resample([1, 2], 5) == [1, 2]
+
+
+def test_same_series_share_one_chart_and_old_ones_are_evicted():
+    renderer = ChartRenderer(maxsize=2, points=2)
+    first = renderer.render({"bitcoin": [1.0, 2.0]}, "a")
+    # Ключ — содержимое рядов: цены старше последних points не учитываются
+    assert renderer.render({"bitcoin": [0.5, 1.0, 2.0]}, "b") is first
+    second = renderer.render({"bitcoin": [1.0, 2.5]}, "c")
+    assert second is not first
+
+    # Обращение к первому графику делает его свежим: вытесняется самый давний
+    assert renderer.get(first.key) is first
+    renderer.render({"ethereum": [2.0, 1.0]}, "d")
+    assert renderer.get(first.key) is first
+    assert renderer.get(second.key) is None
+
+
+def test_chart_is_uploaded_once_and_then_sent_by_file_id(monkeypatch):
+    monkeypatch.setattr(broadcast, "PRIVATE_CHAT_INTERVAL", 0.0)
+    photos = []
+
+    def api(request):
+        if request.url.path.endswith("/sendPhoto"):
+            if request.headers["Content-Type"].startswith("multipart/form-data"):
+                photos.append("upload")
+                return httpx.Response(200, json={"ok": True, "result": {"photo": [{"file_id": "small"},
+                                                                                  {"file_id": "FILE"}]}})
+            photos.append(json.loads(request.content)["photo"])
+        return httpx.Response(200, json={"ok": True})
+
+    chart = ChartRenderer().render({"bitcoin": [1.0, 2.0]}, "📈")
+    broadcaster = Broadcaster("TOKEN", concurrency=4, rate=1000, base_url="http://bot.test",
+                              policy=UpstreamPolicy("Telegram", max_retries=0, retry_statuses=()))
+    transport = httpx.MockTransport(api)
+    broadcaster.http._new_client = lambda: httpx.AsyncClient(transport=transport)
+
+    async def main():
+        result = await broadcaster.deliver([(chat_id, (chart, "текст")) for chat_id in range(1, 6)])
+        await broadcaster.aclose()
+        return result
+
+    result = asyncio.run(main())
+    assert result.sent == 5 and result.photos == 5 and result.uploads == 1
+    # Остальные чаты ждали загрузку и получили график по file_id
+    assert photos == ["upload"] + ["FILE"] * 4
+    assert chart.file_id == "FILE"
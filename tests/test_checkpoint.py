@@ -0,0 +1,25 @@
+import threading
+
+from checkpoint import Checkpoint
+
+
+def test_update_is_written_only_by_snapshot(tmp_path):
+    path = tmp_path / "state.json"
+    checkpoint = Checkpoint(str(path))
+    checkpoint.update(jobs={"3600": 7200})
+    assert not path.exists()
+
+    data = checkpoint.snapshot()
+    # Без новых изменений писать нечего
+    assert checkpoint.snapshot() is None
+    writer = threading.Thread(target=checkpoint.write, args=(data,))
+    writer.start()
+    writer.join()
+    assert Checkpoint(str(path)).load() == {"jobs": {"3600": 7200}}
+
+
+def test_failed_write_is_retried(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "missing" / "state.json"))
+    checkpoint.update(commands_hash="abc")
+    checkpoint.save()
+    assert checkpoint.snapshot() is not None
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+from cluster import CLAIMED, DONE, PENDING, ClusterCoordinator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def make_worker(tmp_path):
+    workers = []
+
+    def make(worker_id, shards=4):
+        worker = ClusterCoordinator(str(tmp_path / "cluster.db"), worker_id, shards=shards,
+                                    lease_seconds=15, worker_timeout=15)
+        workers.append(worker)
+        return worker
+
+    yield make
+    for worker in workers:
+        worker.close()
+
+
+def test_single_leader_and_takeover_after_lease_expires(clock, make_worker):
+    first, second = make_worker("a"), make_worker("b")
+    assert first.heartbeat() and not second.heartbeat()
+    assert first.leader() == "a"
+
+    # Лидер продлевает аренду, пока жив
+    clock[0] += 10
+    assert first.heartbeat() and not second.heartbeat()
+
+    # Лидер пропал: после истечения аренды ее захватывает другой воркер
+    clock[0] += 16
+    assert second.heartbeat()
+    assert second.leader() == "b"
+    assert not first.heartbeat() and not first.is_leader
+    assert second.live_workers() == ["a", "b"]
+
+
+def test_leave_hands_over_the_lease(clock, make_worker):
+    first, second = make_worker("a"), make_worker("b")
+    first.heartbeat()
+    first.leave()
+    assert second.heartbeat()
+    assert second.live_workers() == ["b"]
+
+
+def test_each_shard_is_claimed_once(clock, make_worker):
+    first, second = make_worker("a"), make_worker("b")
+    first.heartbeat()
+    second.heartbeat()
+    assert first.publish("3600:1", 3600, "", {"g": "text"})
+    # Повторная публикация того же тика (например, новым лидером) ничего не меняет
+    assert not second.publish("3600:1", 3600, "", {"g": "other"})
+
+    claimed = []
+    while True:
+        task = (first if len(claimed) % 2 else second).claim_shard()
+        if task is None:
+            break
+        assert task.texts == {"g": "text"}
+        claimed.append(task.shard)
+    assert sorted(claimed) == [0, 1, 2, 3]
+    assert first.progress("3600:1") == {CLAIMED: 4}
+
+
+def test_dead_worker_shard_is_reassigned_with_progress(clock, make_worker):
+    dying, survivor = make_worker("a", shards=1), make_worker("b", shards=1)
+    dying.heartbeat()
+    survivor.heartbeat()
+    dying.publish("3600:1", 3600, "text")
+    task = dying.claim_shard()
+    dying.mark_delivered(task.tick_id, task.shard, [10, 11])
+    # Шард живого воркера не забирают
+    assert survivor.claim_shard() is None
+
+    clock[0] += 16
+    survivor.heartbeat()
+    taken = survivor.claim_shard()
+    assert (taken.tick_id, taken.shard) == (task.tick_id, task.shard)
+    # Подхвативший шард пропускает уже получивших сообщение
+    assert survivor.delivered_chats(taken.tick_id, taken.shard) == {10, 11}
+
+    survivor.finish_shard(taken.tick_id, taken.shard)
+    # Оживший воркер не может завершить или вернуть чужой шард
+    dying.release_shard(task.tick_id, task.shard)
+    assert survivor.progress("3600:1") == {DONE: 1}
+
+
+def test_released_shard_goes_back_to_pending(clock, make_worker):
+    worker = make_worker("a", shards=2)
+    worker.heartbeat()
+    worker.publish("60:1", 60, "text")
+    task = worker.claim_shard()
+    worker.release_shard(task.tick_id, task.shard)
+    assert worker.progress("60:1") == {PENDING: 2}
+
+
+def test_prune_drops_old_ticks(clock, make_worker):
+    worker = make_worker("a", shards=1)
+    worker.heartbeat()
+    worker.publish("60:1", 60, "text")
+    task = worker.claim_shard()
+    worker.mark_delivered(task.tick_id, task.shard, [1])
+    clock[0] += 100
+    assert worker.prune(50) == 1
+    assert not worker.has_tick("60:1")
+    assert worker.delivered_chats("60:1", 0) == set()
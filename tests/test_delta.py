@@ -0,0 +1,27 @@
+from delta import DIGEST, SEND, SKIP, DeltaEngine
+
+
+def test_group_is_sent_until_delivery_is_recorded(tmp_path):
+    engine = DeltaEngine(str(tmp_path / "db.sqlite"), digest_interval=100)
+    prices = {"bitcoin": 100.0}
+    assert engine.decide("g", prices, 1.0, now=0) == SEND
+    # Отправка не удалась: delivered не вызван, следующий тик снова отправляется
+    assert engine.decide("g", prices, 1.0, now=10) == SEND
+
+    engine.delivered("g", prices, now=10)
+    assert engine.decide("g", {"bitcoin": 100.5}, 1.0, now=20) == SKIP
+    assert engine.decide("g", {"bitcoin": 101.0}, 1.0, now=20) == SEND
+    assert engine.decide("g", {"bitcoin": 100.5}, 1.0, now=110) == DIGEST
+
+
+def test_reload_picks_up_state_written_by_another_leader(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    old_leader = DeltaEngine(path)
+    new_leader = DeltaEngine(path)
+    old_leader.delivered("g", {"bitcoin": 100.0}, now=0)
+    old_leader.flush()
+    new_leader.delivered("stale", {"bitcoin": 1.0}, now=0)
+
+    new_leader.reload()
+    assert set(new_leader.states) == {"g"}
+    assert new_leader.decide("g", {"bitcoin": 100.5}, 1.0, now=1) == SKIP
@@ -0,0 +1,30 @@
+import threading
+
+from history import PriceHistory
+
+
+def test_snapshot_written_from_another_thread_loads_back(tmp_path):
+    path = str(tmp_path / "history.json")
+    history = PriceHistory(path, capacity=50)
+    for index in range(60):
+        history.update({"bitcoin": {"usd": 100.0 + index}, "bad": {"usd": None}}, timestamp=index * 3600.0)
+    state = history.snapshot()
+    # Отсчеты после снимка в файл не попадают
+    history.update({"bitcoin": {"usd": 1.0}}, timestamp=60 * 3600.0)
+    writer = threading.Thread(target=history.write, args=(state,))
+    writer.start()
+    writer.join()
+
+    loaded = PriceHistory(path, capacity=50)
+    loaded.load()
+    assert loaded.prices("bitcoin") == [110.0 + index for index in range(50)]
+    assert "bad" not in loaded.coins
+    assert loaded.indicators("bitcoin")["sma"] == sum(136.0 + index for index in range(24)) / 24
+
+
+def test_lazy_history_is_not_overwritten(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text('{"capacity": 10, "coins": {}}')
+    history = PriceHistory(str(path))
+    history.load(lazy=True)
+    assert history.snapshot() is None
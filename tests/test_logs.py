@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import queue
+import sys
+import time
+
+from logs import JsonFormatter, RotatingLogHandler, TimedQueueHandler, next_midnight
+
+
+def make_record(message, *args, exc_info=None, **extra):
+    record = logging.LogRecord("bot", logging.ERROR, __file__, 1, message, args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_keeps_extra_fields():
+    record = make_record("Ошибка отправки в чат %s", 42, chat_id=42, _private=1)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Ошибка отправки в чат 42"
+    assert (entry["level"], entry["logger"], entry["chat_id"]) == ("ERROR", "bot", 42)
+    assert "_private" not in entry and "args" not in entry and "msg" not in entry
+
+
+def test_json_formatter_adds_traceback():
+    try:
+        raise ValueError("плохой ответ")
+    except ValueError:
+        record = make_record("сбой", exc_info=sys.exc_info())
+    line = JsonFormatter().format(record)
+    assert "\n" not in line
+    assert "ValueError: плохой ответ" in json.loads(line)["exc_info"]
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["message"] for line in f]
+
+
+def make_handler(path, **kwargs):
+    handler = RotatingLogHandler(str(path), **kwargs)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def test_rotation_by_size(tmp_path):
+    path = tmp_path / "bot.log"
+    handler = make_handler(path, max_bytes=200, backup_count=2)
+    for index in range(10):
+        handler.handle(make_record(f"запись {index}"))
+    handler.close()
+    # Хранятся текущий файл и не больше двух прошлых, .1 — самый свежий из прошлых
+    assert sorted(os.listdir(tmp_path)) == ["bot.log", "bot.log.1", "bot.log.2"]
+    assert read_lines(path)[-1] == "запись 9"
+    assert read_lines(str(path) + ".1")[-1] < read_lines(path)[0]
+
+
+def test_file_left_from_yesterday_is_rotated_on_first_write(tmp_path):
+    path = tmp_path / "bot.log"
+    path.write_text(json.dumps({"message": "вчера"}) + "\n", encoding="utf-8")
+    yesterday = time.time() - 86400
+    os.utime(path, (yesterday, yesterday))
+
+    handler = make_handler(path)
+    handler.handle(make_record("сегодня"))
+    handler.close()
+    assert read_lines(path) == ["сегодня"]
+    assert read_lines(str(path) + ".1") == ["вчера"]
+    assert handler.rollover_at == next_midnight(time.time())
+
+
+def test_next_midnight():
+    now = time.time()
+    midnight = next_midnight(now)
+    assert 0 < midnight - now <= 86400 + 3600
+    assert time.localtime(midnight)[3:6] == (0, 0, 0)
+
+
+def test_queue_handler_counts_records_without_writing():
+    log_queue = queue.SimpleQueue()
+    handler = TimedQueueHandler(log_queue)
+    handler.handle(make_record("в очередь"))
+    assert handler.records == 1 and handler.seconds > 0
+    assert log_queue.get_nowait().getMessage() == "в очередь"
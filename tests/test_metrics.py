@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+import pytest
+
+from metrics import Histogram, Metrics, MetricsServer
+
+
+def samples(text):
+    """Строки с значениями из текста Prometheus: {имя{метки}: значение}"""
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    # Граница включается в свою корзину, как le в Prometheus
+    assert list(histogram.cumulative()) == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert histogram.quantile(0.5) == 0.1 and histogram.quantile(0.95) == float("inf")
+    assert Histogram().quantile(0.5) is None
+
+
+def test_render_stages_and_families():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.record("analysis", 0.05)
+    metrics.record("analysis", 0.5, "stale")
+    with pytest.raises(ValueError):
+        with metrics.track("send"):
+            raise ValueError
+    metrics.register("ai_queue_depth", "gauge", "Запросы к ИИ, ждущие слота", "priority",
+                     lambda: {"scheduled": 0, "on_demand": 3})
+
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# TYPE tradebot_stage_duration_seconds histogram" in text
+    assert "# TYPE tradebot_ai_queue_depth gauge" in text
+    values = samples(text)
+    assert values['tradebot_stage_duration_seconds_bucket{stage="analysis",le="0.1"}'] == 1
+    assert values['tradebot_stage_duration_seconds_bucket{stage="analysis",le="+Inf"}'] == 2
+    assert values['tradebot_stage_duration_seconds_sum{stage="analysis"}'] == pytest.approx(0.55)
+    assert values['tradebot_stage_requests_total{stage="analysis",status="stale"}'] == 1
+    assert values['tradebot_stage_requests_total{stage="send",status="error"}'] == 1
+    assert values['tradebot_stage_in_flight{stage="send"}'] == 0
+    assert values['tradebot_ai_queue_depth{priority="on_demand"}'] == 3
+
+
+def test_server_serves_metrics_only_on_its_path():
+    metrics = Metrics()
+    metrics.record("market", 0.2)
+
+    async def main():
+        server = MetricsServer(metrics, port=0)
+        await server.start()
+        try:
+            async with httpx.AsyncClient(base_url=f"http://{server.host}:{server.port}") as client:
+                return await client.get("/metrics?x=1"), await client.get("/")
+        finally:
+            await server.close()
+
+    found, missing = asyncio.run(main())
+    assert found.status_code == 200
+    assert found.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert samples(found.text)['tradebot_stage_duration_seconds_count{stage="market"}'] == 1
+    assert missing.status_code == 404
@@ -0,0 +1,37 @@
+from broadcast import RETRY, SENT
+from outbox import EXPIRED, Outbox
+
+
+def make_outbox(tmp_path, **kwargs):
+    return Outbox(str(tmp_path / "outbox.db"), **kwargs)
+
+
+def test_groups_are_delivered_with_their_texts(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.enqueue_groups("t1", [(1, "a"), (2, "b"), (3, "missing")], {"a": "A", "b": "B"})
+    assert list(outbox.iter_due("t1")) == [(1, "A"), (2, "B")]
+    outbox.record("t1", [(1, SENT, None), (2, RETRY, "429")])
+    # Отложенная строка не готова к отправке, доставленная удалена
+    assert list(outbox.iter_due("t1")) == []
+    assert outbox.stats() == {"pending": 1, "retrying": 1}
+
+
+def test_retries_end_as_failed(tmp_path):
+    outbox = make_outbox(tmp_path, max_attempts=2, base_delay=0)
+    outbox.enqueue_messages("t1", [(1, "hi")])
+    outbox.record("t1", [(1, RETRY, "503")])
+    outbox.record("t1", [(1, RETRY, "503")])
+    assert outbox.stats().get("failed") == 1
+
+
+def test_old_ticks_expire_instead_of_being_resent(tmp_path):
+    outbox = make_outbox(tmp_path, ttl=60)
+    outbox.enqueue_messages("old", [(1, "old analysis")])
+    outbox.enqueue_messages("new", [(2, "new analysis")])
+    outbox._conn.execute("UPDATE outbox_ticks SET created_at = created_at - 3600 WHERE tick_id = 'old'")
+    outbox._conn.commit()
+
+    assert outbox.due_ticks() == ["new"]
+    assert outbox.stats().get(EXPIRED) == 1
+    outbox.prune(0)
+    assert EXPIRED not in outbox.stats()
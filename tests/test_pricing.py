@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import httpx
+
+from pricing import MEDIAN, PriceAggregator
+from resilience import CLOSED, UpstreamPolicy
+
+
+class FakeSource:
+    """Источник цен с задержкой latency через UpstreamPolicy (как у настоящих клиентов)"""
+
+    def __init__(self, name, prices, latency=0.0, fail=False):
+        self.policy = UpstreamPolicy(name, deadline=5, max_retries=0, failure_threshold=1, reset_timeout=0)
+        self.prices = prices
+        self.latency = latency
+        self.fail = fail
+
+    async def get_prices(self, ids):
+        async def request():
+            await asyncio.sleep(self.latency)
+            if self.fail:
+                raise httpx.ConnectError("down")
+            return httpx.Response(200, json={coin: {"usd": self.prices[coin]} for coin in ids})
+        return (await self.policy.call(request)).json()
+
+
+def quote(usd):
+    return {"usd": usd, "usd_24h_change": 1.0}
+
+
+def test_combine_takes_median_and_drops_outliers():
+    a, b, c = FakeSource("a", {}), FakeSource("b", {}), FakeSource("c", {})
+    aggregator = PriceAggregator([a, b, c], max_deviation=5.0)
+    merged = aggregator.combine({
+        a: {"bitcoin": quote(100.0), "ethereum": quote(10.0)},
+        b: {"bitcoin": quote(101.0), "ethereum": quote(10.2)},
+        c: {"bitcoin": quote(150.0)},
+    })
+    assert merged["bitcoin"]["usd"] == 100.5
+    assert merged["ethereum"]["usd"] == 10.1
+    assert aggregator.stats[c].outliers == 1
+    assert aggregator.stats[a].outliers == 0
+
+
+def test_combine_two_diverging_prices_prefers_last_accepted():
+    a, b = FakeSource("a", {}), FakeSource("b", {})
+    aggregator = PriceAggregator([a, b], max_deviation=5.0)
+    aggregator.last_prices["bitcoin"] = 200.0
+    merged = aggregator.combine({a: {"bitcoin": quote(100.0)}, b: {"bitcoin": quote(199.0)}})
+    assert merged["bitcoin"]["usd"] == 199.0
+    assert aggregator.stats[a].outliers == 1
+
+
+def test_combine_skips_invalid_prices():
+    a, b = FakeSource("a", {}), FakeSource("b", {})
+    aggregator = PriceAggregator([a, b])
+    merged = aggregator.combine({a: {"bitcoin": quote(0)}, b: {"bitcoin": {"usd": None}}})
+    assert merged == {}
+
+
+def test_median_mode_queries_all_sources():
+    sources = [FakeSource(name, {"bitcoin": price}) for name, price in (("a", 100.0), ("b", 102.0), ("c", 104.0))]
+    aggregator = PriceAggregator(sources, mode=MEDIAN)
+    data = asyncio.run(aggregator.get_prices(["bitcoin"]))
+    assert data["bitcoin"]["usd"] == 102.0
+    assert all(aggregator.stats[source].requests == 1 for source in sources)
+
+
+def test_failed_source_falls_back_to_next():
+    down = FakeSource("down", {"bitcoin": 1.0}, fail=True)
+    up = FakeSource("up", {"bitcoin": 100.0}, latency=0.01)
+    aggregator = PriceAggregator([down, up], default_hedge_delay=1.0)
+    data = asyncio.run(aggregator.get_prices(["bitcoin"]))
+    assert data["bitcoin"]["usd"] == 100.0
+    assert aggregator.stats[down].errors == 1
+
+
+def test_cancelled_hedge_is_not_a_latency_sample():
+    fast = FakeSource("fast", {"bitcoin": 100.0}, latency=0.05)
+    slow = FakeSource("slow", {"bitcoin": 100.0}, latency=1.0)
+    aggregator = PriceAggregator([fast, slow], default_hedge_delay=0.03, probe_interval=3600)
+    aggregator.stats[fast].last_request_at = aggregator.stats[slow].last_request_at = time.monotonic()
+    # Быстрый источник подстрахован медленным, который отменяется после ответа быстрого
+    asyncio.run(aggregator.get_prices(["bitcoin"]))
+    stats = aggregator.stats[slow]
+    assert stats.hedged == 0 and aggregator.stats[fast].hedged == 1
+    assert not stats.latencies
+    assert stats.lower_bound is not None and stats.lower_bound < 0.1
+    assert slow.policy.breaker.state == CLOSED
+
+
+def test_probe_survives_and_closes_breaker():
+    fast = FakeSource("fast", {"bitcoin": 100.0}, latency=0.01)
+    recovered = FakeSource("recovered", {"bitcoin": 100.0}, latency=0.1)
+    # Источник упал в прошлом: предохранитель разомкнут, время на пробу пришло
+    recovered.policy.breaker.record_failure()
+    aggregator = PriceAggregator([fast, recovered], default_hedge_delay=1.0, probe_interval=0)
+
+    async def scenario():
+        data = await aggregator.get_prices(["bitcoin"])
+        # Быстрый источник уже ответил, проба еще идет
+        assert aggregator.probes
+        await asyncio.gather(*aggregator.probes)
+        await asyncio.sleep(0)
+        return data
+
+    assert asyncio.run(scenario())["bitcoin"]["usd"] == 100.0
+    assert recovered.policy.breaker.state == CLOSED
+    stats = aggregator.stats[recovered]
+    assert len(stats.latencies) == 1 and stats.latencies[0] >= 0.1
+    assert not aggregator.probes
+
+    # Быстрый источник упал: цены приходят от восстановившегося
+    fast.fail = True
+    aggregator.probe_interval = 3600
+    assert asyncio.run(aggregator.get_prices(["bitcoin"]))["bitcoin"]["usd"] == 100.0
+
+
+def test_probe_does_not_set_the_hedge_delay():
+    primary = FakeSource("primary", {"bitcoin": 100.0}, latency=0.3)
+    backup = FakeSource("backup", {"bitcoin": 101.0}, latency=0.01)
+    probed = FakeSource("probed", {"bitcoin": 102.0}, latency=0.5)
+    aggregator = PriceAggregator([primary, backup, probed], default_hedge_delay=1.0, probe_interval=60)
+    for source, latency in ((primary, 0.05), (backup, 0.1), (probed, 5.0)):
+        aggregator.stats[source].latencies.extend([latency] * 5)
+    aggregator.stats[primary].last_request_at = aggregator.stats[backup].last_request_at = time.monotonic()
+
+    async def scenario():
+        started = time.monotonic()
+        data = await aggregator.get_prices(["bitcoin"])
+        elapsed = time.monotonic() - started
+        await asyncio.gather(*aggregator.probes)
+        return data, elapsed
+
+    data, elapsed = asyncio.run(scenario())
+    # Подстраховка отсчитывается от основного запроса (p90 0.05 с), а не от пробы медленного источника
+    assert aggregator.stats[primary].hedged == 1
+    assert data["bitcoin"]["usd"] == 101.0 and elapsed < 0.25
+    assert aggregator.stats[probed].requests == 1
@@ -0,0 +1,52 @@
+from prompt import INDICATOR_COLUMNS, PromptBuilder, count_tokens, parse_batch
+
+INDICATORS = {"sma": 101.5, "ema": 100.25, "drawdown": -3.2, "volatility": 1.8, "rsi": 55.0}
+
+
+def market(coins):
+    return {
+        coin: {"usd": 100.0 + index, "usd_24h_change": 1.5, "indicators": dict(INDICATORS)}
+        for index, coin in enumerate(coins)
+    }
+
+
+def test_prompt_within_budget_is_not_cut():
+    data = market(["bitcoin", "ethereum"])
+    prompt, tokens, dropped = PromptBuilder(budget=10_000).build(data)
+    assert dropped == []
+    assert tokens == count_tokens(prompt)
+    assert "rsi" in prompt and "ethereum" in prompt
+
+
+def test_indicator_columns_are_dropped_before_coins():
+    data = market(["cardano", "bitcoin", "ethereum"])
+    builder = PromptBuilder(priority=["bitcoin", "ethereum"])
+    # Ровно столько, сколько занимает таблица всех монет без индикаторов
+    builder.budget = count_tokens(builder.render(data, builder._ordered_coins(data), []))
+    prompt, tokens, dropped = builder.build(data)
+    assert dropped == [name for name, _ in INDICATOR_COLUMNS]
+    assert tokens <= builder.budget
+    assert "cardano" in prompt
+
+    builder.budget -= 1
+    prompt, _, dropped = builder.build(data)
+    # Первой убирается монета с конца списка приоритета
+    assert dropped[-1] == "cardano" and "cardano" not in prompt
+
+
+def test_highest_priority_coin_is_kept_even_over_budget():
+    data = market(["ethereum", "bitcoin"])
+    prompt, tokens, dropped = PromptBuilder(budget=1, priority=["bitcoin"]).build(data)
+    assert "ethereum" in dropped and "bitcoin" in prompt
+    assert tokens > 1
+
+
+def test_batch_sections_are_cut_separately_and_parsed_back():
+    builder = PromptBuilder(budget=10_000)
+    prompt, _, dropped = builder.build_batch([market(["bitcoin"]), market(["ethereum"])])
+    assert dropped == []
+    assert "### 1" in prompt and "### 2" in prompt
+
+    answer = "### 1\nБиткоин растет.\n\n## 2:\nЭфир стоит."
+    assert parse_batch(answer, 2) == ["Биткоин растет.", "Эфир стоит."]
+    assert parse_batch("### 2\nтолько второй", 3) == [None, "только второй", None]
@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, UpstreamPolicy
+
+
+def open_policy():
+    """Политика без повторов с разомкнутым предохранителем, готовым к пробному запросу"""
+    policy = UpstreamPolicy("test", deadline=5, max_retries=0, failure_threshold=1, reset_timeout=0)
+    policy.breaker.record_failure()
+    assert policy.breaker.state == OPEN
+    return policy
+
+
+async def ok():
+    return httpx.Response(200)
+
+
+def test_breaker_opens_after_threshold_and_closes_after_probe():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 1
+
+    # Одна проба за раз
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=0)
+    for _ in range(5):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+
+def test_breaker_waits_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.state == OPEN
+
+
+def test_cancelled_probe_releases_breaker():
+    policy = open_policy()
+
+    async def scenario():
+        async def hang():
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(policy.call(hang))
+        await asyncio.sleep(0)
+        assert policy.breaker.state == HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # Отмена не ошибка сервиса: следующий вызов снова пробует
+        return await policy.call(ok)
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert policy.breaker.state == CLOSED
+    assert policy.failures == 0
+
+
+def test_unexpected_probe_error_counts_as_failure():
+    policy = open_policy()
+
+    async def broken():
+        raise ValueError("bad payload")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await policy.call(broken)
+
+    asyncio.run(scenario())
+    assert policy.breaker.state == OPEN
+    assert policy.failures == 1
+    # После reset_timeout предохранитель снова пускает пробу
+    assert asyncio.run(policy.call(ok)).status_code == 200
+
+
+def test_open_breaker_rejects_calls():
+    policy = UpstreamPolicy("test", max_retries=0, failure_threshold=1, reset_timeout=60)
+    policy.breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.call(ok))
+
+
+def test_retries_then_records_failure():
+    policy = UpstreamPolicy("test", deadline=5, max_retries=2, base_delay=0, failure_threshold=1)
+    calls = []
+
+    async def unavailable():
+        calls.append(1)
+        return httpx.Response(503)
+
+    response = asyncio.run(policy.call(unavailable))
+    assert response.status_code == 503
+    assert len(calls) == 3
+    assert policy.retries == 2
+    assert policy.breaker.state == OPEN
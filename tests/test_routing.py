@@ -0,0 +1,39 @@
+from routing import ModelRouter, market_move, plan_batches
+
+
+def snapshot(change):
+    return {"bitcoin": {"usd": 100.0, "usd_24h_change": change}}
+
+
+def test_market_move_needs_every_change():
+    assert market_move({"bitcoin": {"usd_24h_change": -4.0}, "ethereum": {"usd_24h_change": 1.0}}) == 4.0
+    assert market_move({"bitcoin": {"usd_24h_change": 1.0}, "ethereum": {"usd": 1.0}}) is None
+    assert market_move({}) is None
+
+
+def test_quiet_market_goes_to_the_cheap_model():
+    router = ModelRouter("main", "quiet", quiet_threshold=3.0)
+    assert router.route(snapshot(1.0)) == "quiet"
+    assert router.route(snapshot(-3.0)) == "main"
+    # Неизвестное изменение — основная модель
+    assert router.route(snapshot(None)) == "main"
+    assert ModelRouter("main", "").route(snapshot(0.0)) == "main"
+
+
+def test_batches_hold_one_model_and_at_most_size_snapshots():
+    router = ModelRouter("main", "quiet", quiet_threshold=3.0)
+    datasets = {f"k{index}": snapshot(change) for index, change in enumerate([1, 5, 2, 0.5, 7, 1.5])}
+    batches = plan_batches(datasets, router, 2)
+    assert [(model, list(items)) for model, items in batches] == [
+        ("quiet", ["k0", "k2"]),
+        ("quiet", ["k3", "k5"]),
+        ("main", ["k1", "k4"]),
+    ]
+    assert batches[0][1]["k0"] is datasets["k0"]
+
+
+def test_batch_size_below_one_means_one_snapshot_per_batch():
+    router = ModelRouter("main")
+    batches = plan_batches({"a": snapshot(1), "b": snapshot(2)}, router, 0)
+    assert [list(items) for _, items in batches] == [["a"], ["b"]]
+    assert plan_batches({}, router, 5) == []
@@ -0,0 +1,69 @@
+import asyncio
+
+from scheduler import JobScheduler, next_deadline
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def ignore(deadline, keys):
+    pass
+
+
+def test_deadlines_stay_on_the_grid_despite_late_runs():
+    clock = FakeClock(1000.0)
+    scheduler = JobScheduler(ignore, clock=clock)
+    assert scheduler.schedule("job", 60) == 1020
+
+    fired = []
+    # Каждый запуск опаздывает на 7 с: сдвиг не должен накапливаться
+    for _ in range(5):
+        clock.now = scheduler._heap[0][0] + 7
+        fired += list(scheduler._pop_due(clock.now))
+    assert fired == [1020, 1080, 1140, 1200, 1260]
+
+    # Пропущенные дедлайны не догоняются: следующий — ближайший по сетке
+    clock.now = 1500.0
+    assert list(scheduler._pop_due(clock.now)) == [1320]
+    assert scheduler._heap[0][0] == next_deadline(60, 1500.0) == 1560
+
+
+def test_jobs_with_one_interval_share_a_deadline():
+    clock = FakeClock(1000.0)
+    scheduler = JobScheduler(ignore, clock=clock)
+    scheduler.schedule(("analysis", 60), 60)
+    scheduler.schedule(("outbox", 60), 60)
+    scheduler.schedule(("analysis", 300), 300)
+
+    assert scheduler._pop_due(1020.0) == {1020: [("analysis", 60), ("outbox", 60)]}
+    assert scheduler._pop_due(1200.0) == {
+        1080: [("analysis", 60), ("outbox", 60)],
+        1200: [("analysis", 300)],
+    }
+
+
+def test_run_passes_grouped_jobs_to_handler():
+    calls = []
+
+    async def main():
+        clock = FakeClock(1000.0)
+
+        async def on_due(deadline, keys):
+            calls.append((deadline, sorted(keys)))
+            scheduler.stop()
+
+        scheduler = JobScheduler(on_due, clock=clock)
+        scheduler.schedule("a", 60)
+        scheduler.schedule("b", 60)
+        clock.now = 1020.0
+        await asyncio.wait_for(scheduler.run(), 1)
+        # Обработчик запущен задачей: даем ему завершиться
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert calls == [(1020, ["a", "b"])]
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from clients import AIClient
+from resilience import CLOSED, OPEN, UpstreamPolicy
+from streaming import AnalysisStream, ProgressiveMessage
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """Тело ответа, которое обрывается после первых фрагментов"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        raise httpx.ReadError("соединение разорвано")
+
+
+def sse(*events):
+    return "".join(f"data: {event}\n\n" for event in events).encode()
+
+
+def delta(text, finish_reason=None):
+    return json.dumps({"choices": [{"delta": {"content": text}, "finish_reason": finish_reason}]})
+
+
+def make_client(reply):
+    client = AIClient("http://ai.test/v1/chat/completions", "KEY", "model",
+                      policy=UpstreamPolicy("ИИ", max_retries=0, failure_threshold=1))
+    transport = httpx.MockTransport(lambda request: reply())
+    client._new_client = lambda: httpx.AsyncClient(transport=transport)
+    return client
+
+
+def stream_complete(client):
+    deltas = []
+
+    async def main():
+        try:
+            return await client.stream_complete("prompt", on_delta=deltas.append)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(main()), deltas
+
+
+def event_stream(content):
+    return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=content)
+
+
+def test_full_stream_is_assembled_and_counted_as_success():
+    usage = json.dumps({"choices": [], "usage": {"total_tokens": 12}})
+    client = make_client(lambda: event_stream(sse(delta("Бит"), delta("коин", "stop"), usage, "[DONE]")))
+    result, deltas = stream_complete(client)
+
+    assert deltas == ["Бит", "коин"]
+    assert result["choices"][0]["message"]["content"] == "Биткоин"
+    assert result["usage"] == {"total_tokens": 12}
+    assert client.policy.breaker.state == CLOSED and client.policy.failures == 0
+
+
+def test_stream_broken_mid_body_is_a_failure():
+    client = make_client(lambda: httpx.Response(
+        200, headers={"Content-Type": "text/event-stream"}, stream=BrokenStream([sse(delta("Бит"))])
+    ))
+    with pytest.raises(httpx.ReadError):
+        stream_complete(client)
+    # Заголовки пришли, но ответ не дочитан: предохранитель учел ошибку
+    assert client.policy.failures == 1 and client.policy.breaker.state == OPEN
+
+
+def test_stream_closed_without_end_marker_is_a_failure():
+    client = make_client(lambda: event_stream(sse(delta("Бит"))))
+    with pytest.raises(httpx.RemoteProtocolError):
+        stream_complete(client)
+    assert client.policy.breaker.state == OPEN
+
+
+def test_plain_json_reply_is_returned_as_is():
+    body = {"choices": [{"message": {"role": "assistant", "content": "готово"}}]}
+    client = make_client(lambda: httpx.Response(200, json=body))
+    result, deltas = stream_complete(client)
+    assert result == body and deltas == []
+    assert client.policy.breaker.state == CLOSED
+
+
+def test_every_watcher_sees_the_latest_text():
+    async def main():
+        stream = AnalysisStream()
+        seen = {1: [], 2: []}
+        watchers = [asyncio.create_task(stream.watch(seen[key].append)) for key in seen]
+        await asyncio.sleep(0)
+        stream.append("а")
+        await asyncio.sleep(0)
+        # Два фрагмента подряд: наблюдатель может пропустить промежуточный текст, но не последний
+        stream.append("б")
+        stream.append("в")
+        await asyncio.sleep(0)
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+        return seen
+
+    seen = asyncio.run(main())
+    assert seen[1] == seen[2] == ["а", "абв"]
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edits.append((text, time.monotonic()))
+
+
+class EmptyBucket:
+    def try_acquire(self):
+        return False
+
+
+def test_edits_are_coalesced_and_spaced():
+    bot = FakeBot()
+
+    async def main():
+        message = ProgressiveMessage(bot, 1, 10, "⏳", interval=0.05)
+        text = ""
+        for letter in "абвгде":
+            text += letter
+            message.update(text)
+            await asyncio.sleep(0.02)
+        assert await message.finish(text + "!")
+        return message
+
+    message = asyncio.run(main())
+    texts = [text for text, _ in bot.edits]
+    # Правок меньше, чем фрагментов, а последняя — окончательный текст
+    assert len(texts) < 7 and texts[-1] == "абвгде!"
+    assert message.edits == len(texts)
+    times = [at for _, at in bot.edits]
+    assert all(later - earlier >= 0.045 for earlier, later in zip(times, times[1:]))
+
+
+def test_empty_bucket_delays_only_intermediate_edits():
+    bot = FakeBot()
+
+    async def main():
+        message = ProgressiveMessage(bot, 1, 10, "⏳", interval=0.01, bucket=EmptyBucket())
+        message.update("черновик")
+        await asyncio.sleep(0.05)
+        return await message.finish("итог")
+
+    assert asyncio.run(main())
+    assert [text for text, _ in bot.edits] == ["итог"]
@@ -0,0 +1,111 @@
+import random
+
+import subscribers
+from subscribers import DEFAULT_WATCHLIST, SQLiteSubscriberStore, SubscriberRegistry
+
+WATCHLISTS = [DEFAULT_WATCHLIST, "bitcoin", "bitcoin,ethereum"]
+
+
+def random_row(rng):
+    return rng.choice((3600, 7200)), rng.choice(WATCHLISTS), rng.choice((None, 1.0, 2.5)), rng.randrange(10 ** 9)
+
+
+def expected_rows(reference, interval=None, shard=None, watchlist=None):
+    index, shards = shard or (0, 1)
+    return [
+        (chat_id, row[1], row[2]) for chat_id, row in sorted(reference.items())
+        if chat_id % shards == index and interval in (None, row[0]) and watchlist in (None, row[1])
+    ]
+
+
+def check(registry, reference):
+    assert len(registry) == len(reference)
+    for chat_id, row in reference.items():
+        assert registry.get(chat_id) == row[:3]
+    assert list(registry.iter_rows(batch_size=7)) == expected_rows(reference)
+    assert list(registry.iter_rows(batch_size=5, interval=3600, shard=(1, 3))) == \
+        expected_rows(reference, 3600, (1, 3))
+    assert list(registry.iter_rows(watchlist="bitcoin")) == expected_rows(reference, watchlist="bitcoin")
+    for interval in (None, 3600):
+        groups = {}
+        for _, (chat_interval, watchlist, threshold, _) in reference.items():
+            if interval in (None, chat_interval):
+                groups[watchlist, threshold] = groups.get((watchlist, threshold), 0) + 1
+        assert registry.groups(interval) == groups
+        assert registry.count(interval) == sum(groups.values())
+
+
+def test_registry_matches_reference_through_changes_and_compaction(monkeypatch):
+    monkeypatch.setattr(subscribers, "COMPACT_MIN", 10)
+    rng = random.Random(1)
+    reference = {chat_id: random_row(rng) for chat_id in sorted(rng.sample(range(-1000, 5000), 300))}
+    registry = SubscriberRegistry.from_rows((chat_id, *row) for chat_id, row in sorted(reference.items()))
+    registry.compact_ratio = 0.05
+    check(registry, reference)
+    compactions = 0
+    for _ in range(60):
+        changes = []
+        for chat_id in rng.sample(range(-1000, 5000), rng.randrange(1, 8)):
+            if rng.random() < 0.4:
+                reference.pop(chat_id, None)
+                changes.append((chat_id, None))
+            else:
+                reference[chat_id] = random_row(rng)
+                changes.append((chat_id, reference[chat_id]))
+        columns = registry.state[0]
+        registry.apply(changes)
+        compactions += registry.state[0] is not columns
+        check(registry, reference)
+    assert compactions > 0
+    # Перебор, начатый до изменений, идет по снимку
+    rows = registry.iter_rows()
+    first = next(rows)
+    registry.apply([(first[0] + 1, (3600, "bitcoin", None, 0))])
+    assert sum(1 for _ in rows) == len(reference) - 1
+
+
+def test_single_change_does_not_rebuild_columns():
+    registry = SubscriberRegistry.from_rows((chat_id, 3600, DEFAULT_WATCHLIST, None, 0) for chat_id in range(10_000))
+    columns = registry.state[0]
+    registry.apply([(20_000, (3600, "bitcoin", None, 0))])
+    registry.apply([(5, None)])
+    assert registry.state[0] is columns
+    assert 20_000 in registry and 5 not in registry
+    assert len(registry) == 10_000
+
+
+def test_usernames_are_stored_once():
+    registry = SubscriberRegistry.from_rows(
+        (chat_id, 3600, DEFAULT_WATCHLIST, None, 0, "admin" if chat_id % 2 else None) for chat_id in range(1000)
+    )
+    assert registry.username(1) == "admin" and registry.username(2) is None
+    assert registry.usernames == [None, "admin"]
+    registry.apply([(2, (3600, DEFAULT_WATCHLIST, None, 0, "guest")), (1, None)])
+    assert registry.username(2) == "guest" and registry.username(1) is None
+    registry.compact()
+    assert registry.username(2) == "guest" and registry.username(3) == "admin"
+
+
+def test_store_reads_match_with_and_without_registry(tmp_path):
+    path = str(tmp_path / "subscribers.db")
+    plain = SQLiteSubscriberStore(path)
+    memory = SQLiteSubscriberStore(path, in_memory=True)
+    memory.preload(wait=True)
+    with plain.batch():
+        for chat_id in range(100):
+            plain.add(chat_id, "user")
+    plain.set_watchlist(7, "bitcoin")
+    plain.set_threshold(8, 2.0)
+    plain.remove(9)
+    # Изменения другого соединения видны через журнал
+    memory._checked_at = 0.0
+    for store in (plain, memory):
+        assert 9 not in store and 8 in store
+        assert store.get_watchlist(7) == "bitcoin"
+        assert store.get_threshold(8) == 2.0
+        assert store.count() == 99
+        assert store.get_username(8) == "user" and store.get_username(9) is None
+    assert list(memory.iter_subscriptions()) == list(plain.iter_subscriptions())
+    assert memory.groups() == plain.groups()
+    plain.close()
+    memory.close()
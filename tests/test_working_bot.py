@@ -0,0 +1,166 @@
+import asyncio
+import os
+import signal
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+
+from admission import PriorityLimiter
+from benchmarks.fake_servers import Behaviour, FakeTelegram, parse_body
+
+DATA = {"bitcoin": {"usd": 100.0, "usd_24h_change": 1.5}}
+
+
+@pytest.fixture
+def working_bot(tmp_path, monkeypatch):
+    # Модуль читает настройки при импорте, а файлы бота создаются в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("TELEGRAM_TOKEN", "1:TEST")
+    import working_bot
+    monkeypatch.setattr(working_bot, "METRICS_PORT", 0)
+    return working_bot
+
+
+@pytest.fixture
+def bot(working_bot):
+    bot = working_bot.TradingBot()
+    yield bot
+    bot.subscribers.close()
+
+
+def run_analysis(bot, chat_id=1):
+    sent = []
+
+    async def send_message(chat_id, text):
+        sent.append(text)
+
+    async def get_crypto_data(coins):
+        return DATA
+
+    bot.send_message = send_message
+    bot.get_crypto_data = get_crypto_data
+    asyncio.run(bot.hourly_analysis(chat_id))
+    return sent
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_full_ai_queue_gets_a_fast_reply_with_cached_analysis(working_bot, bot, monkeypatch, stream):
+    monkeypatch.setattr(working_bot, "STREAM_ANALYSIS", stream)
+    # Очередь к ИИ не принимает ни одного запроса пользователя
+    bot.ai_slots = PriorityLimiter(1, max_waiting=0)
+    # Анализ этих данных устарел, но еще есть в кэше
+    bot.analysis_cache.set(working_bot.analysis_cache_key(DATA), "Биткоин растет.", ttl=0)
+
+    [text] = run_analysis(bot)
+    assert "Биткоин растет." in text and "перегружен" in text
+    assert "Ошибка анализа" not in text
+    assert bot.ai_client.policy.calls == 0
+    assert bot.ai_slots.shed_counts()["on_demand"] == 1
+
+
+def test_full_ai_queue_without_cache_says_so(bot):
+    bot.ai_slots = PriorityLimiter(1, max_waiting=0)
+    [text] = run_analysis(bot)
+    assert "перегружен" in text and "Ошибка анализа" not in text
+
+
+class RecordingTelegram(FakeTelegram):
+    """Заглушка Bot API, которая запоминает вызовы методов"""
+
+    def __init__(self):
+        super().__init__(Behaviour())
+        self.calls = []
+
+    async def handle_request(self, method, target, headers, body):
+        self.calls.append((target.rsplit("/", 1)[-1], parse_body(headers, body)))
+        return await super().handle_request(method, target, headers, body)
+
+
+@pytest.fixture
+def telegram():
+    """Заглушка Bot API в отдельном потоке со своим циклом событий"""
+    server = RecordingTelegram()
+    loop = asyncio.new_event_loop()
+    port = loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{port}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def command(chat_id, text):
+    return {
+        "update_id": chat_id,
+        "message": {
+            "message_id": 1, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test", "username": f"user{chat_id}"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def test_webhook_accepts_only_updates_with_the_secret(working_bot, telegram, monkeypatch):
+    server, api_url = telegram
+    port = free_port()
+    for name, value in [("TELEGRAM_API_URL", api_url), ("SCHEDULER_ENABLED", False),
+                        ("WEBHOOK_LISTEN", "127.0.0.1"), ("WEBHOOK_PORT", port),
+                        ("WEBHOOK_URL", "https://bot.example/"), ("WEBHOOK_SECRET", "s3cret")]:
+        monkeypatch.setattr(working_bot, name, value)
+    bot = working_bot.TradingBot()
+    working_bot.register_handlers(bot)
+    url = f"http://127.0.0.1:{port}/telegram"
+    responses = {}
+    # Выставляется, если run_webhook завершился сам: тогда останавливать нечего
+    finished = threading.Event()
+
+    def send_updates():
+        try:
+            give_up_at = time.monotonic() + 10
+            while "wrong" not in responses and not finished.is_set():
+                try:
+                    responses["wrong"] = httpx.post(url, json=command(7, "/start"),
+                                                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+                except httpx.TransportError:
+                    if time.monotonic() > give_up_at:
+                        raise
+                    time.sleep(0.05)
+            responses["right"] = httpx.post(url, json=command(8, "/start"),
+                                            headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+            while not server.delivered and not finished.is_set() and time.monotonic() < give_up_at:
+                time.sleep(0.05)
+        finally:
+            if not finished.is_set():
+                # Останавливает run_webhook так же, как Ctrl+C
+                os.kill(os.getpid(), signal.SIGINT)
+
+    sender = threading.Thread(target=send_updates)
+    sender.start()
+    # Как в отдельном процессе бота: у главного потока есть свой цикл событий (run_webhook его закроет)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        working_bot.run_webhook(bot)
+    finally:
+        finished.set()
+        asyncio.set_event_loop(None)
+        sender.join()
+
+    assert responses["wrong"].status_code == 403
+    assert responses["right"].status_code == 200
+    # Ответ получил только чат, приславший обновление с секретом
+    assert set(server.delivered) == {8}
+    assert 8 in bot.subscribers and 7 not in bot.subscribers
+    [(_, params)] = [call for call in server.calls if call[0] == "setWebhook"]
+    assert params["url"] == "https://bot.example/telegram"
+    assert params["secret_token"] == "s3cret"
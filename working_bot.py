@@ -1,48 +1,232 @@
-import requests
+import time
+
+# Момент запуска процесса (до тяжелых импортов): от него считается время до первого ответа
+STARTED_AT = time.time()
+
 import json
 import os
-import threading
-import time
+import asyncio
+import hashlib
 import logging
+import re
+import signal
+import sqlite3
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
-from telegram import Bot, Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram import BotCommand, Update
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters
+
+from admission import ON_DEMAND, SCHEDULED, ChatRateLimiter, Overloaded, PriorityLimiter
+from alerts import ABOVE, AlertEngine, valid_price
+from broadcast import (
+    GROUP_CHAT_INTERVAL, PRIVATE_CHAT_INTERVAL, RETRY, SENT, TELEGRAM_API_URL as DEFAULT_TELEGRAM_API_URL,
+    BroadcastResult, Broadcaster, TokenBucket
+)
+from cache import TTLCache
+from checkpoint import Checkpoint
+from clients import AIClient, CoinCapClient, MarketDataClient
+from delta import DIGEST, SKIP, DeltaEngine
+from history import PriceHistory
+from logs import setup_logging
+from metrics import Metrics, MetricsServer
+from outbox import Outbox
+from pricing import PriceAggregator
+from prompt import PromptBuilder, parse_batch
+from resilience import UpstreamPolicy
+from routing import ModelRouter, plan_batches
+from scheduler import JobScheduler, next_deadline
+from streaming import AnalysisStream, ProgressiveMessage
+from subscribers import DEFAULT_WATCHLIST, SQLiteSubscriberStore, migrate_from_json
 
 # Загружаем переменные из .env файла
 load_dotenv()
 
 # Получаем переменные окружения
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Адрес Bot API можно подменить (локальный Bot API сервер или заглушка бенчмарка)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", DEFAULT_TELEGRAM_API_URL).rstrip("/")
 PROXYAPI_KEY = os.getenv("PROXYAPI_KEY")
 PROXYAPI_URL = os.getenv("PROXYAPI_URL")
 AI_MODEL = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+# На спокойном рынке (изменение за сутки меньше порога, %) анализ пишет более дешевая модель
+AI_QUIET_MODEL = os.getenv("AI_QUIET_MODEL", "")
+AI_QUIET_THRESHOLD = float(os.getenv("AI_QUIET_THRESHOLD", "3"))
+# Анализы групп рассылки за тик запрашиваются пакетами: несколько таблиц в одном запросе
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "5"))  # 1 — каждый анализ отдельным запросом
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "8"))  # Одновременных запросов к ИИ
+# Запросы пользователей занимают не все слоты ИИ: остальные всегда свободны для рассылки
+AI_ON_DEMAND_CONCURRENCY = int(os.getenv("AI_ON_DEMAND_CONCURRENCY", "6"))
+AI_QUEUE_LIMIT = int(os.getenv("AI_QUEUE_LIMIT", "32"))  # Ждущих запросов пользователей, дальше — ответ из кэша
+# Лимиты на чат: запросов в минуту и сколько можно отправить подряд
+ANALYZE_RATE_LIMIT = float(os.getenv("ANALYZE_RATE_LIMIT", "2"))  # /analyze
+ANALYZE_BURST = int(os.getenv("ANALYZE_BURST", "3"))
+MESSAGE_RATE_LIMIT = float(os.getenv("MESSAGE_RATE_LIMIT", "6"))  # Обычные сообщения
+MESSAGE_BURST = int(os.getenv("MESSAGE_BURST", "5"))
+ANALYSIS_MAX_TOKENS = 200  # Лимит ответа на один снимок; пакет получает его на каждый снимок
 CRYPTO_API_URL = os.getenv("CRYPTO_API_URL")
 CRYPTO_IDS = os.getenv("CRYPTO_IDS", "bitcoin,ethereum,cardano").split(",")
+# Личные списки монет (/watch): сколько монет может быть в списке чата
+MAX_WATCHLIST_SIZE = int(os.getenv("MAX_WATCHLIST_SIZE", "10"))
+# Длина списка id в одном запросе к CoinGecko: длинное объединение списков делится на части
+MARKET_MAX_IDS_LENGTH = int(os.getenv("MARKET_MAX_IDS_LENGTH", "1500"))
 
-# Словарь для хранения активных чатов
-active_chats = {}
-CHAT_ID_FILE = "active_chats.json"  # Файл для сохранения активных чатов
+# Источники цен: coingecko (CRYPTO_API_URL) и coincap. При нескольких источниках
+# first — первый годный ответ с подстраховкой медленного источника следующим,
+# median — все источники сразу и медиана цен
+MARKET_SOURCES = [name.strip().lower() for name in os.getenv("MARKET_SOURCES", "coingecko").split(",") if name.strip()]
+COINCAP_API_URL = os.getenv("COINCAP_API_URL", "https://api.coincap.io/v2/assets")
+MARKET_AGGREGATION = os.getenv("MARKET_AGGREGATION", "first").lower()
+MARKET_HEDGE_DELAY = float(os.getenv("MARKET_HEDGE_DELAY", "1"))  # Пока у источника мало замеров задержки
+MARKET_MAX_DEVIATION = float(os.getenv("MARKET_MAX_DEVIATION", "5"))  # Отклонение от медианы, %, после которого цена — выброс
+
+# Хранилище активных чатов
+SUBSCRIBERS_DB = os.getenv("SUBSCRIBERS_DB", "subscribers.db")
+# Компактный реестр подписчиков в памяти: проверки подписки и перебор для рассылки без запросов к базе
+SUBSCRIBERS_IN_MEMORY = os.getenv("SUBSCRIBERS_IN_MEMORY", "true").lower() in ("1", "true", "yes")
+CHAT_ID_FILE = "active_chats.json"  # Старый файл чатов, переносится в базу при первом запуске
 
 # Настройки бота
-ANALYSIS_INTERVAL_SECONDS = 3600
-scheduler_running = False
-
-# Настройка логирования
-def setup_logging():
-    """Настраивает логирование"""
-    log_filename = f"trading_bot_{datetime.now().strftime('%Y%m%d')}.log"
-    logging.basicConfig(
-        level=logging.ERROR,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding='utf-8')
-        ]
-    )
-    return logging.getLogger(__name__)
+ANALYSIS_INTERVAL_SECONDS = 3600  # Интервал по умолчанию для новых чатов
+
+# Интервалы рассылки, которые чат может выбрать командой /interval
+INTERVAL_OPTIONS = {
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "1d": 86400
+}
+
+# Настройки рассылки
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "50"))
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "30"))
+
+# Подавление рассылки без заметных изменений: порог по умолчанию (%, 0 — каждый тик)
+# и как часто спокойным чатам приходит сводка вместо пропущенных сообщений
+DELTA_THRESHOLD = float(os.getenv("DELTA_THRESHOLD", "1"))
+DIGEST_INTERVAL = int(os.getenv("DIGEST_INTERVAL", "21600"))
+DELTA_STATE_RETENTION = 7 * 86400  # Сколько помнить группы рассылки, в которых не осталось чатов
+
+# Потоковый анализ для /analyze: цены отправляются сразу, анализ дописывается правками
+STREAM_ANALYSIS = os.getenv("STREAM_ANALYSIS", "true").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1"))  # Не чаще одной правки в чат за столько секунд
+EDIT_RATE_LIMIT = float(os.getenv("EDIT_RATE_LIMIT", "10"))  # Промежуточных правок в секунду на все чаты
+STREAM_PLACEHOLDER_DELAY = float(os.getenv("STREAM_PLACEHOLDER_DELAY", "0.5"))  # Быстрый анализ уходит одним сообщением
+ANALYSIS_PLACEHOLDER = "⏳ Анализ готовится..."
+
+# Графики цен
+CHARTS_ENABLED = os.getenv("CHARTS_ENABLED", "false").lower() in ("1", "true", "yes")  # График перед плановым анализом
+CHART_POINTS = int(os.getenv("CHART_POINTS", "168"))  # Сколько последних цен на графике
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "128"))
+
+# Настройки кэша
+MARKET_CACHE_TTL = float(os.getenv("MARKET_CACHE_TTL", "60"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+
+# Очередь доставки: повторы временных ошибок (429, 5xx, сеть) с растущей задержкой
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "30"))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "1800"))
+OUTBOX_RETRY_INTERVAL = int(os.getenv("OUTBOX_RETRY_INTERVAL", "60"))  # Как часто проверять отложенные
+OUTBOX_MESSAGE_TTL = float(os.getenv("OUTBOX_MESSAGE_TTL", "3600"))  # Недоставленное дольше сообщение не отправляется
+OUTBOX_RETENTION = 7 * 86400  # Сколько хранить сообщения, которые так и не удалось доставить
+
+# Ценовые алерты
+ALERTS_CHECK_INTERVAL = int(os.getenv("ALERTS_CHECK_INTERVAL", "60"))
+MAX_ALERTS_PER_CHAT = int(os.getenv("MAX_ALERTS_PER_CHAT", "20"))
+
+# История цен для технических индикаторов
+PRICE_HISTORY_FILE = os.getenv("PRICE_HISTORY_FILE", "price_history.json")
+PRICE_HISTORY_SIZE = int(os.getenv("PRICE_HISTORY_SIZE", "1000"))
+# История пополняется одним отсчетом за столько секунд, независимо от того, как часто запрашиваются цены
+PRICE_HISTORY_INTERVAL = int(os.getenv("PRICE_HISTORY_INTERVAL", "3600"))
+
+# Бюджет токенов на промпт анализа
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "400"))
 
-# Инициализируем логгер
-logger = setup_logging()
+# Таймауты внешних API (секунды)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+MARKET_READ_TIMEOUT = float(os.getenv("MARKET_READ_TIMEOUT", "10"))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", "60"))
+
+# Общий срок запроса вместе с повторами, повторы и предохранители
+MARKET_DEADLINE = float(os.getenv("MARKET_DEADLINE", "20"))
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", "90"))
+TELEGRAM_DEADLINE = float(os.getenv("TELEGRAM_DEADLINE", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Эндпоинт метрик Prometheus (0 - отключен) и чаты, которым доступна команда /metrics
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").split(",") if chat_id.strip()}
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес, на который Telegram отправляет обновления
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Очередь входящих обновлений и число одновременно обрабатываемых
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "256"))
+# Соединений для ответов пользователям; массовые рассылки идут через отдельный пул Broadcaster
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "8"))
+
+# Плановая рассылка и алерты (при нескольких процессах за балансировщиком включаются в одном)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Шардированная рассылка несколькими процессами (python working_bot.py --worker)
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "false").lower() in ("1", "true", "yes")
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID")  # По умолчанию: имя хоста и PID
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", "16"))
+CLUSTER_LEASE_SECONDS = float(os.getenv("CLUSTER_LEASE_SECONDS", "15"))
+CLUSTER_POLL_INTERVAL = float(os.getenv("CLUSTER_POLL_INTERVAL", "2"))
+CLUSTER_TICK_RETENTION = 2 * 86400  # Сколько хранить опубликованные тики и прогресс доставки
+
+# Быстрый перезапуск: последний снимок, анализ и состояние расписания
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", "bot_state.json")
+# Как часто измененное состояние записывается на диск, в секундах
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "60"))
+# Плановая рассылка, пропущенная во время перезапуска, отправляется сразу, если опоздание не больше этого
+CATCHUP_WINDOW = int(os.getenv("CATCHUP_WINDOW", "600"))
+# Цель для времени от запуска процесса до ответа на обновление, пришедшее во время перезапуска
+STARTUP_TARGET_SECONDS = float(os.getenv("STARTUP_TARGET_SECONDS", "3"))
+
+# Лог в JSON: пишется из очереди отдельным потоком, ротируется по размеру и в полночь
+LOG_FILE = os.getenv("LOG_FILE", "trading_bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+
+# Меню команд бота (устанавливается через setMyCommands, только если изменилось)
+BOT_COMMANDS = [
+    ("start", "🚀 Запустить бота и подписаться на уведомления"),
+    ("status", "📊 Показать статус бота и количество пользователей"),
+    ("analyze", "🔍 Выполнить анализ криптовалют сейчас"),
+    ("interval", "⏰ Выбрать интервал рассылки"),
+    ("watch", "⭐ Мои монеты: добавить монеты в список"),
+    ("unwatch", "➖ Убрать монеты из списка"),
+    ("threshold", "🔕 Порог изменения цены для рассылки"),
+    ("chart", "📈 График цен моих монет"),
+    ("alert", "🔔 Алерт, когда цена пересечет уровень"),
+    ("stop", "❌ Отписаться от уведомлений"),
+]
+
+# Данные старше этого срока помечаются в сообщении как устаревшие
+STALE_DATA_SECONDS = 15 * 60
+
+# Идентификатор монеты CoinGecko: строчные латинские буквы, цифры и дефис
+COIN_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]{0,63}$")
+
+# Инициализируем логгер: записи уходят в очередь, файл пишет отдельный поток
+log_handler = setup_logging(LOG_FILE, LOG_LEVEL, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT)
+logger = logging.getLogger(__name__)
 
 def format_interval(seconds):
     """Форматирует интервал в читаемый вид"""
@@ -55,208 +239,1176 @@ def format_interval(seconds):
     else:
         return f"каждый {seconds // 86400} день"
 
+def watchlist_signature(coins):
+    """Подпись списка монет: отсортированные id через запятую, для общего списка — DEFAULT_WATCHLIST"""
+    coins = set(coins)
+    if coins == set(CRYPTO_IDS):
+        return DEFAULT_WATCHLIST
+    return ",".join(sorted(coins))
+
+def watchlist_coins(watchlist):
+    """Монеты списка по его подписи"""
+    return watchlist.split(",") if watchlist else list(CRYPTO_IDS)
+
+def delivery_group(watchlist, threshold):
+    """Ключ группы рассылки: чаты с одним списком монет и одним порогом получают одно сообщение"""
+    return watchlist if threshold is None else f"{watchlist}@{threshold:g}"
+
+def format_duration(seconds):
+    """Длительность в часах или минутах"""
+    if seconds >= 3600:
+        return f"{seconds / 3600:.0f} ч"
+    return f"{max(seconds // 60, 1):.0f} мин"
+
+def format_digest(crypto_data, state, now=None):
+    """Сводка вместо пропущенных сообщений: изменения с последнего сообщения и диапазон цен"""
+    now = time.time() if now is None else now
+    message = (
+        f"🗒 Сводка: за {format_duration(now - state.delivered_at)} цены не сдвинулись на порог, "
+        f"пропущено обновлений: {state.skipped}\n\n"
+    )
+    for coin, data in crypto_data.items():
+        price = data.get('usd')
+        base = state.prices.get(coin)
+        if not isinstance(price, (int, float)):
+            continue
+        line = f"💰 {coin.upper()}: ${price:,.2f}"
+        if base:
+            line += f" ({(price / base - 1) * 100:+.2f}% с прошлого сообщения"
+            line += f", диапазон ${state.lows.get(coin, price):,.2f}–${state.highs.get(coin, price):,.2f})"
+        message += line + "\n"
+    message += "\nПолный анализ придет, когда цена изменится сильнее порога. /analyze - анализ сейчас"
+    return message
+
+def format_threshold(threshold):
+    """Порог изменения цены для сообщений"""
+    return f"{threshold:g}%" if threshold > 0 else "нет (каждый тик)"
+
+def format_coins(coins):
+    """Список монет для сообщений"""
+    return ", ".join(coin.capitalize() for coin in coins)
+
+def format_analysis_message(crypto_data, analysis):
+    """Формирует текст сообщения с ценами и анализом"""
+    message = "📊 Анализ криптовалют\n\n"
+    updated_at = [data['last_updated_at'] for data in crypto_data.values() if data.get('last_updated_at')]
+    if updated_at and time.time() - min(updated_at) > STALE_DATA_SECONDS:
+        message += f"⚠️ Данные от {datetime.fromtimestamp(min(updated_at)).strftime('%d.%m %H:%M')}, источник временно недоступен\n\n"
+    for coin, data in crypto_data.items():
+        price = data.get('usd', 'N/A')
+        change_24h = data.get('usd_24h_change', 'N/A')
+        message += f"💰 {coin.upper()}: ${price:,.2f} ({change_24h:+.2f}%)\n"
+        indicators = data.get('indicators')
+        if indicators:
+            message += f"   {format_indicators(indicators)}\n"
+
+    message += f"\n🤖 Анализ ИИ:\n{analysis}"
+    return message
+
+def format_indicators(indicators):
+    """Формирует строку с техническими индикаторами монеты"""
+    parts = [f"SMA: ${indicators['sma']:,.2f}", f"EMA: ${indicators['ema']:,.2f}"]
+    if indicators.get('rsi') is not None:
+        parts.append(f"RSI: {indicators['rsi']:.0f}")
+    if indicators.get('volatility') is not None:
+        parts.append(f"σ: {indicators['volatility']:.2f}%")
+    parts.append(f"просадка: {indicators['drawdown']:.2f}%")
+    return " | ".join(parts)
+
+def round_indicators(indicators):
+    """Округляет индикаторы, чтобы не раздувать промпт и ключ кэша"""
+    return {
+        key: (round(value, 6) if key in ('sma', 'ema') else round(value, 2))
+        if isinstance(value, float) else value
+        for key, value in indicators.items()
+    }
+
+def analysis_cache_key(data):
+    """Ключ кэша анализа: хеш данных, по которым он строится"""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def is_analysis_ok(analysis):
+    """Проверяет, что анализ получен без ошибки и его можно кэшировать"""
+    return not analysis.startswith("Ошибка анализа")
+
+def make_policy(name, deadline, **kwargs):
+    """Создает политику повторов и предохранитель для внешнего сервиса"""
+    return UpstreamPolicy(
+        name,
+        deadline=deadline,
+        max_retries=HTTP_MAX_RETRIES,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+        **kwargs
+    )
+
 class TradingBot:
-    def __init__(self):
-        self.bot = Bot(token=TELEGRAM_TOKEN)
-        self.app = Application.builder().token(TELEGRAM_TOKEN).build()
+    def __init__(self, worker=False):
+        # Воркер кластера только рассылает: обновления Telegram и алерты обслуживает основной процесс
+        self.worker = worker
+        # concurrent_updates: долгий /analyze одного пользователя не задерживает остальных.
+        # Очередь обновлений ограничена: когда обработчики не успевают, webhook
+        # перестает отвечать Telegram, пока в очереди не освободится место
+        self.app = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .base_url(f"{TELEGRAM_API_URL}/bot")
+            .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+            .concurrent_updates(UPDATE_CONCURRENCY)
+            .connection_pool_size(TELEGRAM_POOL_SIZE)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+        # Один клиент Telegram с пулом соединений приложения
+        self.bot = self.app.bot
+        # Цикл событий бота, на котором выполняются все асинхронные запросы
+        self.loop = None
+        self.scheduler = None
+        self.scheduler_task = None
+        # Задержки и исходы по этапам: данные, анализ, форматирование, отправка
+        self.metrics = Metrics()
+        self.metrics_server = MetricsServer(self.metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+        self.market_client = MarketDataClient(
+            CRYPTO_API_URL,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=MARKET_READ_TIMEOUT,
+            max_ids_length=MARKET_MAX_IDS_LENGTH,
+            policy=make_policy("CoinGecko", MARKET_DEADLINE)
+        )
+        market_sources = {
+            "coingecko": self.market_client,
+            "coincap": CoinCapClient(
+                COINCAP_API_URL,
+                connect_timeout=HTTP_CONNECT_TIMEOUT,
+                read_timeout=MARKET_READ_TIMEOUT,
+                max_ids_length=MARKET_MAX_IDS_LENGTH,
+                policy=make_policy("CoinCap", MARKET_DEADLINE)
+            ),
+        }
+        for name in MARKET_SOURCES:
+            if name not in market_sources:
+                print(f"⚠️ Неизвестный источник цен {name}, доступны: {', '.join(market_sources)}")
+        # Данные старше STALE_DATA_SECONDS считаются устаревшими: такой источник подстраховывается следующим
+        self.prices = PriceAggregator(
+            [market_sources[name] for name in MARKET_SOURCES if name in market_sources] or [self.market_client],
+            mode=MARKET_AGGREGATION,
+            default_hedge_delay=MARKET_HEDGE_DELAY,
+            max_deviation=MARKET_MAX_DEVIATION,
+            stale_after=STALE_DATA_SECONDS
+        )
+        self.ai_client = AIClient(
+            PROXYAPI_URL, PROXYAPI_KEY, AI_MODEL,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=AI_READ_TIMEOUT,
+            policy=make_policy("ProxyAPI", AI_DEADLINE)
+        )
+        self.router = ModelRouter(AI_MODEL, AI_QUIET_MODEL, AI_QUIET_THRESHOLD)
+        # Общий лимит запросов к ИИ: пакеты тика идут параллельно, но не больше AI_CONCURRENCY;
+        # освободившийся слот первой получает рассылка, запросы пользователей ждут за ней
+        self.ai_slots = PriorityLimiter(AI_CONCURRENCY, AI_ON_DEMAND_CONCURRENCY, max_waiting=AI_QUEUE_LIMIT)
+        self.analyze_limiter = ChatRateLimiter(ANALYZE_RATE_LIMIT / 60, ANALYZE_BURST)
+        self.message_limiter = ChatRateLimiter(MESSAGE_RATE_LIMIT / 60, MESSAGE_BURST)
+        self.metrics.register(
+            "ai_queue_depth", "gauge", "Запросы к ИИ, ждущие слота", "priority", self.ai_slots.depth
+        )
+        self.metrics.register(
+            "ai_in_flight", "gauge", "Выполняемые запросы к ИИ", "priority", self.ai_slots.in_flight
+        )
+        self.metrics.register(
+            "requests_shed_total", "counter", "Запросы, отклоненные без обращения к ИИ", "reason",
+            lambda: {
+                "ai_queue": sum(self.ai_slots.shed_counts().values()),
+                "analyze_rate": self.analyze_limiter.limited,
+                "message_rate": self.message_limiter.limited,
+            }
+        )
+        self.broadcaster = Broadcaster(
+            TELEGRAM_TOKEN,
+            concurrency=BROADCAST_CONCURRENCY,
+            rate=TELEGRAM_RATE_LIMIT,
+            base_url=TELEGRAM_API_URL,
+            metrics=self.metrics,
+            # 429 от Telegram обрабатывает сама рассылка
+            policy=make_policy("Telegram", TELEGRAM_DEADLINE, retry_statuses=(500, 502, 503, 504))
+        )
+        # Общий кэш для плановой рассылки и /analyze
+        self.market_cache = TTLCache(MARKET_CACHE_TTL, maxsize=CACHE_MAX_ENTRIES)
+        self.analysis_cache = TTLCache(ANALYSIS_CACHE_TTL, maxsize=CACHE_MAX_ENTRIES)
+        # Последние снимки, отправленные группам рассылки: тики без заметных изменений пропускаются
+        self.deltas = DeltaEngine(SUBSCRIBERS_DB, digest_interval=DIGEST_INTERVAL)
+        # Анализы, которые ИИ сейчас генерирует, по ключу кэша: их текст видят все ждущие /analyze
+        self.analysis_streams = {}
+        # Общий лимит промежуточных правок, чтобы они не отнимали лимит Telegram у рассылок
+        self.edit_bucket = TokenBucket(EDIT_RATE_LIMIT)
+        self.history = PriceHistory(PRICE_HISTORY_FILE, capacity=PRICE_HISTORY_SIZE)
+        # История читается при первом свежем снимке: до него хватает восстановленного снимка
+        self.history.load(lazy=True)
+        # Графики по содержимому: одинаковый график рисуется и загружается в Telegram один раз
+        # Рендерер графиков создается при первом графике: он не нужен до первого ответа
+        self.charts = None
+        self.prompt_builder = PromptBuilder(PROMPT_TOKEN_BUDGET, priority=CRYPTO_IDS, model=AI_MODEL)
+        self.last_token_usage = None
+        # Последний успешный анализ: отдается, пока ИИ недоступен
+        self.last_analysis = None
+        self.first_update_seen = False
         self.load_active_chats()
+        self.alerts = AlertEngine(SUBSCRIBERS_DB, max_per_chat=MAX_ALERTS_PER_CHAT)
+        # Монеты всех списков чатов и алертов: запрашиваются у CoinGecko одним снимком
+        self.market_ids = []
+        self.refresh_market_ids()
+        self.checkpoint = Checkpoint(CHECKPOINT_FILE)
+        self.restore_checkpoint()
+        self.outbox = Outbox(
+            SUBSCRIBERS_DB, max_attempts=OUTBOX_MAX_ATTEMPTS,
+            base_delay=OUTBOX_RETRY_DELAY, max_delay=OUTBOX_MAX_RETRY_DELAY, ttl=OUTBOX_MESSAGE_TTL
+        )
+        # Тики очереди, которые сейчас доставляются (их не берет повторная доставка)
+        self.outbox_busy = set()
+        self.cluster = None
+        if CLUSTER_ENABLED:
+            # Модуль кластера нужен только в кластерном режиме
+            from cluster import ClusterCoordinator
+            self.cluster = ClusterCoordinator(
+                SUBSCRIBERS_DB, CLUSTER_WORKER_ID, shards=CLUSTER_SHARDS,
+                lease_seconds=CLUSTER_LEASE_SECONDS, worker_timeout=CLUSTER_LEASE_SECONDS
+            )
+        self.cluster_tasks = []
+        self.cluster_stopping = False
+        self.cluster_wakeup = asyncio.Event()
 
     def load_active_chats(self):
-        """Загружает активные чаты из файла"""
-        global active_chats
-        try:
-            if os.path.exists(CHAT_ID_FILE):
-                with open(CHAT_ID_FILE, 'r', encoding='utf-8') as f:
-                    active_chats = json.load(f)
-                    print(f"📱 Загружено {len(active_chats)} активных чатов")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки активных чатов: {e}")
-            print(f"Ошибка загрузки активных чатов: {e}")
-
-    def save_active_chats(self):
-        """Сохраняет активные чаты в файл"""
-        try:
-            with open(CHAT_ID_FILE, 'w', encoding='utf-8') as f:
-                json.dump(active_chats, f, ensure_ascii=False, indent=2)
-            print(f"💾 Сохранено {len(active_chats)} активных чатов")
-        except Exception as e:
-            logger.error(f"Ошибка сохранения активных чатов: {e}")
-            print(f"Ошибка сохранения активных чатов: {e}")
+        """Открывает хранилище активных чатов"""
+        self.subscribers = SQLiteSubscriberStore(
+            SUBSCRIBERS_DB, default_interval=ANALYSIS_INTERVAL_SECONDS, in_memory=SUBSCRIBERS_IN_MEMORY
+        )
+        migrate_from_json(self.subscribers, CHAT_ID_FILE)
+        # Реестр грузится в фоне: запуск его не ждет, до готовности чтения идут в базу
+        self.subscribers.preload()
+        print(f"📱 Загружено {self.subscribers.count()} активных чатов")
 
     def add_chat(self, chat_id, username=None):
         """Добавляет чат в список активных"""
-        global active_chats
-        active_chats[str(chat_id)] = {
-            'username': username,
-            'added_at': datetime.now().isoformat()
-        }
-        self.save_active_chats()
+        self.subscribers.add(chat_id, username)
         print(f"✅ Добавлен чат: {chat_id} (@{username})")
 
     def remove_chat(self, chat_id):
         """Удаляет чат из списка активных"""
-        global active_chats
-        if str(chat_id) in active_chats:
-            del active_chats[str(chat_id)]
-            self.save_active_chats()
+        if self.subscribers.remove(chat_id):
             print(f"❌ Удален чат: {chat_id}")
 
-    def get_crypto_data(self):
-        """Получает данные о криптовалютах"""
+    def remove_chats(self, chat_ids):
+        """Удаляет несколько чатов одной транзакцией"""
+        removed = self.subscribers.remove_many(chat_ids)
+        for chat_id in chat_ids:
+            self.alerts.remove_chat(chat_id)
+        if removed:
+            print(f"❌ Удалено чатов: {removed}")
+
+    def refresh_market_ids(self):
+        """Пересчитывает объединение монет общего списка, личных списков и алертов"""
+        self.market_ids = sorted(set(CRYPTO_IDS) | self.subscribers.watched_coins() | self.alerts.coins())
+
+    def chat_coins(self, chat_id):
+        """Монеты из списка чата"""
+        return watchlist_coins(self.subscribers.get_watchlist(chat_id) or DEFAULT_WATCHLIST)
+
+    def restore_checkpoint(self):
+        """Восстанавливает последний снимок рынка и анализ: первый /analyze после перезапуска не ждет API и ИИ"""
+        state = self.checkpoint.load()
+        now = time.time()
+        market = state.get("market")
+        if market and market.get("ids") == self.market_ids:
+            # Просроченный снимок попадает в кэш с нулевым сроком: он доступен только через get_stale
+            age = now - market["fetched_at"]
+            self.market_cache.set(tuple(self.market_ids), market["data"], ttl=max(MARKET_CACHE_TTL - age, 0))
+        analysis = state.get("analysis")
+        if analysis:
+            age = now - analysis["created_at"]
+            self.analysis_cache.set(analysis["key"], analysis["text"], ttl=max(ANALYSIS_CACHE_TTL - age, 0))
+            self.last_analysis = (analysis["text"], analysis["created_at"])
+        self.last_token_usage = state.get("token_usage")
+        if market or analysis:
+            print(f"♻️ Восстановлено состояние из {CHECKPOINT_FILE}")
+
+    def missed_ticks(self, now=None):
+        """Плановые рассылки, дедлайн которых пришелся на перезапуск: {дедлайн: [ключи задач]}"""
+        now = time.time() if now is None else now
+        done = self.checkpoint.get("jobs") or {}
+        missed = {}
+        for interval in INTERVAL_OPTIONS.values():
+            last_done = done.get(str(interval))
+            if last_done is None:
+                continue
+            # Последний уже наступивший дедлайн сетки; более ранние пропуски не догоняются
+            deadline = next_deadline(interval, now) - interval
+            if last_done < deadline and now - deadline <= CATCHUP_WINDOW:
+                missed.setdefault(deadline, []).append(("analysis", interval))
+        return missed
+
+    async def sync_bot_commands(self):
+        """Устанавливает меню команд, только если оно изменилось с прошлого запуска"""
+        digest = hashlib.sha1(json.dumps(BOT_COMMANDS, ensure_ascii=False).encode('utf-8')).hexdigest()
+        if self.checkpoint.get("commands_hash") == digest:
+            return
         try:
-            params = {
-                'ids': ','.join(CRYPTO_IDS),
-                'vs_currencies': 'usd',
-                'include_24hr_change': 'true'
-            }
-            response = requests.get(CRYPTO_API_URL, params=params)
-            data = response.json()
+            await self.app.bot.set_my_commands([BotCommand(command, description) for command, description in BOT_COMMANDS])
+            self.checkpoint.update(commands_hash=digest)
+            print("✅ Команды бота установлены")
+        except Exception as e:
+            print(f"❌ Ошибка установки команд: {e}")
+            logger.error(f"Ошибка установки команд: {e}")
+
+    async def on_update_handled(self, update, context):
+        """Замеряет время от запуска процесса до ответа на первое обновление, пришедшее во время перезапуска"""
+        if self.first_update_seen:
+            return
+        self.first_update_seen = True
+        message = update.effective_message
+        # Сообщение, отправленное уже после запуска, не ждало перезапуска
+        if message is None or message.date is None or message.date.timestamp() > STARTED_AT:
+            return
+        elapsed = time.time() - STARTED_AT
+        self.metrics.record("first_update", elapsed)
+        print(f"🚀 Первое обновление обработано через {elapsed:.2f} с после запуска")
+        if elapsed > STARTUP_TARGET_SECONDS:
+            print(f"⚠️ Запуск дольше цели {STARTUP_TARGET_SECONDS:g} с")
+            logger.error(f"Первое обновление обработано через {elapsed:.2f} с, цель {STARTUP_TARGET_SECONDS:g} с")
+
+    async def on_startup(self, application):
+        """Запоминает цикл событий бота, запускает планировщик и эндпоинт метрик.
+
+        Все, что требует сети, запускается в фоне: прием обновлений не ждет этих запросов.
+        """
+        self.loop = asyncio.get_running_loop()
+        if not self.worker:
+            asyncio.create_task(self.sync_bot_commands())
+        if SCHEDULER_ENABLED:
+            self.start_scheduler()
+            for deadline, keys in self.missed_ticks().items():
+                print(f"⏪ Отправляю рассылку, пропущенную при перезапуске ({datetime.fromtimestamp(deadline).strftime('%H:%M')})")
+                asyncio.create_task(self.run_due_jobs(deadline, keys))
+            if not self.worker:
+                # Рассылка, прерванная остановкой или падением, продолжается с того же места
+                asyncio.create_task(self.retry_outbox())
+        if self.cluster is not None:
+            await self.start_cluster()
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                print(f"❌ Не удалось запустить эндпоинт метрик: {e}")
+                logger.error(f"Не удалось запустить эндпоинт метрик: {e}")
+        ready = time.time() - STARTED_AT
+        self.metrics.record("ready", ready)
+        print(f"🚀 Бот готов через {ready:.2f} с после запуска")
+
+    async def on_shutdown(self, application):
+        """Останавливает планировщик, сохраняет историю и закрывает пулы соединений"""
+        self.stop_scheduler()
+        if self.cluster is not None:
+            await self.stop_cluster()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        self.history.save()
+        self.checkpoint.save()
+        for source in self.prices.sources:
+            await source.aclose()
+        if self.market_client not in self.prices.sources:
+            await self.market_client.aclose()
+        await self.ai_client.aclose()
+        await self.broadcaster.aclose()
+
+    def run_sync(self, coro):
+        """Выполняет корутину из синхронного кода (скрипты, отладка, сторонние потоки).
+
+        Бот сам эти обертки не использует. Из потока, где работает цикл событий,
+        вызывать нельзя: ожидание результата заблокировало бы этот цикл, поэтому
+        такой вызов сразу завершается RuntimeError — там нужен await.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            coro.close()
+            raise RuntimeError("Синхронную обертку нельзя вызывать из цикла событий: используйте await")
+        if self.loop is not None and self.loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        return asyncio.run(coro)
+
+    async def get_market_snapshot(self):
+        """Получает снимок рынка по объединению монет всех списков (через кэш)"""
+        ids = list(self.market_ids)
+        key = tuple(ids)
+        with self.metrics.track("market") as span:
+            data = await self.market_cache.aget_or_load(
+                key,
+                lambda: self.fetch_crypto_data(ids),
+                cacheable=lambda data: not isinstance(data, str)
+            )
+            if isinstance(data, str):
+                # Источник недоступен или предохранитель разомкнут: отдаем последний удачный снимок
+                stale = self.market_cache.get_stale(key)
+                if stale is not None:
+                    print(f"⚠️ {data}. Использую последние сохраненные данные")
+                    span.status = "stale"
+                    return stale
+                span.status = "error"
             return data
+
+    async def get_crypto_data(self, coins=None):
+        """Получает данные о монетах списка (по умолчанию CRYPTO_IDS) из общего снимка рынка"""
+        snapshot = await self.get_market_snapshot()
+        if isinstance(snapshot, str):
+            return snapshot
+        coins = coins or CRYPTO_IDS
+        data = {coin: snapshot[coin] for coin in coins if coin in snapshot}
+        if not data:
+            return f"Ошибка получения данных: нет цен для {', '.join(coins)}"
+        return data
+
+    def get_crypto_data_sync(self):
+        """Получает данные о криптовалютах (синхронно, не из цикла событий — см. run_sync)"""
+        return self.run_sync(self.get_crypto_data())
+
+    async def fetch_crypto_data(self, ids=None):
+        """Запрашивает данные о криптовалютах у API (по умолчанию объединение всех списков)"""
+        ids = ids or self.market_ids
+        try:
+            data = await self.prices.get_prices(ids)
         except Exception as e:
             return f"Ошибка получения данных: {e}"
 
-    def analyze_with_proxyapi(self, data):
-        """Анализирует данные с помощью ProxyAPI"""
-        try:
-            prompt = f"""
-            Проанализируй следующие данные о криптовалютах и дай краткий анализ:
-            {json.dumps(data, indent=2, ensure_ascii=False)}
+        # Индикаторы по истории цен попадают в кэшированный снимок — и в сообщение, и в промпт;
+        # сама история пополняется по расписанию (sample_history)
+        for coin, coin_data in data.items():
+            indicators = self.history.indicators(coin)
+            if indicators:
+                coin_data['indicators'] = round_indicators(indicators)
+        self.checkpoint.update(market={"ids": ids, "data": data, "fetched_at": time.time()})
 
-            Дай краткий анализ (2-3 предложения) на русском языке о текущем состоянии рынка.
-            """
+        # Алерты проверяются на каждом свежем снимке, доставка идет в фоне. Воркер
+        # кластера их не проверяет, даже став лидером: алерты добавляет и удаляет
+        # основной процесс, а копия воркера, загруженная при запуске, устарела бы
+        if not self.worker:
+            triggered = self.alerts.check_snapshot(data)
+            if triggered:
+                asyncio.create_task(self.deliver_alerts(triggered))
+        return data
 
-            headers = {
-                "Authorization": f"Bearer {PROXYAPI_KEY}",
-                "Content-Type": "application/json"
-            }
+    async def analyze_with_proxyapi(self, data, on_partial=None, batch=None, priority=ON_DEMAND):
+        """Анализирует данные с помощью ProxyAPI (через кэш).
 
-            payload = {
-                "model": AI_MODEL,
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 200
-            }
+        on_partial(текст) вызывается с уже сгенерированной частью анализа,
+        пока ответ ИИ приходит потоком. batch — задача пакетного запроса
+        (request_batch), в который уже попали эти данные. priority — место
+        запроса в очереди к ИИ (SCHEDULED для рассылки). Если очередь к ИИ
+        заполнена, запрос ON_DEMAND завершается Overloaded сразу, без ожидания.
+        """
+        key = analysis_cache_key(data)
+        with self.metrics.track("analysis") as span:
+            watcher = None
+            if on_partial is not None:
+                stream = self.analysis_streams.setdefault(key, AnalysisStream())
+                watcher = asyncio.create_task(stream.watch(on_partial))
+            try:
+                analysis = await self.analysis_cache.aget_or_load(
+                    key,
+                    lambda: (self.request_analysis(data, priority) if batch is None
+                             else self.analysis_from_batch(batch, key, data)),
+                    cacheable=is_analysis_ok
+                )
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+                    # Запрос по этому ключу завершен, новые ждущие пойдут в кэш
+                    self.analysis_streams.pop(key, None)
+            if is_analysis_ok(analysis):
+                self.last_analysis = (analysis, time.time())
+                return analysis
+
+            # ИИ недоступен: отдаем анализ этих же данных или последний удачный
+            span.status = "stale"
+            stale = self.analysis_cache.get_stale(key)
+            if stale is not None:
+                return stale
+            if self.last_analysis is not None:
+                text, created_at = self.last_analysis
+                print(f"⚠️ {analysis}. Использую последний анализ")
+                return f"{text}\n(анализ от {datetime.fromtimestamp(created_at).strftime('%d.%m %H:%M')}, ИИ временно недоступен)"
+            span.status = "error"
+            return analysis
+
+    def analyze_with_proxyapi_sync(self, data):
+        """Анализирует данные с помощью ProxyAPI (синхронно, не из цикла событий — см. run_sync)"""
+        return self.run_sync(self.analyze_with_proxyapi(data))
+
+    async def request_analysis(self, data, priority=ON_DEMAND):
+        """Запрашивает анализ данных у ProxyAPI; Overloaded из очереди к ИИ передается вызывающему"""
+        try:
+            prompt, prompt_tokens, dropped = self.prompt_builder.build(data)
+            if dropped:
+                print(f"✂️ Промпт сокращен до {prompt_tokens} токенов, убрано: {', '.join(dropped)}")
 
-            response = requests.post(PROXYAPI_URL, headers=headers, json=payload)
-            result = response.json()
+            model = self.router.route(data)
+            self.router.routed[model] += 1
+            async with self.ai_slots.slot(priority):
+                if STREAM_ANALYSIS:
+                    # Фрагменты ответа сразу видны всем, кто ждет этот анализ
+                    key = analysis_cache_key(data)
+                    stream = self.analysis_streams.setdefault(key, AnalysisStream())
+                    try:
+                        result = await self.ai_client.stream_complete(
+                            prompt, max_tokens=ANALYSIS_MAX_TOKENS, on_delta=stream.append, model=model
+                        )
+                    finally:
+                        self.analysis_streams.pop(key, None)
+                else:
+                    result = await self.ai_client.complete(prompt, max_tokens=ANALYSIS_MAX_TOKENS, model=model)
+            self.record_usage(result, prompt_tokens)
             analysis = result.get('choices', [{}])[0].get('message', {}).get('content', 'Ошибка анализа')
+            if is_analysis_ok(analysis):
+                self.checkpoint.update(
+                    analysis={"key": analysis_cache_key(data), "text": analysis, "created_at": time.time()},
+                    token_usage=self.last_token_usage
+                )
             return analysis
+        except Overloaded:
+            # Это не ошибка ИИ: отвечает вызывающий, не дожидаясь слота
+            raise
         except Exception as e:
             return f"Ошибка анализа: {e}"
 
-    def send_message_sync(self, chat_id, text):
-        """Отправляет сообщение в Telegram (синхронно)"""
+    def record_usage(self, result, prompt_tokens):
+        """Запоминает расход токенов из ответа ИИ"""
+        usage = result.get('usage')
+        if usage:
+            self.last_token_usage = usage
+            print(
+                f"🧮 Токены: промпт {usage.get('prompt_tokens')} (оценка {prompt_tokens}), "
+                f"ответ {usage.get('completion_tokens')}, всего {usage.get('total_tokens')}"
+            )
+
+    async def analyze_batch(self, datasets):
+        """Анализы нескольких снимков за тик: {ключ кэша: анализ}.
+
+        Снимки, анализа которых нет в кэше, делятся на пакеты по модели
+        (plan_batches) и запрашиваются одним запросом на пакет; пакеты идут
+        параллельно в пределах AI_CONCURRENCY. Каждый снимок проходит через
+        analyze_with_proxyapi, так что кэш, схлопывание с /analyze и запасной
+        анализ работают как для одиночного запроса.
+        """
+        unique = {}
+        for data in datasets:
+            unique.setdefault(analysis_cache_key(data), data)
+        missing = {key: data for key, data in unique.items() if self.analysis_cache.get(key) is None}
+        batches = {}
+        for model, items in plan_batches(missing, self.router, AI_BATCH_SIZE):
+            if len(items) > 1:
+                task = asyncio.ensure_future(self.request_batch(items, model))
+                batches.update(dict.fromkeys(items, task))
+        analyses = await asyncio.gather(
+            *(self.analyze_with_proxyapi(data, batch=batches.get(key), priority=SCHEDULED)
+              for key, data in unique.items())
+        )
+        return dict(zip(unique, analyses))
+
+    async def analysis_from_batch(self, batch, key, data):
+        """Анализ снимка из пакетного ответа; если его раздел не разобран — отдельным запросом"""
+        analysis = (await batch).get(key)
+        if analysis is None:
+            return await self.request_analysis(data, SCHEDULED)
+        return analysis
+
+    async def request_batch(self, datasets, model):
+        """Запрашивает анализы нескольких снимков ({ключ: данные}) одним запросом.
+
+        Возвращает {ключ: анализ} только для разобранных разделов ответа;
+        при ошибке — пустой словарь, и каждый снимок запрашивается отдельно.
+        """
+        keys = list(datasets)
         try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, json=data, timeout=10)
-            if response.status_code == 200:
-                print(f"📤 Сообщение отправлено в чат {chat_id}")
-            else:
-                print(f"❌ Ошибка отправки в чат {chat_id}: {response.status_code}")
-                # Если чат заблокирован или удален, удаляем его из активных
-                if response.status_code in [403, 400]:
-                    self.remove_chat(chat_id)
+            prompt, prompt_tokens, dropped = self.prompt_builder.build_batch(list(datasets.values()))
+            if dropped:
+                print(f"✂️ Пакетный промпт сокращен, убрано: {', '.join(dropped)}")
+            self.router.routed[model] += len(keys)
+            async with self.ai_slots.slot(SCHEDULED):
+                result = await self.ai_client.complete(prompt, max_tokens=ANALYSIS_MAX_TOKENS * len(keys), model=model)
+            self.record_usage(result, prompt_tokens)
+            text = result.get('choices', [{}])[0].get('message', {}).get('content', '')
         except Exception as e:
-            print(f"❌ Ошибка отправки в чат {chat_id}: {e}")
-            logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+            logger.error(f"Ошибка пакетного анализа ({len(keys)} снимков): {e}")
+            return {}
+        analyses = {key: answer for key, answer in zip(keys, parse_batch(text, len(keys))) if answer}
+        if len(analyses) < len(keys):
+            print(f"⚠️ Пакетный анализ: разобрано {len(analyses)} из {len(keys)}, остальные запрашиваются отдельно")
+        if analyses:
+            key, analysis = next(iter(analyses.items()))
+            self.checkpoint.update(
+                analysis={"key": key, "text": analysis, "created_at": time.time()},
+                token_usage=self.last_token_usage
+            )
+        logger.info(
+            f"Пакетный анализ: {len(analyses)}/{len(keys)} снимков, модель {model}",
+            extra={"event": "analysis_batch", "model": model, "size": len(keys), "parsed": len(analyses),
+                   "prompt_tokens": prompt_tokens}
+        )
+        return analyses
 
-    def hourly_analysis_sync(self):
-        """Выполняет анализ (синхронно) для всех активных чатов"""
-        global active_chats
-        if not active_chats:
+    async def scheduled_analysis(self, interval=None):
+        """Выполняет анализ и рассылает его чатам с указанным интервалом (или всем).
+
+        Возвращает итог рассылки (BroadcastResult) или None, если чатов нет.
+        """
+        groups = self.subscribers.groups(interval)
+        total_chats = sum(groups.values())
+        if not total_chats:
             print("📭 Нет активных чатов для отправки анализа")
+            return None
+
+        print(f"🔍 Выполняю анализ для {total_chats} чатов, групп рассылки: {len(groups)}...")
+        texts, charts, ready = await self.render_deliveries(interval, groups, charts=CHARTS_ENABLED)
+        if not texts:
+            return BroadcastResult()
+
+        # Отправляем сообщения группам, где цены заметно изменились, и сводки
+        result = await self.broadcast(texts, interval, charts)
+        # Неотправленное осталось в очереди на повтор; если не ушло ничего, следующий тик отправит заново
+        if result.sent:
+            self.record_deliveries(ready)
+        return result
+
+    def record_deliveries(self, ready):
+        """Запоминает снимки цен, отправленные группам ({ключ группы в DeltaEngine: цены})"""
+        for key, prices in ready.items():
+            self.deltas.delivered(key, prices)
+        self.deltas.flush()
+
+    async def render_deliveries(self, interval, groups, charts=False):
+        """Готовит тексты рассылки по группам {(список монет, порог): число чатов}.
+
+        Снимок рынка запрашивается один раз на все группы. Группа получает
+        анализ, только если цена какой-то монеты с ее прошлого сообщения
+        сдвинулась на порог, иначе тик пропускается без запроса к ИИ и копится
+        в сводку. Анализ запрашивается один раз на каждый различный список:
+        одинаковые данные дают один ключ кэша, а анализы разных списков
+        собираются в пакетные запросы (analyze_batch). Возвращает {ключ группы: текст}
+        только для групп, которым есть что отправить, {ключ группы: ключ графика}
+        для групп с полным анализом, если charts включен, и снимки цен этих групп
+        для record_deliveries после успешной отправки.
+        """
+        now = time.time()
+        decisions = {}
+        chart_keys = {}
+        ready = {}
+
+        async def prepare(watchlist, threshold):
+            # Получаем данные
+            crypto_data = await self.get_crypto_data(watchlist_coins(watchlist))
+            if isinstance(crypto_data, str):
+                # Отправляем ошибку во все чаты группы
+                return f"❌ {crypto_data}"
+
+            key = f"{interval}:{delivery_group(watchlist, threshold)}"
+            prices = {coin: data['usd'] for coin, data in crypto_data.items() if isinstance(data.get('usd'), (int, float))}
+            decision = self.deltas.decide(key, prices, DELTA_THRESHOLD if threshold is None else threshold, now)
+            decisions[(watchlist, threshold)] = decision
+            if decision == SKIP:
+                self.deltas.skip(key, prices)
+                return None
+            ready[key] = prices
+            if decision == DIGEST:
+                return format_digest(crypto_data, self.deltas.skip(key, prices), now)
+            # Снимок для анализа: анализы всех групп запрашиваются вместе
+            return crypto_data
+
+        prepared = await asyncio.gather(*(prepare(watchlist, threshold) for watchlist, threshold in groups))
+        self.deltas.flush()
+        # Анализируем с помощью ProxyAPI
+        analyses = await self.analyze_batch([item for item in prepared if isinstance(item, dict)])
+
+        async def render(group, item):
+            if not isinstance(item, dict):
+                return item
+            text = self.format_message(item, analyses[analysis_cache_key(item)])
+            chart = await self.render_chart(list(item)) if charts else None
+            if chart is not None:
+                chart_keys[delivery_group(*group)] = chart.key
+            return text
+
+        texts = await asyncio.gather(*(render(group, item) for group, item in zip(groups, prepared)))
+        skipped = [group for group, decision in decisions.items() if decision == SKIP]
+        digests = sum(1 for decision in decisions.values() if decision == DIGEST)
+        if skipped or digests:
+            print(
+                f"🔕 Без заметных изменений: групп {len(skipped)} (чатов {sum(groups[group] for group in skipped)}), "
+                f"сводок: {digests}"
+            )
+        logger.info(
+            f"Тик {interval or 'all'}: групп {len(groups)}, пропущено {len(skipped)}, сводок {digests}",
+            extra={"event": "render", "interval": interval, "groups": len(groups), "skipped": len(skipped),
+                   "skipped_chats": sum(groups[group] for group in skipped), "digests": digests,
+                   "charts": len(chart_keys)}
+        )
+        texts = {
+            delivery_group(watchlist, threshold): text
+            for (watchlist, threshold), text in zip(groups, texts) if text is not None
+        }
+        return texts, chart_keys, ready
+
+    async def render_chart(self, coins):
+        """График последних цен монет (chart.Chart) или None, если истории еще нет.
+
+        Рисуется в отдельном потоке, чтобы не задерживать обработку обновлений;
+        одинаковые ряды цен берутся из кэша графиков.
+        """
+        if self.charts is None:
+            from chart import ChartRenderer
+            self.charts = ChartRenderer(maxsize=CHART_CACHE_SIZE, points=CHART_POINTS)
+        series = {coin: self.history.prices(coin, CHART_POINTS) for coin in coins}
+        caption = f"📈 {format_coins(coins)}: последние {max(len(prices) for prices in series.values())} цен"
+        with self.metrics.track("chart"):
+            return await asyncio.to_thread(self.charts.render, series, caption)
+
+    def format_message(self, crypto_data, analysis):
+        """Формирует сообщение с анализом (с замером времени)"""
+        with self.metrics.track("format"):
+            return format_analysis_message(crypto_data, analysis)
+
+    def hourly_analysis_sync(self):
+        """Выполняет анализ для всех активных чатов (синхронно, не из цикла событий — см. run_sync)"""
+        self.run_sync(self.scheduled_analysis())
+
+    async def broadcast(self, texts, interval=None, charts=None):
+        """Рассылает чатам тексты их групп ({ключ группы: текст}) через очередь доставки.
+
+        charts — ключи графиков групп ({ключ группы: ключ графика}), отправляемых перед текстом.
+        """
+        # Получатели сначала записываются в очередь: после сбоя рассылка
+        # продолжится с того же места, а временные ошибки будут повторены
+        tick_id = f"{interval or 'all'}:{time.time_ns()}"
+        members = (
+            (chat_id, delivery_group(watchlist, threshold))
+            for chat_id, watchlist, threshold in self.subscribers.iter_subscriptions(interval=interval)
+        )
+        self.outbox.enqueue_groups(tick_id, members, texts, charts)
+        result = await self.deliver_outbox_tick(tick_id)
+        print(
+            f"📤 Рассылка завершена: {result.sent}/{result.total} за {result.elapsed:.2f} с "
+            f"({result.throughput:.1f} сообщ/с, ошибок: {result.failed}, повторов: {result.retried})"
+        )
+        if result.photos:
+            print(f"📈 Графиков отправлено: {result.photos}, загружено в Telegram: {result.uploads}")
+        # Одна запись на тик вместо записи на каждый чат
+        logger.info(
+            f"Рассылка {tick_id}: {result.sent}/{result.total} за {result.elapsed:.2f} с",
+            extra={"event": "broadcast", "tick_id": tick_id, "total": result.total, "sent": result.sent,
+                   "failed": result.failed, "retried": result.retried, "dead": len(result.dead_chats),
+                   "photos": result.photos, "uploads": result.uploads, "elapsed": round(result.elapsed, 3)}
+        )
+        return result
+
+    async def deliver_outbox_tick(self, tick_id):
+        """Отправляет готовые сообщения тика из очереди; недоступные чаты отписываются одной транзакцией в конце"""
+        self.outbox_busy.add(tick_id)
+        on_result, flush = self.outbox.recorder(tick_id)
+        try:
+            result = await self.broadcaster.deliver(self.outbox.iter_due(tick_id, chart_store=self.charts), on_result)
+        finally:
+            flush()
+            self.outbox_busy.discard(tick_id)
+        self.remove_chats(result.dead_chats)
+        return result
+
+    async def retry_outbox(self):
+        """Досылает отложенные сообщения и сообщения, не доставленные до перезапуска.
+
+        В кластере очередь общая, поэтому ее досылает только лидер.
+        """
+        if self.cluster is not None and not self.cluster.is_leader:
             return
+        for tick_id in self.outbox.due_ticks():
+            if tick_id in self.outbox_busy:
+                continue
+            result = await self.deliver_outbox_tick(tick_id)
+            print(f"🔁 Повторная доставка {tick_id}: {result.sent}/{result.total}")
+        self.outbox.prune(OUTBOX_RETENTION)
+        self.deltas.prune(DELTA_STATE_RETENTION)
 
-        print(f"🔍 Выполняю анализ для {len(active_chats)} чатов...")
+    async def deliver_alerts(self, triggered):
+        """Отправляет сообщения о сработавших алертах"""
+        messages = [
+            (alert.chat_id,
+             f"🔔 {alert.coin.upper()} {'поднялся выше' if alert.direction == ABOVE else 'опустился ниже'} "
+             f"${alert.threshold:,.2f}: сейчас ${price:,.2f}")
+            for alert, price in triggered
+        ]
+        # Алерты одноразовые, поэтому тоже идут через очередь: временная ошибка не теряет их
+        tick_id = f"alerts:{time.time_ns()}"
+        self.outbox.enqueue_messages(tick_id, messages)
+        result = await self.deliver_outbox_tick(tick_id)
+        print(f"🔔 Отправлено алертов: {result.sent}/{result.total}")
 
-        # Получаем данные
-        crypto_data = self.get_crypto_data()
-        if isinstance(crypto_data, str):
-            # Отправляем ошибку во все чаты
-            for chat_id in active_chats.keys():
-                self.send_message_sync(chat_id, f"❌ {crypto_data}")
+    async def sample_history(self):
+        """Добавляет в историю отсчет цен (раз в PRICE_HISTORY_INTERVAL) и сохраняет ее вне цикла событий"""
+        snapshot = await self.get_market_snapshot()
+        # Устаревший снимок (источник недоступен) отсчетом не становится
+        if isinstance(snapshot, str) or self.market_cache.get(tuple(self.market_ids)) is None:
+            print("⚠️ Отсчет истории цен пропущен: нет свежих данных")
             return
+        self.history.update(snapshot)
+        await asyncio.to_thread(self.history.write, self.history.snapshot())
 
-        # Анализируем с помощью ProxyAPI
-        analysis = self.analyze_with_proxyapi(crypto_data)
-
-        # Формируем сообщение
-        message = "📊 Анализ криптовалют\n\n"
-        for coin, data in crypto_data.items():
-            price = data.get('usd', 'N/A')
-            change_24h = data.get('usd_24h_change', 'N/A')
-            message += f"💰 {coin.upper()}: ${price:,.2f} ({change_24h:+.2f}%)\n"
-
-        message += f"\n🤖 Анализ ИИ:\n{analysis}"
-
-        # Отправляем сообщение во все активные чаты
-        for chat_id in active_chats.keys():
-            self.send_message_sync(chat_id, message)
-
-    def scheduler_thread(self):
-        """Поток планировщика"""
-        global scheduler_running, active_chats
-        while scheduler_running:
-            time.sleep(ANALYSIS_INTERVAL_SECONDS)
-            if scheduler_running and active_chats:
-                print("⏰ Выполняю плановый анализ...")
-                self.hourly_analysis_sync()
+    async def check_alerts(self):
+        """Обновляет цены, если есть алерты (проверка идет при каждом свежем снимке)"""
+        if len(self.alerts):
+            await self.get_market_snapshot()
+
+    async def run_due_jobs(self, deadline, keys):
+        """Обрабатывает задачи расписания, у которых наступил дедлайн.
+
+        Группы рассылки с общим дедлайном запускаются вместе: данные и анализ
+        берутся из общего кэша, поэтому запрос к API и ИИ выполняется один раз.
+        """
+        jobs = []
+        intervals = [interval for kind, interval in keys if kind == "analysis"]
+        if intervals:
+            print(f"⏰ Выполняю плановый анализ для интервалов: {', '.join(format_interval(i) for i in intervals)}")
+            # Списки могли измениться в другом процессе или после отписки чатов
+            self.refresh_market_ids()
+            if self.cluster is not None:
+                jobs.extend(self.cluster_analysis(interval, deadline) for interval in intervals)
+            else:
+                jobs.extend(self.scheduled_analysis(interval) for interval in intervals)
+        if ("alerts", ALERTS_CHECK_INTERVAL) in keys:
+            jobs.append(self.check_alerts())
+        if ("outbox", OUTBOX_RETRY_INTERVAL) in keys:
+            jobs.append(self.retry_outbox())
+        if ("history", PRICE_HISTORY_INTERVAL) in keys:
+            jobs.append(self.sample_history())
+        if ("checkpoint", CHECKPOINT_INTERVAL) in keys:
+            jobs.append(self.save_checkpoint())
+        await asyncio.gather(*jobs)
+        if intervals:
+            # Выполненные дедлайны сохраняются сразу, чтобы после перезапуска
+            # догнать пропущенные, но не повторить уже отправленные
+            done = dict(self.checkpoint.get("jobs") or {})
+            done.update({str(interval): deadline for interval in intervals})
+            self.checkpoint.update(jobs=done)
+            await self.save_checkpoint()
+
+    async def save_checkpoint(self):
+        """Записывает измененное состояние бота на диск вне цикла событий"""
+        await asyncio.to_thread(self.checkpoint.write, self.checkpoint.snapshot())
 
     def start_scheduler(self):
-        """Запускает планировщик в отдельном потоке"""
-        global scheduler_running
-        if not scheduler_running:
-            scheduler_running = True
-            scheduler_thread = threading.Thread(target=self.scheduler_thread, daemon=True)
-            scheduler_thread.start()
-            interval_text = format_interval(ANALYSIS_INTERVAL_SECONDS)
-            print(f"⏰ Планировщик запущен ({interval_text})")
+        """Запускает планировщик в цикле событий бота"""
+        if self.scheduler is None or not self.scheduler.running:
+            self.scheduler = JobScheduler(self.run_due_jobs)
+            # Одна задача на каждый интервал: чаты с одинаковым интервалом
+            # получают рассылку по одному дедлайну
+            for interval in INTERVAL_OPTIONS.values():
+                self.scheduler.schedule(("analysis", interval), interval)
+            self.scheduler.schedule(("checkpoint", CHECKPOINT_INTERVAL), CHECKPOINT_INTERVAL)
+            if not self.worker:
+                self.scheduler.schedule(("alerts", ALERTS_CHECK_INTERVAL), ALERTS_CHECK_INTERVAL)
+                self.scheduler.schedule(("history", PRICE_HISTORY_INTERVAL), PRICE_HISTORY_INTERVAL)
+            if not self.worker or self.cluster is not None:
+                # Воркеры кластера передают в очередь временные ошибки своих шардов
+                self.scheduler.schedule(("outbox", OUTBOX_RETRY_INTERVAL), OUTBOX_RETRY_INTERVAL)
+            self.scheduler_task = asyncio.create_task(self.scheduler.run())
+            print("⏰ Планировщик запущен")
 
     def stop_scheduler(self):
         """Останавливает планировщик"""
-        global scheduler_running
-        scheduler_running = False
+        if self.scheduler is not None:
+            self.scheduler.stop()
         print("⏰ Планировщик остановлен")
 
+    async def cluster_analysis(self, interval, deadline):
+        """Плановый тик в режиме кластера: лидер публикует сообщение, все воркеры доставляют свои шарды"""
+        if not self.subscribers.count(interval):
+            return
+        # Тик называется по дедлайну: у всех воркеров расписание выровнено по одной сетке
+        tick_id = f"{interval}:{int(deadline)}"
+        # Если лидер умер перед тиком, аренду после ее истечения захватит другой воркер
+        # и опубликует тик сам; ждать дольше двух сроков аренды нет смысла
+        give_up_at = time.monotonic() + CLUSTER_LEASE_SECONDS * 2
+        while (not await asyncio.to_thread(self.cluster.has_tick, tick_id)
+               and time.monotonic() < give_up_at):
+            if await self.cluster_heartbeat():
+                # Если всем группам нечего отправить, тик публикуется пустым: воркеры не ждут его
+                # Графики в кластере не рассылаются: картинки есть только в памяти лидера
+                texts, _, ready = await self.render_deliveries(interval, self.subscribers.groups(interval))
+                if await asyncio.to_thread(self.cluster.publish, tick_id, interval, "", texts):
+                    # Опубликованный тик доставят воркеры, временные ошибки — очередь доставки
+                    self.record_deliveries(ready)
+                    print(f"📣 Опубликован тик {tick_id}")
+                break
+            await asyncio.sleep(CLUSTER_LEASE_SECONDS / 3)
+        self.cluster_wakeup.set()
+
+    def save_shard_progress(self, task, sent, retries):
+        """Записывает прогресс шарда: временные ошибки уходят в очередь доставки, затем чаты отмечаются.
+
+        retries — тройки (chat_id, text, ошибка). Строки очереди записываются раньше
+        отметки в cluster_delivered: при падении между ними сообщение может уйти
+        повторно, но не потеряется.
+        """
+        if retries:
+            retry_tick = f"{task.tick_id}:{task.shard}"
+            self.outbox.enqueue_messages(retry_tick, ((chat_id, text) for chat_id, text, _ in retries))
+            self.outbox.record(retry_tick, [(chat_id, RETRY, error) for chat_id, _, error in retries])
+        self.cluster.mark_delivered(task.tick_id, task.shard, sent + [chat_id for chat_id, _, _ in retries])
+
+    async def deliver_shard(self, task):
+        """Доставляет сообщение тика чатам одного шарда, пропуская уже получивших его.
+
+        Сообщения с временной ошибкой (429, 5xx, сеть) передаются в очередь
+        доставки и досылаются повторной доставкой лидера. Запросы к базе
+        кластера выполняются в потоке, чтобы не держать цикл событий.
+
+        Каждый исход записывается сразу после отправки: пока идет одна запись,
+        новые исходы копятся и уходят следующей транзакцией (group commit).
+        Если воркер умер между ответом Telegram и записью, подхвативший шард
+        отправит эти сообщения повторно: sendMessage не принимает ключ
+        идемпотентности, поэтому отправку и запись нельзя сделать атомарными.
+        Повторов не больше, чем отправок воркера в полете плюс одна
+        незаписанная транзакция; запись до отправки превратила бы их в потери.
+        """
+        delivered = await asyncio.to_thread(self.cluster.delivered_chats, task.tick_id, task.shard)
+        # Тексты сообщений, которые сейчас отправляются: нужны, чтобы передать их в очередь при ошибке
+        in_flight = {}
+        sent, retries = [], []
+        writer = None
+
+        def messages():
+            for chat_id, watchlist, threshold in self.subscribers.iter_subscriptions(
+                    interval=task.interval, shard=(task.shard, self.cluster.shards)):
+                # При остановке новые отправки не начинаются, начатые доходят до конца
+                if self.cluster_stopping:
+                    return
+                if chat_id in delivered:
+                    continue
+                text = task.texts.get(delivery_group(watchlist, threshold)) if task.texts else task.text
+                # Тик группы пропущен или чат сменил группу после публикации тика
+                if text:
+                    in_flight[chat_id] = text
+                    yield chat_id, text
+
+        async def write_progress():
+            while sent or retries:
+                batch = (list(sent), list(retries))
+                sent.clear()
+                retries.clear()
+                try:
+                    await asyncio.to_thread(self.save_shard_progress, task, *batch)
+                except sqlite3.Error as e:
+                    # Незаписанные чаты получат сообщение повторно, если шард подхватит другой воркер
+                    logger.error(f"Ошибка записи прогресса шарда {task.shard} тика {task.tick_id}: {e}")
+
+        async def flush():
+            if writer is not None:
+                await writer
+            await write_progress()
+
+        def on_result(chat_id, outcome, error):
+            nonlocal writer
+            text = in_flight.pop(chat_id, None)
+            if outcome == SENT:
+                sent.append(chat_id)
+            elif outcome == RETRY and text is not None:
+                retries.append((chat_id, text, error))
+            else:
+                return
+            if writer is None or writer.done():
+                writer = asyncio.ensure_future(write_progress())
+
+        try:
+            result = await self.broadcaster.deliver(messages(), on_result)
+        except BaseException:
+            # Прогресс записывается до возврата шарда, иначе его подхватят без пропуска отправленных
+            await flush()
+            await asyncio.to_thread(self.cluster.release_shard, task.tick_id, task.shard)
+            raise
+        await flush()
+
+        if self.cluster_stopping:
+            # Остаток шарда доставит другой воркер
+            await asyncio.to_thread(self.cluster.release_shard, task.tick_id, task.shard)
+        else:
+            await asyncio.to_thread(self.cluster.finish_shard, task.tick_id, task.shard)
+        print(f"📤 Шард {task.shard} тика {task.tick_id}: {result.sent}/{result.total} за {result.elapsed:.2f} с")
+        logger.info(
+            f"Шард {task.shard} тика {task.tick_id}: {result.sent}/{result.total} за {result.elapsed:.2f} с",
+            extra={"event": "shard", "tick_id": task.tick_id, "shard": task.shard, "total": result.total,
+                   "sent": result.sent, "failed": result.failed, "retried": result.retried,
+                   "dead": len(result.dead_chats), "elapsed": round(result.elapsed, 3)}
+        )
+        self.remove_chats(result.dead_chats)
+
+    async def deliver_cluster_ticks(self):
+        """Забирает и доставляет шарды, пока они есть"""
+        while not self.cluster_stopping:
+            task = await asyncio.to_thread(self.cluster.claim_shard)
+            if task is None:
+                return
+            await self.deliver_shard(task)
+
+    async def cluster_heartbeat(self):
+        """Heartbeat воркера; True, если он лидер.
+
+        Ставший лидером воркер перечитывает состояние групп рассылки: пока
+        лидером был другой процесс, его записывал тот.
+        """
+        was_leader = self.cluster.is_leader
+        is_leader = await asyncio.to_thread(self.cluster.heartbeat)
+        if is_leader and not was_leader:
+            await asyncio.to_thread(self.deltas.reload)
+        return is_leader
+
+    async def cluster_heartbeat_loop(self):
+        """Поддерживает heartbeat воркера и аренду лидера"""
+        while True:
+            try:
+                await self.cluster_heartbeat()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка heartbeat кластера: {e}")
+            await asyncio.sleep(CLUSTER_LEASE_SECONDS / 3)
+
+    async def cluster_delivery_loop(self):
+        """Проверяет неразобранные шарды (в том числе брошенные умершими воркерами)"""
+        last_prune = 0.0
+        while not self.cluster_stopping:
+            try:
+                await self.deliver_cluster_ticks()
+                if self.cluster.is_leader and time.monotonic() - last_prune > 3600:
+                    await asyncio.to_thread(self.cluster.prune, CLUSTER_TICK_RETENTION)
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка доставки шардов: {e}")
+            try:
+                await asyncio.wait_for(self.cluster_wakeup.wait(), CLUSTER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.cluster_wakeup.clear()
+
+    async def start_cluster(self):
+        """Регистрирует воркер в кластере и запускает фоновые задачи"""
+        self.cluster_stopping = False
+        await self.cluster_heartbeat()
+        self.cluster_tasks = [
+            asyncio.create_task(self.cluster_heartbeat_loop()),
+            asyncio.create_task(self.cluster_delivery_loop()),
+        ]
+        print(f"🧩 Воркер {self.cluster.worker_id} в кластере, шардов: {self.cluster.shards}")
+
+    async def stop_cluster(self):
+        """Дожидается начатых отправок, возвращает шард и выходит из кластера"""
+        self.cluster_stopping = True
+        self.cluster_wakeup.set()
+        heartbeat_task, delivery_task = self.cluster_tasks or (None, None)
+        if delivery_task is not None:
+            await delivery_task
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        await asyncio.to_thread(self.cluster.leave)
+        print(f"🧩 Воркер {self.cluster.worker_id} вышел из кластера")
+
     async def send_message(self, chat_id, text):
-        """Отправляет сообщение в Telegram"""
+        """Отправляет сообщение в Telegram; возвращает отправленное сообщение или None"""
         try:
-            await self.bot.send_message(chat_id=chat_id, text=text)
+            with self.metrics.track("send"):
+                message = await self.bot.send_message(chat_id=chat_id, text=text)
             print(f"📤 Сообщение отправлено в чат {chat_id}")
+            return message
         except Exception as e:
             print(f"❌ Ошибка отправки в чат {chat_id}: {e}")
             logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+            return None
 
     async def hourly_analysis(self, chat_id):
         """Выполняет анализ для конкретного чата"""
         print("Выполняю анализ...")
+        started = time.perf_counter()
 
-        # Получаем данные
-        crypto_data = self.get_crypto_data()
+        # Получаем данные по списку монет чата
+        crypto_data = await self.get_crypto_data(self.chat_coins(chat_id))
         if isinstance(crypto_data, str):
             await self.send_message(chat_id, f"❌ {crypto_data}")
             return
 
-        # Анализируем с помощью ProxyAPI
-        analysis = self.analyze_with_proxyapi(crypto_data)
+        key = analysis_cache_key(crypto_data)
+        if not STREAM_ANALYSIS or self.analysis_cache.get(key) is not None:
+            # Анализируем с помощью ProxyAPI
+            try:
+                analysis = await self.analyze_with_proxyapi(crypto_data)
+            except Overloaded:
+                await self.send_message(chat_id, self.overloaded_message(crypto_data))
+                return
 
-        # Формируем сообщение
-        message = "📊 Анализ криптовалют\n\n"
-        for coin, data in crypto_data.items():
-            price = data.get('usd', 'N/A')
-            change_24h = data.get('usd_24h_change', 'N/A')
-            message += f"💰 {coin.upper()}: ${price:,.2f} ({change_24h:+.2f}%)\n"
+            # Отправляем сообщение
+            await self.send_message(chat_id, self.format_message(crypto_data, analysis))
+            self.metrics.record("first_content", time.perf_counter() - started)
+            return
+
+        progress = None
+        partial_text = None
 
-        message += f"\n🤖 Анализ ИИ:\n{analysis}"
+        def on_partial(partial):
+            nonlocal partial_text
+            partial_text = format_analysis_message(crypto_data, f"{partial} ▌")
+            if progress is not None:
+                progress.update(partial_text)
 
-        # Отправляем сообщение
-        await self.send_message(chat_id, message)
+        analysis_task = asyncio.create_task(self.analyze_with_proxyapi(crypto_data, on_partial=on_partial))
+        done, _ = await asyncio.wait({analysis_task}, timeout=STREAM_PLACEHOLDER_DELAY)
+        if analysis_task in done:
+            # ИИ ответил быстро (или очередь к ИИ заполнена): правки не нужны
+            try:
+                text = self.format_message(crypto_data, analysis_task.result())
+            except Overloaded:
+                text = self.overloaded_message(crypto_data)
+            await self.send_message(chat_id, text)
+            self.metrics.record("first_content", time.perf_counter() - started)
+            return
+
+        # Цены уходят сразу, анализ дописывается в то же сообщение по мере генерации
+        text = partial_text or self.format_message(crypto_data, ANALYSIS_PLACEHOLDER)
+        message = await self.send_message(chat_id, text)
+        self.metrics.record("first_content", time.perf_counter() - started)
+        if message is None:
+            await asyncio.gather(analysis_task, return_exceptions=True)
+            return
+        progress = ProgressiveMessage(
+            self.bot, chat_id, message.message_id, text,
+            interval=max(STREAM_EDIT_INTERVAL, PRIVATE_CHAT_INTERVAL if chat_id > 0 else GROUP_CHAT_INTERVAL),
+            bucket=self.edit_bucket
+        )
+        if partial_text and partial_text != text:
+            progress.update(partial_text)
+        try:
+            text = self.format_message(crypto_data, await analysis_task)
+        except Overloaded:
+            text = self.overloaded_message(crypto_data)
+        await progress.finish(text)
+
+    def overloaded_message(self, crypto_data):
+        """Быстрый ответ, когда очередь к ИИ заполнена: цены и анализ из кэша без ожидания ИИ"""
+        print("⏳ Очередь к ИИ заполнена, отвечаю анализом из кэша")
+        notice = "⏳ ИИ сейчас перегружен запросами, новый анализ не запрошен."
+        cached = self.analysis_cache.get_stale(analysis_cache_key(crypto_data))
+        if cached is not None:
+            return self.format_message(crypto_data, f"{cached}\n\n{notice}")
+        if self.last_analysis is not None:
+            text, created_at = self.last_analysis
+            return self.format_message(
+                crypto_data,
+                f"{text}\n(анализ от {datetime.fromtimestamp(created_at).strftime('%d.%m %H:%M')})\n\n{notice}"
+            )
+        return self.format_message(crypto_data, f"{notice} Попробуйте через минуту.")
 
     async def start_command(self, update: Update, context):
         """Обработчик команды /start"""
@@ -264,20 +1416,26 @@ class TradingBot:
         username = update.effective_user.username
 
         self.add_chat(chat_id, username)
-        interval_text = format_interval(ANALYSIS_INTERVAL_SECONDS)
+        interval_text = format_interval(self.subscribers.get_interval(chat_id) or ANALYSIS_INTERVAL_SECONDS)
         welcome_message = f"""
 🤖 Добро пожаловать в Trading Bot!
 
 Я анализирую криптовалюты и отправляю результаты {interval_text}.
 
-📊 Сейчас анализирую: Bitcoin, Ethereum, Cardano
-🤖 Анализ: через ProxyAPI ({AI_MODEL})
+📊 Сейчас анализирую: {format_coins(self.chat_coins(chat_id))}
+🤖 Анализ: через ProxyAPI ({AI_MODEL}{f", на спокойном рынке {AI_QUIET_MODEL}" if AI_QUIET_MODEL else ""})
 ⏰ Отправка: {interval_text}
 
 Команды:
 /start - показать это сообщение
 /status - текущий статус бота
 /analyze - выполнить анализ сейчас
+/interval - выбрать интервал рассылки (5m, 15m, 1h, 1d)
+/watch - мои монеты и добавление монет в список
+/unwatch - убрать монеты из списка
+/threshold - порог изменения цены для рассылки
+/chart - график цен ваших монет
+/alert - сообщить, когда цена пересечет уровень
 /stop - остановить получение уведомлений
 
 Отправьте любое сообщение, чтобы начать получать уведомления!
@@ -287,36 +1445,330 @@ class TradingBot:
 
     async def status_command(self, update: Update, context):
         """Обработчик команды /status"""
-        global active_chats, scheduler_running
         chat_id = update.effective_chat.id
 
-        if str(chat_id) not in active_chats:
+        if chat_id not in self.subscribers:
             await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
         else:
+            scheduler_running = self.scheduler is not None and self.scheduler.running
             status = "✅ Запущен" if scheduler_running else "❌ Остановлен"
-            total_chats = len(active_chats)
+            total_chats = self.subscribers.count()
+            interval = self.subscribers.get_interval(chat_id) or ANALYSIS_INTERVAL_SECONDS
+            next_run = datetime.fromtimestamp(next_deadline(interval)).strftime('%d.%m %H:%M')
+            threshold = self.subscribers.get_threshold(chat_id)
+            outbox = self.outbox.stats()
+            cluster_line = ""
+            if self.cluster is not None:
+                cluster_line = (
+                    f"Кластер: лидер {self.cluster.leader() or 'не выбран'}, "
+                    f"воркеров {len(self.cluster.live_workers())}, шардов {self.cluster.shards}\n"
+                )
+            services = [source.policy.status() for source in self.prices.sources]
+            services += [self.ai_client.policy.status(), self.broadcaster.policy.status()]
+            # При нескольких источниках цен видно, какой сейчас быстрее и надежнее
+            sources = "\n\nИсточники цен:\n" + "\n".join(self.prices.status()) if len(self.prices.sources) > 1 else ""
             await update.message.reply_text(
                 f"✅ Бот активен\n"
                 f"Ваш Chat ID: {chat_id}\n"
                 f"Всего активных чатов: {total_chats}\n"
-                f"Планировщик: {status}"
+                f"Планировщик: {status}\n"
+                f"Интервал: {format_interval(interval)}, следующий анализ: {next_run}\n"
+                f"Порог изменения цены: {format_threshold(DELTA_THRESHOLD if threshold is None else threshold)}\n"
+                f"{cluster_line}"
+                f"Очередь доставки: ожидают {outbox.get('pending', 0)}, на повторе {outbox['retrying']}, "
+                f"не доставлено {outbox.get('failed', 0)}, устарело {outbox.get('expired', 0)}\n"
+                f"\nВнешние сервисы:\n" + "\n".join(services) + sources
             )
 
     async def analyze_command(self, update: Update, context):
         """Обработчик команды /analyze"""
         chat_id = update.effective_chat.id
-        if str(chat_id) not in active_chats:
+        if chat_id not in self.subscribers:
             await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
             return
 
+        retry_after = self.analyze_limiter.check(chat_id)
+        if retry_after is not None:
+            # Сверх лимита — без запросов к API: последний анализ из кэша, один раз за ограничение
+            if self.analyze_limiter.notify(chat_id):
+                cached = self.cached_analysis(chat_id)
+                notice = f"⏳ Слишком частые запросы: новый анализ через {retry_after:.0f} с."
+                await update.message.reply_text(f"{notice} Последний анализ:\n\n{cached}" if cached else notice)
+            return
+
         await update.message.reply_text("🔍 Выполняю анализ...")
         await self.hourly_analysis(chat_id)
 
+    def cached_analysis(self, chat_id):
+        """Последний анализ списка монет чата из кэша (даже устаревший) или None; к API не обращается"""
+        snapshot = self.market_cache.get_stale(tuple(self.market_ids))
+        if snapshot is None:
+            return None
+        data = {coin: snapshot[coin] for coin in self.chat_coins(chat_id) if coin in snapshot}
+        analysis = self.analysis_cache.get_stale(analysis_cache_key(data)) if data else None
+        if analysis is None:
+            return None
+        return self.format_message(data, analysis)
+
+    async def interval_command(self, update: Update, context):
+        """Обработчик команды /interval"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        options = ", ".join(INTERVAL_OPTIONS)
+        if not context.args or context.args[0].lower() not in INTERVAL_OPTIONS:
+            current = self.subscribers.get_interval(chat_id) or ANALYSIS_INTERVAL_SECONDS
+            await update.message.reply_text(
+                f"⏰ Сейчас анализ приходит {format_interval(current)}\n"
+                f"Чтобы изменить, отправьте /interval и один из вариантов: {options}"
+            )
+            return
+
+        interval = INTERVAL_OPTIONS[context.args[0].lower()]
+        self.subscribers.set_interval(chat_id, interval)
+        await update.message.reply_text(f"✅ Анализ будет отправляться {format_interval(interval)}")
+        print(f"⏰ Чат {chat_id} выбрал интервал {format_interval(interval)}")
+
+    async def find_unknown_coins(self, coins):
+        """Монеты, которых нет в CoinGecko: новые id проверяются одним запросом цен"""
+        unchecked = [coin for coin in coins if coin not in self.market_ids]
+        if not unchecked:
+            return []
+        data = await self.market_client.get_prices(unchecked)
+        return [coin for coin in unchecked if coin not in data]
+
+    async def watch_command(self, update: Update, context):
+        """Обработчик команды /watch"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        coins = self.chat_coins(chat_id)
+        requested = list(dict.fromkeys(arg.lower().strip(',') for arg in context.args or []))
+        if not requested:
+            await update.message.reply_text(
+                f"⭐ Ваши монеты: {format_coins(coins)}\n"
+                f"Добавить: /watch <id монеты в CoinGecko>, например /watch solana dogecoin\n"
+                f"Убрать: /unwatch <id монеты>\n"
+                f"В списке может быть до {MAX_WATCHLIST_SIZE} монет"
+            )
+            return
+
+        invalid = [coin for coin in requested if not COIN_ID_PATTERN.match(coin)]
+        if invalid:
+            await update.message.reply_text(f"❌ Некорректный id монеты: {', '.join(invalid)}")
+            return
+        added = [coin for coin in requested if coin not in coins]
+        if not added:
+            await update.message.reply_text(f"✅ Эти монеты уже в списке: {format_coins(coins)}")
+            return
+        if len(coins) + len(added) > MAX_WATCHLIST_SIZE:
+            await update.message.reply_text(f"❌ В списке может быть не больше {MAX_WATCHLIST_SIZE} монет")
+            return
+        try:
+            unknown = await self.find_unknown_coins(added)
+        except Exception as e:
+            logger.error(f"Ошибка проверки монет {added}: {e}")
+            await update.message.reply_text(f"❌ Не удалось проверить монеты: {e}")
+            return
+        if unknown:
+            await update.message.reply_text(f"❌ CoinGecko не знает монеты: {', '.join(unknown)}")
+            return
+
+        coins = coins + added
+        self.subscribers.set_watchlist(chat_id, watchlist_signature(coins))
+        self.refresh_market_ids()
+        await update.message.reply_text(f"✅ Добавлено: {format_coins(added)}\n⭐ Ваши монеты: {format_coins(coins)}")
+        print(f"⭐ Чат {chat_id} добавил в список: {', '.join(added)}")
+
+    async def unwatch_command(self, update: Update, context):
+        """Обработчик команды /unwatch"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        coins = self.chat_coins(chat_id)
+        requested = {arg.lower().strip(',') for arg in context.args or []}
+        if not requested:
+            await update.message.reply_text(
+                f"⭐ Ваши монеты: {format_coins(coins)}\n"
+                f"Чтобы убрать монету, отправьте /unwatch <id монеты>"
+            )
+            return
+
+        remaining = [coin for coin in coins if coin not in requested]
+        if len(remaining) == len(coins):
+            await update.message.reply_text(f"❌ Этих монет нет в списке: {format_coins(coins)}")
+            return
+        if not remaining:
+            await update.message.reply_text("❌ В списке должна остаться хотя бы одна монета")
+            return
+
+        self.subscribers.set_watchlist(chat_id, watchlist_signature(remaining))
+        self.refresh_market_ids()
+        await update.message.reply_text(f"✅ Ваши монеты: {format_coins(remaining)}")
+        print(f"⭐ Чат {chat_id} убрал из списка: {', '.join(sorted(requested & set(coins)))}")
+
+    async def threshold_command(self, update: Update, context):
+        """Обработчик команды /threshold"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        args = [arg.lower() for arg in context.args or []]
+        if not args:
+            threshold = self.subscribers.get_threshold(chat_id)
+            await update.message.reply_text(
+                f"🔕 Порог изменения цены: {format_threshold(DELTA_THRESHOLD if threshold is None else threshold)}\n"
+                f"Плановый анализ приходит, только если цена какой-то из ваших монет с прошлого "
+                f"сообщения изменилась на порог, иначе раз в {format_duration(DIGEST_INTERVAL)} приходит сводка.\n"
+                f"Изменить: /threshold <процент>, например /threshold 2\n"
+                f"/threshold 0 - получать каждый анализ, /threshold default - порог по умолчанию ({DELTA_THRESHOLD:g}%)"
+            )
+            return
+
+        if args[0] == "default":
+            threshold = None
+        else:
+            try:
+                threshold = float(args[0].replace(',', '.').rstrip('%'))
+            except ValueError:
+                threshold = -1
+            if not 0 <= threshold <= 100:
+                await update.message.reply_text("❌ Порог — число процентов от 0 до 100, например /threshold 2")
+                return
+        self.subscribers.set_threshold(chat_id, threshold)
+        await update.message.reply_text(
+            f"✅ Порог изменения цены: {format_threshold(DELTA_THRESHOLD if threshold is None else threshold)}"
+        )
+        print(f"🔕 Чат {chat_id} выбрал порог {threshold}")
+
+    async def chart_command(self, update: Update, context):
+        """Обработчик команды /chart"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        chart = await self.render_chart(self.chat_coins(chat_id))
+        if chart is None:
+            await update.message.reply_text("📈 История цен пока слишком короткая для графика, попробуйте позже")
+            return
+        if chart.file_id is None:
+            async with chart.lock:
+                # Пока ждали, этот же график мог загрузить другой чат
+                if chart.file_id is None:
+                    message = await update.message.reply_photo(chart.png, caption=chart.caption)
+                    chart.file_id = message.photo[-1].file_id
+                    return
+        # График уже в Telegram: отправляется по file_id без повторной загрузки
+        await update.message.reply_photo(chart.file_id, caption=chart.caption)
+
+    async def alert_command(self, update: Update, context):
+        """Обработчик команды /alert"""
+        chat_id = update.effective_chat.id
+        if chat_id not in self.subscribers:
+            await update.message.reply_text("❌ Бот не активирован. Отправьте /start")
+            return
+
+        args = [arg.lower() for arg in context.args or []]
+        coins = self.chat_coins(chat_id)
+        usage = (
+            "🔔 Алерты по цене:\n"
+            "/alert <монета> <цена> - сообщить, когда цена пересечет уровень\n"
+            "/alert list - мои алерты\n"
+            "/alert del <номер> - удалить алерт\n"
+            f"Монеты: {', '.join(coins)}"
+        )
+
+        if args[:1] == ["list"]:
+            alerts = self.alerts.for_chat(chat_id)
+            if not alerts:
+                await update.message.reply_text("🔕 У вас нет алертов")
+                return
+            lines = [
+                f"#{alert.alert_id} {alert.coin.upper()} {'≥' if alert.direction == ABOVE else '≤'} ${alert.threshold:,.2f}"
+                for alert in alerts
+            ]
+            await update.message.reply_text("🔔 Ваши алерты:\n" + "\n".join(lines))
+            return
+
+        if args[:1] == ["del"] and len(args) == 2 and args[1].lstrip('#').isdigit():
+            if self.alerts.remove(chat_id, int(args[1].lstrip('#'))):
+                await update.message.reply_text("✅ Алерт удален")
+            else:
+                await update.message.reply_text("❌ Алерт не найден")
+            return
+
+        if len(args) != 2 or args[0] not in coins:
+            await update.message.reply_text(usage)
+            return
+        try:
+            threshold = float(args[1].replace(',', '.').lstrip('$'))
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+        if not valid_price(threshold):
+            await update.message.reply_text("❌ Порог должен быть положительной ценой")
+            return
+
+        crypto_data = await self.get_crypto_data(coins)
+        if isinstance(crypto_data, str):
+            await update.message.reply_text(f"❌ {crypto_data}")
+            return
+        current_price = crypto_data.get(args[0], {}).get('usd')
+        if current_price is None:
+            await update.message.reply_text("❌ Нет текущей цены для этой монеты")
+            return
+
+        try:
+            alert = self.alerts.add(chat_id, args[0], threshold, current_price)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        await update.message.reply_text(
+            f"✅ Алерт #{alert.alert_id}: сообщу, когда {alert.coin.upper()} "
+            f"{'поднимется выше' if alert.direction == ABOVE else 'опустится ниже'} ${threshold:,.2f} "
+            f"(сейчас ${current_price:,.2f})"
+        )
+
+    async def metrics_command(self, update: Update, context):
+        """Обработчик команды /metrics (только для ADMIN_CHAT_IDS)"""
+        chat_id = update.effective_chat.id
+        if chat_id not in ADMIN_CHAT_IDS:
+            await update.message.reply_text("❌ Команда доступна только администраторам")
+            return
+
+        caches = [("данные", self.market_cache), ("анализ", self.analysis_cache)]
+        if self.charts is not None:
+            caches.append(("графики", self.charts.cache))
+        cache_lines = [
+            f"{name}: попаданий {cache.hits}, промахов {cache.misses}, схлопнуто {cache.coalesced}"
+            for name, cache in caches
+        ]
+        models = ", ".join(f"{model}: {count}" for model, count in self.router.routed.most_common()) or "запросов не было"
+        endpoint = (
+            f"http://{self.metrics_server.host}:{self.metrics_server.port}/metrics"
+            if self.metrics_server is not None and self.metrics_server.server is not None else "отключен"
+        )
+        await update.message.reply_text(
+            "📈 Метрики по этапам:\n" + "\n".join(self.metrics.summary()) +
+            "\n\nКэш:\n" + "\n".join(cache_lines) +
+            f"\n\nАнализов по моделям: {models}" +
+            f"\n\nЭндпоинт: {endpoint}"
+        )
+
     async def stop_command(self, update: Update, context):
         """Обработчик команды /stop"""
         chat_id = update.effective_chat.id
-        if str(chat_id) in active_chats:
+        if chat_id in self.subscribers:
             self.remove_chat(chat_id)
+            self.alerts.remove_chat(chat_id)
             await update.message.reply_text("❌ Вы отписались от уведомлений")
         else:
             await update.message.reply_text("❌ Вы не были подписаны на уведомления")
@@ -326,54 +1778,105 @@ class TradingBot:
         chat_id = update.effective_chat.id
         username = update.effective_user.username
 
-        if str(chat_id) not in active_chats:
+        retry_after = self.message_limiter.check(chat_id)
+        if retry_after is not None:
+            # На поток сообщений отвечаем один раз, дальше молчим до конца ограничения
+            if self.message_limiter.notify(chat_id):
+                await update.message.reply_text(
+                    f"⏳ Слишком много сообщений, подождите {retry_after:.0f} с. Последний анализ: /analyze"
+                )
+            return
+
+        if chat_id not in self.subscribers:
             self.add_chat(chat_id, username)
-            interval_text = format_interval(ANALYSIS_INTERVAL_SECONDS)
+            interval_text = format_interval(self.subscribers.get_interval(chat_id) or ANALYSIS_INTERVAL_SECONDS)
             await update.message.reply_text(f"✅ Бот активирован! Анализ будет отправляться {interval_text}.")
             print(f"✅ Бот активирован для чата: {chat_id} (@{username})")
         else:
             await update.message.reply_text("🤖 Бот уже активен. Используйте /analyze для анализа.")
 
 
-def setup_bot_commands():
-    """Устанавливает список команд для бота"""
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/setMyCommands"
-        commands = [
-            {"command": "start", "description": "🚀 Запустить бота и подписаться на уведомления"},
-            {"command": "status", "description": "📊 Показать статус бота и количество пользователей"},
-            {"command": "analyze", "description": "🔍 Выполнить анализ криптовалют сейчас"},
-            {"command": "stop", "description": "❌ Отписаться от уведомлений"}
-        ]
-        data = {"commands": commands}
-        response = requests.post(url, json=data, timeout=10)
-        if response.status_code == 200:
-            print("✅ Команды бота установлены")
-        else:
-            print(f"❌ Ошибка установки команд: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Ошибка установки команд: {e}")
-
-def main():
-    # Устанавливаем команды бота
-    setup_bot_commands()
-    bot = TradingBot()
-
-    # Регистрируем обработчики
+def register_handlers(bot):
+    """Регистрирует обработчики команд и сообщений (общие для polling и webhook)"""
     bot.app.add_handler(CommandHandler("start", bot.start_command))
     bot.app.add_handler(CommandHandler("status", bot.status_command))
     bot.app.add_handler(CommandHandler("analyze", bot.analyze_command))
+    bot.app.add_handler(CommandHandler("interval", bot.interval_command))
+    bot.app.add_handler(CommandHandler("watch", bot.watch_command))
+    bot.app.add_handler(CommandHandler("unwatch", bot.unwatch_command))
+    bot.app.add_handler(CommandHandler("threshold", bot.threshold_command))
+    bot.app.add_handler(CommandHandler("chart", bot.chart_command))
+    bot.app.add_handler(CommandHandler("alert", bot.alert_command))
+    bot.app.add_handler(CommandHandler("metrics", bot.metrics_command))
     bot.app.add_handler(CommandHandler("stop", bot.stop_command))
     bot.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+    # Группа после основных обработчиков: срабатывает, когда ответ на обновление уже отправлен
+    bot.app.add_handler(TypeHandler(Update, bot.on_update_handled), group=1)
+
+
+def run_webhook(bot):
+    """Принимает обновления через webhook на встроенном HTTP-сервере.
+
+    Сервер проверяет секретный токен из заголовка X-Telegram-Bot-Api-Secret-Token
+    и кладет обновления в ограниченную очередь приложения. Несколько процессов
+    с одинаковыми WEBHOOK_URL и WEBHOOK_SECRET могут работать за балансировщиком.
+    """
+    bot.app.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+
+def run_worker():
+    """Воркер кластера без приема обновлений: участвует в выборе лидера и доставляет шарды"""
+    async def run():
+        bot = TradingBot(worker=True)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await bot.on_startup(None)
+        await stop.wait()
+        await bot.on_shutdown(None)
 
-    print("🤖 Trading Bot запущен!")
-    if active_chats:
-        print(f"✅ Загружено {len(active_chats)} активных чатов")
-        bot.start_scheduler()
+    asyncio.run(run())
+
+
+def main():
+    if "--worker" in sys.argv[1:]:
+        if not CLUSTER_ENABLED:
+            print("❌ Воркер работает только с CLUSTER_ENABLED=true")
+            return
+        print("🧩 Запуск воркера рассылки")
+        run_worker()
+        return
+
+    if BOT_MODE not in ("polling", "webhook"):
+        print(f"❌ Неизвестный режим BOT_MODE={BOT_MODE}, допустимо: polling, webhook")
+        return
+    if BOT_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        # Секрет должен быть общим для всех процессов за балансировщиком, поэтому не генерируется
+        print("❌ Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+        return
+
+    bot = TradingBot()
+    register_handlers(bot)
+
+    print(f"🤖 Trading Bot запущен! Режим: {BOT_MODE}")
+    total_chats = bot.subscribers.count()
+    if total_chats:
+        print(f"✅ Загружено {total_chats} активных чатов")
     else:
         print("📱 Отправьте боту /start или любое сообщение для активации")
 
-    bot.app.run_polling()
+    if BOT_MODE == "webhook":
+        run_webhook(bot)
+    else:
+        bot.app.run_polling()
 
 
 if __name__ == "__main__":